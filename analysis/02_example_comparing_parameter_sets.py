@@ -36,6 +36,8 @@ highFertGrowthRate = data_extractors.get_population_growth_rate(path.join(highFe
 #Using the run_tools functions, it's just as easy to run the test for repeat simulations:
 lowFertParams["outputDirectory"] = path.join(filepaths.modelOutputRoot, "test_fertilityRate", "low_fertility_reps");
 highFertParams["outputDirectory"] = path.join(filepaths.modelOutputRoot, "test_fertilityRate", "high_fertility_reps");
+#Consecutive calls with the same numCores reuse the same worker processes
+# (see run_tools.Runner), so there's no start up cost for the second call.
 run_tools.run_reps(lowFertParams, numReps=16, numCores=4);
 run_tools.run_reps(highFertParams, numReps=16, numCores=4);
 #extract_from_repeats will search for directory structure which indicates repeat
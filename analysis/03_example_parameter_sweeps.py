@@ -53,8 +53,14 @@ mortalityRates = [0.04, 0.05, 0.06];
 initialPopulationSizes = [4000, 5000, 6000];
 run_tools.run_sweep(multiSweepParams, ["fertilityRate", "mortalityRate", "initialPopulationSize"], [fertilityRates, mortalityRates, initialPopulationSizes], numReps=10, numCores=4);
 #Extract the data
-paramNames, paramVals, popSizeTSData = analysis_tools.extract_from_sweep(multiSweepParams["outputDirectory"], data_extractors.get_pop_size_time_series);
-paramNames, paramVals, growthRates = analysis_tools.extract_from_sweep(multiSweepParams["outputDirectory"], data_extractors.get_population_growth_rate);
+#extract_many_from_sweep applies several extractors in one pass, so each run's
+# output is only read once. numWorkers spreads the extraction over 4 processes,
+# and useCache stores each extracted value on disk so running this script again
+# doesn't need to re-read the simulation output (see
+# analysis_tools.extract_from_run_directories).
+paramNames, paramVals, sweepData = analysis_tools.extract_many_from_sweep(multiSweepParams["outputDirectory"], {"popSize": data_extractors.get_pop_size_time_series, "growthRate": data_extractors.get_population_growth_rate}, numWorkers=4, useCache=True);
+popSizeTSData = sweepData["popSize"];
+growthRates = sweepData["growthRate"];
 #A sweep over 3 parameters (with 10 repeats), this means the data extracted
 # is stored in 3+1 dimensions. 'paramNames' defines the order to index these
 # dimensions (the repeats are always last). 'paramVals' gives us the
@@ -76,7 +82,39 @@ plt.xlabel("fertility rate");
 plt.ylabel("population growth rate");
 
 
+#For large sweeps the data can instead be extracted as a 'SweepCube': a dense
+# array with one axis per parameter, then one for the repeats (and one for time
+# if the extractor returns a time series). It is stored as a memory-mapped file
+# in the sweep directory and reused next time unless the sweep has new output.
+#Axes are referred to by name and parameter axes by parameter value, so means
+# and standard deviations over a whole sweep are single array operations:
+paramNames, paramVals, growthRateCube = analysis_tools.extract_from_sweep(multiSweepParams["outputDirectory"], data_extractors.get_population_growth_rate, asCube=True);
+meanGrowthRates = growthRateCube.sel(initialPopulationSize=5000).mean("rep"); #axes: fertilityRate, mortalityRate
+plt.figure();
+for mortalityRate in paramVals["mortalityRate"]:
+    plt.plot(paramVals["fertilityRate"], meanGrowthRates.sel(mortalityRate=mortalityRate).values, label="Mortality rate = "+str(mortalityRate));
+plt.legend(loc=0);
+plt.xlabel("fertility rate");
+plt.ylabel("population growth rate");
 
 
-
-
+#####Sampled sweeps
+#The number of runs in a full sweep grows exponentially with the number of
+# parameters. A sampled sweep instead runs a fixed number of points spread
+# through a range for each parameter (here a Sobol sequence of 32 points; use
+# method="lhs" for a Latin hypercube). Integer ranges give integer values.
+sampledSweepParams = parameters.get_default_params();
+sampledSweepParams["outputDirectory"] = path.join(filepaths.modelOutputRoot, "sampled_param_sweep");
+run_tools.run_sampled_sweep(sampledSweepParams, {"fertilityRate": (0.05, 0.15), "mortalityRate": (0.04, 0.06), "initialPopulationSize": (4000, 6000)}, 32, numReps=10, numCores=4);
+#More points can then be added where the growth rate changes fastest, or
+# varies most between repeats. Only the new points are run.
+run_tools.refine_sweep(sampledSweepParams, 16, extractorFunc=data_extractors.get_population_growth_rate, numCores=4);
+#The points are scattered, so the data is returned as a list (one element per
+# point, containing the value for each repeat) with an array of the points'
+# parameter values (one column per parameter, in paramNames order).
+paramNames, points, growthRates = analysis_tools.extract_from_design(sampledSweepParams["outputDirectory"], data_extractors.get_population_growth_rate);
+plt.figure();
+plt.scatter(points[:, 0], points[:, 1], c=[np.nanmean(pointGrowthRates) for pointGrowthRates in growthRates]);
+plt.colorbar(label="population growth rate");
+plt.xlabel("fertility rate");
+plt.ylabel("mortality rate");
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque;
+import numpy as np;
+
+from model import simple_model;
+from model.simple_model import childAge, maxAge, NO_PARTNER;
+from utilities import checkpoints, profiling;
+
+######
+#Array-backed engine for the simple model (see simple_model.py for the model
+# description).
+#Agent state is held in preallocated NumPy column arrays instead of a pandas
+# DataFrame. Dead agents are marked with a tombstone rather than being removed,
+# and newborn agents fill the free slots at the end of the arrays. Storage
+# grows by doubling its capacity and tombstones are compacted away once they
+# outnumber the living agents, so each step costs O(population size) without
+# copying the whole population.
+#Every agent has a unique ID which increases monotonically and is never reused.
+# Partner links store IDs, and an id->slot index (maintained as agents are born,
+# die and are compacted) turns an ID back into a slot in O(1).
+#Slots are always kept in the order agents were created in (compaction keeps
+# the relative order), which is the same as the row order of the reference
+# DataFrame engine. This means, given the same random number generator, both
+# engines consume random numbers in exactly the same way and produce identical
+# output.
+#This is why newborn agents are always appended, and tombstones only removed
+# by compaction, rather than newborns reusing the slots of dead agents: a reused
+# slot would put a newborn before agents created earlier, so the engines would
+# no longer match. Compaction is amortised over the steps between compactions.
+#IDs (including partner links) are int64, as they're never reused so keep
+# growing over a long run, and match the DataFrame engine's columns. Slots are
+# bounded by the capacity, so the id->slot index stores them as int32 to halve
+# its size.
+
+
+#Used in the id->slot index to indicate an ID no longer belongs to a living agent
+NO_SLOT = -1;
+
+
+#Stores the state of every agent as a set of column arrays. Only slots
+# [0, size) are in use, and of these only the slots where 'alive' is True
+# contain living agents.
+#idToSlot[agentId-idBase] gives the slot of a living agent. idBase is moved
+# forward on compaction so the index only spans IDs from the oldest living agent.
+class AgentStore:
+    #Names of the per-agent column arrays.
+    columns = ("id", "age", "isFemale", "partner", "alive");
+
+    #Minimum number of tombstones before compaction is considered, to avoid
+    # compacting very small populations every step.
+    minCompactionSize = 1024;
+
+    def __init__(self, capacity):
+        capacity = max(int(capacity), 1);
+        self.id = np.zeros((capacity,), dtype=np.int64);
+        self.age = np.zeros((capacity,), dtype=np.int16);
+        self.isFemale = np.zeros((capacity,), dtype=bool);
+        self.partner = np.full((capacity,), NO_PARTNER, dtype=np.int64); #ID of partner
+        self.alive = np.zeros((capacity,), dtype=bool);
+        self.size = 0; #Number of slots in use (living agents and tombstones)
+        self.numAlive = 0;
+        self.nextId = 0;
+        self.idBase = 0;
+        self.idToSlot = np.full((capacity,), NO_SLOT, dtype=np.int32); #int32 slots, not int64 IDs (see above)
+        self.singlePools = None; #see SinglePools, only kept for incremental pairing
+
+    #Number of living agents, so len() works the same as for the DataFrame engine.
+    def __len__(self):
+        return self.numAlive;
+
+    @property
+    def capacity(self):
+        return len(self.alive);
+
+    @property
+    def numTombstones(self):
+        return self.size - self.numAlive;
+
+    #Returns the slot indices of all living agents, in creation order.
+    def live_slots(self):
+        return np.flatnonzero(self.alive[0:self.size]);
+
+    #Returns the slots of the agents with the given IDs (NO_SLOT for dead agents).
+    def slots_of(self, agentIds):
+        return self.idToSlot[np.asarray(agentIds)-self.idBase];
+
+    #Adds new (unpartnered) agents into the free slots at the end of the store.
+    #Returns the slot indices of the new agents.
+    def add(self, ages, isFemale):
+        numToAdd = len(ages);
+        if self.size + numToAdd > self.capacity:
+            self._make_room(numToAdd);
+        slots = np.arange(self.size, self.size+numToAdd);
+        self._fill_slots(slots, ages, isFemale);
+        self.size += numToAdd;
+        return slots;
+
+    #Stores new agents in the given (free) slots, giving them the next IDs in order.
+    def _fill_slots(self, slots, ages, isFemale):
+        numToAdd = len(slots);
+        newIds = np.arange(self.nextId, self.nextId+numToAdd);
+        self._reserve_ids(numToAdd);
+        self.idToSlot[newIds-self.idBase] = slots;
+        self.nextId += numToAdd;
+        self.id[slots] = newIds;
+        self.age[slots] = ages;
+        self.isFemale[slots] = isFemale;
+        self.partner[slots] = NO_PARTNER;
+        self.alive[slots] = True;
+        self.numAlive += numToAdd;
+
+    #Marks the agents in the given slots as dead (tombstones). Their partners
+    # become unpartnered, which only touches the dead agents and their partners.
+    def kill(self, slots):
+        partnerIds = self.partner[slots];
+        partnerSlots = self.slots_of(partnerIds[partnerIds != NO_PARTNER]);
+        partnerSlots = partnerSlots[partnerSlots != NO_SLOT];
+        self.partner[partnerSlots] = NO_PARTNER;
+        if self.singlePools is not None:
+            self.singlePools.add(self, partnerSlots);
+        self.partner[slots] = NO_PARTNER;
+        self.idToSlot[self.id[slots]-self.idBase] = NO_SLOT;
+        self.alive[slots] = False;
+        self.numAlive -= len(slots);
+        if self.numTombstones > max(self.numAlive, self.minCompactionSize):
+            self.compact();
+
+    #Removes tombstones by moving living agents to the front of the arrays,
+    # preserving their relative order, then rebuilds the id->slot index.
+    def compact(self):
+        live = self.alive[0:self.size].copy(); #the alive column is itself compacted below
+        for column in self.columns:
+            values = getattr(self, column);
+            values[0:self.numAlive] = values[0:self.size][live];
+        self.alive[self.numAlive:self.size] = False;
+        self.partner[self.numAlive:self.size] = NO_PARTNER;
+        self.size = self.numAlive;
+        self._rebuild_id_index(np.arange(0, self.size));
+
+    #Rebuilds the id->slot index from the slots of all living agents.
+    def _rebuild_id_index(self, liveSlots):
+        liveIds = self.id[liveSlots];
+        #IDs older than the oldest living agent can never be looked up again
+        newIdBase = liveIds.min() if len(liveIds) > 0 else self.nextId;
+        self.idToSlot[0:self.nextId-self.idBase] = NO_SLOT;
+        self.idToSlot[liveIds-newIdBase] = liveSlots;
+        self.idBase = newIdBase;
+
+    #Ensures the id->slot index can hold numToAdd more IDs, doubling its length if needed.
+    def _reserve_ids(self, numToAdd):
+        required = self.nextId+numToAdd-self.idBase;
+        if required > len(self.idToSlot):
+            newLength = len(self.idToSlot);
+            while required > newLength:
+                newLength *= 2;
+            grown = np.full((newLength,), NO_SLOT, dtype=self.idToSlot.dtype);
+            grown[0:self.nextId-self.idBase] = self.idToSlot[0:self.nextId-self.idBase];
+            self.idToSlot = grown;
+
+    #Checks the agent state is internally consistent, raising a RuntimeError if
+    # not. See simple_model.check_consistency for the partner link checks.
+    def check_consistency(self):
+        liveSlots = self.live_slots();
+        if len(liveSlots) != self.numAlive:
+            raise RuntimeError("numAlive does not match the number of living agents");
+        if np.any(self.id[liveSlots] >= self.nextId) or self._check_id_order(liveSlots) == False:
+            raise RuntimeError("Agent IDs are not unique and increasing");
+        indexedSlots = self.idToSlot[0:self.nextId-self.idBase];
+        if not np.array_equal(np.sort(indexedSlots[indexedSlots != NO_SLOT]), liveSlots):
+            raise RuntimeError("id->slot index contains entries for dead agents");
+        if not np.array_equal(self.slots_of(self.id[liveSlots]), liveSlots):
+            raise RuntimeError("id->slot index does not match the living agents");
+        partnered = liveSlots[self.partner[liveSlots] != NO_PARTNER];
+        partnerIds = self.partner[partnered];
+        if np.any(partnerIds < self.idBase) or np.any(partnerIds >= self.nextId):
+            raise RuntimeError("Partner links found pointing to dead agents");
+        partners = self.slots_of(partnerIds);
+        if np.any(partners == NO_SLOT):
+            raise RuntimeError("Partner links found pointing to dead agents");
+        if not np.array_equal(self.partner[partners], self.id[partnered]):
+            raise RuntimeError("Partner links found which are not reciprocated");
+        if np.any(self.isFemale[partners] == self.isFemale[partnered]):
+            raise RuntimeError("Partner links found between agents of the same sex");
+        if np.any(self.age[partnered] <= childAge):
+            raise RuntimeError("Partnered children found");
+        if self.singlePools is not None:
+            self.singlePools.check_consistency(self);
+
+    #Returns True if IDs of the living agents increase with their slot (i.e.
+    # slots are in creation order).
+    def _check_id_order(self, liveSlots):
+        return np.all(np.diff(self.id[liveSlots]) > 0);
+
+    #Ensures there are at least numToAdd free slots, compacting if at least
+    # half of the store is tombstones and otherwise doubling the capacity.
+    def _make_room(self, numToAdd):
+        if self.numTombstones >= self.capacity//2:
+            self.compact();
+        newCapacity = self.capacity;
+        while self.size + numToAdd > newCapacity:
+            newCapacity *= 2;
+        if newCapacity != self.capacity:
+            for column in self.columns:
+                values = getattr(self, column);
+                grown = np.full((newCapacity,), NO_PARTNER if column == "partner" else 0, dtype=values.dtype);
+                grown[0:self.size] = values[0:self.size];
+                setattr(self, column, grown);
+
+
+
+#Pools of the IDs of unpartnered adults, kept up to date as agents change
+# status so partnering doesn't have to scan the whole population each step
+# (used with the 'incrementalPairing' parameter, see pair_unmarried_agents).
+#Agents join a pool when they become adults (children are kept in one list of
+# IDs per age until then) or their partner dies, and leave when they're
+# partnered. Dead agents are only removed when a pool or list is next used.
+#IDs rather than slots are stored, as slots change when the store is compacted.
+# Pools are kept in the order agents joined them: new agents are appended, so
+# keeping a pool in order never needs a sort. The order is stored in checkpoints
+# (see get_agent_state), so a run resumed from a checkpoint gives the same
+# output as an uninterrupted run.
+class SinglePools:
+    #Builds the pools and lists of children from a scan of every agent in store.
+    #poolRanks: the position of each living agent (in slot order) in its pool,
+    #   or -1 if it isn't in one, e.g. from a checkpoint. If None the pools are
+    #   in ID order.
+    def __init__(self, store, poolRanks=None):
+        liveSlots = store.live_slots();
+        ages = store.age[liveSlots];
+        wSingleAdults = (ages > childAge) & (store.partner[liveSlots] == NO_PARTNER);
+        self.pools = [];
+        for isFemale in (False, True):
+            wPool = wSingleAdults & (store.isFemale[liveSlots] == isFemale);
+            poolSlots = liveSlots[wPool];
+            if poolRanks is not None:
+                poolSlots = poolSlots[np.argsort(poolRanks[wPool], kind="stable")];
+            self.pools.append(store.id[poolSlots]);
+        self.newSingles = [[], []]; #IDs added to each pool since it was last used
+        self.childIds = deque(store.id[liveSlots[ages == age]] for age in range(0, childAge+1)); #childIds[age]
+
+    #Returns the slots of the agents with the given IDs, or NO_SLOT for agents
+    # which have died (including IDs no longer covered by the id->slot index).
+    @staticmethod
+    def slots_of(store, agentIds):
+        slots = np.full((len(agentIds),), NO_SLOT, dtype=np.int64);
+        wIndexed = agentIds >= store.idBase;
+        slots[wIndexed] = store.slots_of(agentIds[wIndexed]);
+        return slots;
+
+    #Adds the agents in the given slots to the pool of their sex.
+    def add(self, store, slots):
+        for isFemale in (False, True):
+            self.newSingles[isFemale].append(store.id[slots[store.isFemale[slots] == isFemale]]);
+
+    #Adds newborn agents (with age 0) to the children.
+    def add_newborns(self, agentIds):
+        self.childIds[0] = np.concatenate([self.childIds[0], agentIds]);
+
+    #Called after every agent has aged by one year: children who are now adults
+    # join the pools.
+    def age(self, store):
+        newAdultSlots = self.slots_of(store, self.childIds.pop());
+        self.add(store, newAdultSlots[newAdultSlots != NO_SLOT]);
+        self.childIds.appendleft(np.zeros((0,), dtype=np.int64));
+
+    #Returns the slots of the living agents in each pool (males first), and
+    # removes dead agents from the pools.
+    def get_slots(self, store):
+        poolSlots = [];
+        for isFemale in (False, True):
+            pool = self.pools[isFemale];
+            if len(self.newSingles[isFemale]) > 0:
+                pool = np.concatenate([pool]+self.newSingles[isFemale]);
+            slots = self.slots_of(store, pool);
+            self.pools[isFemale] = pool[slots != NO_SLOT];
+            self.newSingles[isFemale] = [];
+            poolSlots.append(slots[slots != NO_SLOT]);
+        return poolSlots;
+
+    #Removes the agents at the given positions (in the order returned by
+    # get_slots) from the pool of the given sex.
+    def remove(self, isFemale, positions):
+        keep = np.ones((len(self.pools[isFemale]),), dtype=bool);
+        keep[positions] = False;
+        self.pools[isFemale] = self.pools[isFemale][keep];
+
+    #Returns the position of each living agent (in slot order) in its pool, or
+    # -1 if it isn't in one (see __init__).
+    def get_ranks(self, store):
+        ranks = np.full((store.size,), -1, dtype=np.int64);
+        for slots in self.get_slots(store):
+            ranks[slots] = np.arange(0, len(slots));
+        return ranks[store.live_slots()];
+
+    #Checks the pools contain exactly the living unpartnered adults, raising a
+    # RuntimeError if not.
+    def check_consistency(self, store):
+        liveSlots = store.live_slots();
+        singleAdults = liveSlots[(store.age[liveSlots] > childAge) & (store.partner[liveSlots] == NO_PARTNER)];
+        males, females = self.get_slots(store);
+        if not (np.array_equal(np.sort(males), singleAdults[store.isFemale[singleAdults] == False]) and np.array_equal(np.sort(females), singleAdults[store.isFemale[singleAdults]])):
+            raise RuntimeError("Pools of unpartnered adults don't match the agents");
+
+
+#The functions below mirror those in simple_model.py, but operate on an AgentStore.
+
+#Initialise numAgents agents. Returns an AgentStore containing agent state
+def initialise_agents(numAgents, rng):
+    store = AgentStore(numAgents);
+    ages = rng.integers(low=0, high=maxAge, size=numAgents);
+    isFemale = rng.choice([True, False], size=numAgents, replace=True);
+    store.add(ages, isFemale);
+    return store;
+
+
+#Returns the (engine independent) agent state of the living agents, see
+# simple_model.make_agent_state. If the store keeps pools of unpartnered adults
+# the state also contains each agent's position in its pool ("poolRank"), which
+# other engines ignore.
+def get_agent_state(store):
+    liveSlots = store.live_slots();
+    agentState = simple_model.make_agent_state(store.id[liveSlots], store.age[liveSlots], store.isFemale[liveSlots], store.partner[liveSlots]);
+    if store.singlePools is not None:
+        agentState["poolRank"] = store.singlePools.get_ranks(store);
+    return agentState;
+
+
+#Returns an AgentStore containing the agents in agentState.
+def restore_agents(agentState):
+    store = AgentStore(len(agentState["age"]));
+    slots = store.add(agentState["age"], agentState["isFemale"]);
+    store.partner[slots] = simple_model.get_partner_ids(agentState, store.id[slots]);
+    return store;
+
+
+#Performs partnering of unmarried adults.
+#If the store keeps pools of unpartnered adults (see SinglePools) they are used
+# instead of scanning every agent (see pair_from_pools).
+def pair_unmarried_agents(store, rng):
+    if store.singlePools is not None:
+        return pair_from_pools(store, rng);
+    n = store.size;
+    wUnmarriedAdults = store.alive[0:n] & (store.age[0:n] > childAge) & (store.partner[0:n] == NO_PARTNER);
+    unmarriedFemales = np.flatnonzero(wUnmarriedAdults & store.isFemale[0:n]);
+    unmarriedMales = np.flatnonzero(wUnmarriedAdults & (store.isFemale[0:n] == False));
+
+    rng.shuffle(unmarriedFemales);
+    rng.shuffle(unmarriedMales);
+
+    numToMarry = min(len(unmarriedFemales), len(unmarriedMales));
+
+    store.partner[unmarriedFemales[0:numToMarry]] = store.id[unmarriedMales[0:numToMarry]];
+    store.partner[unmarriedMales[0:numToMarry]] = store.id[unmarriedFemales[0:numToMarry]];
+    return store;
+
+
+
+#Partnering using the store's pools of unpartnered adults. Every agent of the
+# less common sex is partnered with a different agent of the other sex, drawn
+# uniformly at random from its pool: the same distribution of partnerships as
+# shuffling both sexes (as pair_unmarried_agents does), but the cost only
+# depends on the size of the pools, not the whole population. Random numbers
+# are used differently, so output differs from pair_unmarried_agents for the
+# same seed.
+def pair_from_pools(store, rng):
+    pools = store.singlePools;
+    males, females = pools.get_slots(store);
+    numToMarry = min(len(females), len(males));
+    isFemaleDrawn = len(females) > len(males); #the more common sex is drawn from
+    drawnPositions = rng.choice(max(len(females), len(males)), size=numToMarry, replace=False);
+    if isFemaleDrawn:
+        pairedFemales, pairedMales = females[drawnPositions], males;
+    else:
+        pairedFemales, pairedMales = females, males[drawnPositions];
+    store.partner[pairedFemales] = store.id[pairedMales];
+    store.partner[pairedMales] = store.id[pairedFemales];
+    pools.remove(isFemaleDrawn, drawnPositions);
+    pools.remove(isFemaleDrawn == False, np.arange(0, numToMarry));
+    return store;
+
+
+#Reproduction, returns number of births. add_newly_born_agents handles creation
+# of new agents.
+def do_reproduction(store, fertilityRate, rng):
+    n = store.size;
+    canReproduce = np.flatnonzero(store.alive[0:n] & store.isFemale[0:n] & (store.partner[0:n] != NO_PARTNER));
+    reproducing = canReproduce[rng.random(len(canReproduce)) < simple_model.get_agent_rates(fertilityRate, store.age, store.isFemale, canReproduce)];
+    numBirths = len(reproducing);
+    store = add_newly_born_agents(store, reproducing, rng);
+    return store, numBirths;
+
+
+#Checks for agent death and marks dead agents as tombstones.
+#Partners of dead agents become unpartnered.
+#Returns number of deaths.
+def do_mortality(store, mortalityRate, rng):
+    liveSlots = store.live_slots();
+    wDying = rng.random(len(liveSlots)) < simple_model.get_agent_rates(mortalityRate, store.age, store.isFemale, liveSlots);
+    store.kill(liveSlots[wDying]);
+    return store, np.sum(wDying);
+
+
+#Increments the age of all agents (tombstones included, which is cheaper than
+# selecting only the living agents and has no effect on them).
+def age_agents(store):
+    store.age[0:store.size] += 1;
+    if store.singlePools is not None:
+        store.singlePools.age(store);
+    return store;
+
+
+#Creates newly born agents, given the slots of the reproducing agents.
+def add_newly_born_agents(store, reproducingSlots, rng):
+    numToAdd = len(reproducingSlots);
+    isFemale = rng.choice([True, False], size=numToAdd, replace=True);
+    slots = store.add(np.zeros((numToAdd,), dtype=np.int16), isFemale);
+    if store.singlePools is not None:
+        store.singlePools.add_newborns(store.id[slots]);
+    return store;
+
+
+
+#Runs the main simulation loop (see simple_model.simulate). Returns the time
+# series of population size, deaths and births.
+def simulate(params, rng, verbose=False, stopping=None, checkpointer=None, profiler=profiling.nullProfiler):
+    if stopping is None:
+        stopping = simple_model.StoppingCriteria(params);
+    if checkpointer is None:
+        checkpointer = checkpoints.Checkpointer(params);
+    initialPopulationSize = params["initialPopulationSize"];
+    tMax = params["maxTime"];
+    fertilityRate, mortalityRate = simple_model.get_rates(params);
+
+    agentState, (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), startStep = checkpointer.start(rng, stopping);
+    if agentState is None:
+        population = initialise_agents(initialPopulationSize, rng);
+    else:
+        population = restore_agents(agentState);
+    if params.get("incrementalPairing"):
+        population.singlePools = SinglePools(population, agentState.get("poolRank") if agentState is not None else None);
+    profiler.tick("initialise");
+
+    for t in range(startStep, tMax):
+        if verbose:
+            print("t = ", t, " Population size: ", len(population));
+
+        population = pair_unmarried_agents(population, rng);
+        profiler.tick("pairing");
+        population, numBirths = do_reproduction(population, fertilityRate, rng);
+        profiler.tick("reproduction");
+        population, numDeaths = do_mortality(population, mortalityRate, rng);
+        profiler.tick("mortality");
+        population = age_agents(population);
+        profiler.tick("ageing");
+        if simple_model.checkConsistency:
+            population.check_consistency();
+
+        deathsTimeSeries.append(numDeaths);
+        birthsTimeSeries.append(numBirths);
+        popSizeTimeSeries.append(len(population));
+
+        stopped = stopping.check(popSizeTimeSeries);
+        if stopped == False and checkpointer.is_due(t):
+            checkpointer.save(t, get_agent_state(population), (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), rng, stopping);
+        profiler.tick("bookkeeping");
+        profiler.end_step(len(population));
+
+        if stopped:
+            break;
+
+    return popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries;
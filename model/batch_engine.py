@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+
+from model import simple_model;
+from model.simple_model import childAge, maxAge, NO_PARTNER;
+from model.agent_store import AgentStore, NO_SLOT;
+from utilities import checkpoints, profiling;
+
+######
+#Batched engine for the simple model (see simple_model.py for the model
+# description).
+#Runs many independent repeats (replicates) of the same parameter set together
+# in one AgentStore, with an extra column recording which replicate each agent
+# belongs to. Each step of the model is then a handful of NumPy operations over
+# all replicates at once instead of one set of operations per replicate.
+#Every replicate has its own random number generator, created in the same way
+# as for a standalone run. Within a replicate agents are visited in creation order (the
+# same order as the agent_store and DataFrame engines) so each replicate's
+# output is identical to a standalone run with the same seed.
+
+
+#AgentStore where each replicate has its own contiguous region of slots:
+# replicate r uses slots [r*regionCapacity, r*regionCapacity+regionSizes[r]).
+#Because regions are in replicate order, and agents within a region are in
+# creation order, any set of slots found by scanning the store (e.g. with
+# np.flatnonzero) is already grouped by replicate. This avoids having to sort
+# agents by replicate every step.
+#All regions are grown together (doubling regionCapacity) when any region runs
+# out of free slots.
+class BatchAgentStore(AgentStore):
+    columns = AgentStore.columns + ("rep",);
+
+    def __init__(self, regionCapacity, numReps):
+        regionCapacity = max(int(regionCapacity), 1);
+        super().__init__(regionCapacity*numReps);
+        self.numReps = numReps;
+        self.regionCapacity = regionCapacity;
+        self.regionSizes = np.zeros((numReps,), dtype=np.int64);
+        self.rep = np.repeat(np.arange(0, numReps, dtype=np.int32), regionCapacity);
+        self.size = self.capacity; #The whole store is scanned, including free slots
+
+    @property
+    def numTombstones(self):
+        return np.sum(self.regionSizes) - self.numAlive;
+
+    #Adds new (unpartnered) agents to the end of their replicate's region.
+    #reps gives the replicate of each new agent and must be in increasing order.
+    def add(self, ages, isFemale, reps):
+        numToAdd = np.bincount(reps, minlength=self.numReps);
+        if np.any(self.regionSizes + numToAdd > self.regionCapacity):
+            self._make_room(numToAdd);
+        positionInGroup = np.arange(len(reps)) - np.repeat(np.cumsum(numToAdd)-numToAdd, numToAdd);
+        slots = reps*self.regionCapacity + self.regionSizes[reps] + positionInGroup;
+        self._fill_slots(slots, ages, isFemale);
+        self.regionSizes += numToAdd;
+        return slots;
+
+    #Moves living agents to the start of their region, preserving their order.
+    def compact(self):
+        liveSlots, offsets = self.group_by_rep(self.live_slots());
+        counts = np.diff(offsets);
+        newSlots = np.repeat(np.arange(0, self.numReps)*self.regionCapacity, counts) + np.arange(len(liveSlots)) - np.repeat(offsets[0:-1], counts);
+        for column in self.columns:
+            if column != "rep":
+                values = getattr(self, column);
+                values[newSlots] = values[liveSlots];
+        self.alive[:] = False;
+        self.alive[newSlots] = True;
+        self.regionSizes = counts;
+        self._rebuild_id_index(newSlots);
+
+    #Ensures each replicate's region has room for numToAdd[r] more agents,
+    # compacting if at least half of the used slots are tombstones and otherwise
+    # doubling the capacity of every region.
+    def _make_room(self, numToAdd):
+        if self.numTombstones >= np.sum(self.regionSizes)//2:
+            self.compact();
+        newRegionCapacity = self.regionCapacity;
+        while np.any(self.regionSizes + numToAdd > newRegionCapacity):
+            newRegionCapacity *= 2;
+        if newRegionCapacity == self.regionCapacity:
+            return;
+        
+        oldSlots = np.arange(0, self.capacity);
+        newSlots = self.rep*newRegionCapacity + oldSlots % self.regionCapacity;
+        for column in self.columns:
+            if column != "rep":
+                values = getattr(self, column);
+                grown = np.full((newRegionCapacity*self.numReps,), NO_PARTNER if column == "partner" else 0, dtype=values.dtype);
+                grown[newSlots] = values;
+                setattr(self, column, grown);
+        indexed = self.idToSlot[0:self.nextId-self.idBase];
+        indexed[indexed != NO_SLOT] = newSlots[indexed[indexed != NO_SLOT]];
+        self.rep = np.repeat(np.arange(0, self.numReps, dtype=np.int32), newRegionCapacity);
+        self.regionCapacity = newRegionCapacity;
+        self.size = self.capacity;
+
+    #Returns the number of living agents in each replicate.
+    def count_by_rep(self):
+        return np.diff(self.group_by_rep(self.live_slots())[1]);
+
+    #Groups the given slots (in increasing order) by replicate. Returns the slots
+    # and the offsets of the start of each replicate's group (so group r is
+    # slots[offsets[r]:offsets[r+1]]). Within a group slots are in creation order.
+    def group_by_rep(self, slots):
+        offsets = np.searchsorted(slots, np.arange(0, self.numReps+1)*self.regionCapacity);
+        return slots, offsets;
+
+    #IDs only increase with slot within each region, and every agent must be in
+    # its replicate's region.
+    def _check_id_order(self, liveSlots):
+        if np.any(self.rep[liveSlots] != liveSlots // self.regionCapacity):
+            return False;
+        if np.any(liveSlots % self.regionCapacity >= self.regionSizes[self.rep[liveSlots]]):
+            return False;
+        sameRegion = self.rep[liveSlots[1:]] == self.rep[liveSlots[0:-1]];
+        return np.all(np.diff(self.id[liveSlots])[sameRegion] > 0);
+
+
+#Returns the first counts[r] elements of each replicate's group.
+def take_first_in_groups(groupedSlots, offsets, counts):
+    groupSizes = np.diff(offsets);
+    positionInGroup = np.arange(len(groupedSlots)) - np.repeat(offsets[0:-1], groupSizes);
+    return groupedSlots[positionInGroup < np.repeat(counts, groupSizes)];
+
+
+#Draws uniform random numbers for each replicate's group of slots, each from
+# that replicate's own random number stream.
+def draw_random_by_rep(offsets, rngs):
+    randomNumbers = np.empty((offsets[-1],));
+    for r, rng in enumerate(rngs):
+        randomNumbers[offsets[r]:offsets[r+1]] = rng.random(offsets[r+1]-offsets[r]);
+    return randomNumbers;
+
+
+
+#The functions below mirror those in agent_store.py, but take a list of random
+# number generators with one per replicate.
+
+#Initialise numAgents agents for each replicate.
+def initialise_agents(numAgents, rngs):
+    store = BatchAgentStore(numAgents, len(rngs));
+    ages = [];
+    isFemale = [];
+    for rng in rngs:
+        ages.append(rng.integers(low=0, high=maxAge, size=numAgents));
+        isFemale.append(rng.choice([True, False], size=numAgents, replace=True));
+    store.add(np.concatenate(ages), np.concatenate(isFemale), np.repeat(np.arange(0, len(rngs)), numAgents));
+    return store;
+
+
+#Returns the (engine independent) agent state of each replicate, see
+# simple_model.make_agent_state.
+def get_agent_states(store):
+    liveSlots, offsets = store.group_by_rep(store.live_slots());
+    states = [];
+    for r in range(0, store.numReps):
+        slots = liveSlots[offsets[r]:offsets[r+1]];
+        states.append(simple_model.make_agent_state(store.id[slots], store.age[slots], store.isFemale[slots], store.partner[slots]));
+    return states;
+
+
+#Returns a BatchAgentStore containing the agents in each replicate's agent state.
+def restore_agents(agentStates):
+    counts = np.array([len(agentState["age"]) for agentState in agentStates]);
+    store = BatchAgentStore(max(np.max(counts), 1), len(agentStates));
+    reps = np.repeat(np.arange(0, len(agentStates)), counts);
+    slots = store.add(np.concatenate([agentState["age"] for agentState in agentStates]),
+                      np.concatenate([agentState["isFemale"] for agentState in agentStates]), reps);
+    offsets = np.concatenate([[0], np.cumsum(counts)]);
+    for r, agentState in enumerate(agentStates):
+        repSlots = slots[offsets[r]:offsets[r+1]];
+        store.partner[repSlots] = simple_model.get_partner_ids(agentState, store.id[repSlots]);
+    return store;
+
+
+#Performs partnering of unmarried adults within each replicate.
+def pair_unmarried_agents(store, rngs):
+    n = store.size;
+    unmarriedAdults = np.flatnonzero(store.alive[0:n] & (store.age[0:n] > childAge) & (store.partner[0:n] == NO_PARTNER));
+    wFemale = store.isFemale[unmarriedAdults];
+    unmarriedFemales, femaleOffsets = store.group_by_rep(unmarriedAdults[wFemale]);
+    unmarriedMales, maleOffsets = store.group_by_rep(unmarriedAdults[wFemale == False]);
+
+    for r, rng in enumerate(rngs):
+        rng.shuffle(unmarriedFemales[femaleOffsets[r]:femaleOffsets[r+1]]);
+        rng.shuffle(unmarriedMales[maleOffsets[r]:maleOffsets[r+1]]);
+
+    numToMarry = np.minimum(np.diff(femaleOffsets), np.diff(maleOffsets));
+    marryingFemales = take_first_in_groups(unmarriedFemales, femaleOffsets, numToMarry);
+    marryingMales = take_first_in_groups(unmarriedMales, maleOffsets, numToMarry);
+
+    store.partner[marryingFemales] = store.id[marryingMales];
+    store.partner[marryingMales] = store.id[marryingFemales];
+    return store;
+
+
+#Reproduction, returns the number of births in each replicate.
+def do_reproduction(store, fertilityRate, rngs):
+    n = store.size;
+    canReproduce, offsets = store.group_by_rep(np.flatnonzero(store.alive[0:n] & store.isFemale[0:n] & (store.partner[0:n] != NO_PARTNER)));
+    reproducing = canReproduce[draw_random_by_rep(offsets, rngs) < simple_model.get_agent_rates(fertilityRate, store.age, store.isFemale, canReproduce)];
+    numBirths = np.bincount(store.rep[reproducing], minlength=store.numReps);
+    store = add_newly_born_agents(store, numBirths, rngs);
+    return store, numBirths;
+
+
+#Checks for agent death and marks dead agents as tombstones.
+#Returns the number of deaths in each replicate.
+def do_mortality(store, mortalityRate, rngs):
+    liveSlots, offsets = store.group_by_rep(store.live_slots());
+    dying = liveSlots[draw_random_by_rep(offsets, rngs) < simple_model.get_agent_rates(mortalityRate, store.age, store.isFemale, liveSlots)];
+    numDeaths = np.bincount(store.rep[dying], minlength=store.numReps);
+    store.kill(dying);
+    return store, numDeaths;
+
+
+#Increments the age of all agents.
+def age_agents(store):
+    store.age[0:store.size] += 1;
+    return store;
+
+
+#Creates numToAdd[r] newly born agents in each replicate r.
+def add_newly_born_agents(store, numToAdd, rngs):
+    isFemale = np.concatenate([rng.choice([True, False], size=numToAdd[r], replace=True) for r, rng in enumerate(rngs)]);
+    reps = np.repeat(np.arange(0, store.numReps), numToAdd);
+    store.add(np.zeros((len(reps),), dtype=np.int16), isFemale, reps);
+    return store;
+
+
+
+#Runs the main simulation loop for one replicate per random number generator
+# in rngs (see simple_model.simulate). Returns a list containing the time series
+# of population size, deaths and births for each replicate.
+#A replicate stops recording output once it goes extinct (or meets another of
+# its stopping criteria), exactly as a standalone run would stop. The agents of
+# replicates stopped early are removed, so they aren't simulated any further.
+#The time and memory budgets (see simple_model.StoppingCriteria) apply to the
+# whole batch, so stop every replicate still running when they're used up.
+#stoppings: the StoppingCriteria of each replicate (created from params if None).
+#checkpointers: the Checkpointer of each replicate (see checkpoints.py). All
+#   replicates save their checkpoints after the same time steps.
+#profiler: records the time spent in each phase for the whole batch (see profiling.py).
+def simulate_batch(params, rngs, verbose=False, stoppings=None, checkpointers=None, profiler=profiling.nullProfiler):
+    if stoppings is None:
+        stoppings = [simple_model.StoppingCriteria(params) for rng in rngs];
+    if checkpointers is None:
+        checkpointers = [checkpoints.Checkpointer(params) for rng in rngs];
+    initialPopulationSize = params["initialPopulationSize"];
+    tMax = params["maxTime"];
+    fertilityRate, mortalityRate = simple_model.get_rates(params);
+
+    agentStates, outputs, startStep = checkpoints.start_batch(checkpointers, rngs, stoppings);
+    active = np.array([stopping.reason is None for stopping in stoppings]);
+
+    if agentStates is None:
+        population = initialise_agents(initialPopulationSize, rngs);
+    else:
+        population = restore_agents(agentStates);
+    popSizes = population.count_by_rep();
+    profiler.tick("initialise");
+
+    for t in range(startStep, tMax):
+        if verbose:
+            print("t = ", t, " Population size: ", len(population), " Active replicates: ", np.sum(active));
+
+        population = pair_unmarried_agents(population, rngs);
+        profiler.tick("pairing");
+        population, numBirths = do_reproduction(population, fertilityRate, rngs);
+        profiler.tick("reproduction");
+        population, numDeaths = do_mortality(population, mortalityRate, rngs);
+        profiler.tick("mortality");
+        population = age_agents(population);
+        profiler.tick("ageing");
+        if simple_model.checkConsistency:
+            population.check_consistency();
+
+        popSizes = popSizes + numBirths - numDeaths;
+        for r in np.flatnonzero(active):
+            popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries = outputs[r];
+            popSizeTimeSeries.append(popSizes[r]);
+            deathsTimeSeries.append(numDeaths[r]);
+            birthsTimeSeries.append(numBirths[r]);
+
+        #Replicates which have gone extinct (or met another stopping
+        # criterion) stop recording output
+        budgetReason = stoppings[0].check_budget();
+        stopped = [];
+        for r in np.flatnonzero(active):
+            reason = stoppings[r].check_population(outputs[r][0]);
+            if reason is None:
+                reason = budgetReason;
+            if reason is not None:
+                stoppings[r].stop(reason, t);
+                active[r] = False;
+                stopped.append(r);
+        if np.any(popSizes[stopped] > 0):
+            liveSlots, offsets = population.group_by_rep(population.live_slots());
+            population.kill(np.concatenate([liveSlots[offsets[r]:offsets[r+1]] for r in stopped]));
+            popSizes[stopped] = 0;
+        if np.any(active) and checkpointers[0].is_due(t):
+            for r, agentState in enumerate(get_agent_states(population)):
+                checkpointers[r].save(t, agentState, outputs[r], rngs[r], stoppings[r]);
+        profiler.tick("bookkeeping");
+        profiler.end_step(len(population));
+
+        if np.any(active) == False:
+            break;
+
+    return outputs;
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+
+from model import simple_model;
+from model.simple_model import childAge, maxAge, NO_PARTNER;
+from utilities import checkpoints, profiling;
+
+######
+#Cohort (aggregate) engine for the simple model (see simple_model.py for the
+# model description).
+#Every agent of the same age and sex behaves identically: mortality and
+# fertility are fixed probabilities, and partnering only depends on the number
+# of unpartnered adults of each sex. So instead of one row per agent, the
+# population is stored as counts, and each step draws how many agents in each
+# group partner, reproduce and die from the binomial (or multinomial)
+# distribution of the sum of their individual random draws.
+#Age only matters while agents are children (age <= childAge), so children are
+# counted by age and sex, and adults only by sex and partnered status. Every
+# partnered adult is in a couple, so couples are counted rather than partnered
+# agents: when one partner dies the other joins the unpartnered adults.
+#Each step costs the same regardless of the population size, so very large
+# populations (billions of agents) take milliseconds to simulate.
+#Age and sex specific rate schedules (see simple_model.get_rates) aren't
+# supported, as adults aren't counted by age.
+#Output has the same distribution as the agent based engines, but isn't
+# identical for the same seed, as random numbers are used differently (see
+# tests/test_cohort_engine.py for the statistical comparison).
+
+FEMALE = 1; #Column of females in the count arrays (males are column 0)
+
+
+#Counts of agents in each group:
+#children[age, sex]: children by age (0 to childAge) and sex.
+#singleAdults[sex]: unpartnered adults by sex.
+#couples: number of partnered couples (one adult of each sex).
+class Cohorts:
+    def __init__(self):
+        self.children = np.zeros((childAge+1, 2), dtype=np.int64);
+        self.singleAdults = np.zeros((2,), dtype=np.int64);
+        self.couples = 0;
+
+    #Number of living agents, so len() works the same as for the agent engines.
+    def __len__(self):
+        return int(np.sum(self.children)+np.sum(self.singleAdults)+2*self.couples);
+
+    #Checks the counts are consistent, raising a RuntimeError if not.
+    def check_consistency(self):
+        if np.any(self.children < 0) or np.any(self.singleAdults < 0) or self.couples < 0:
+            raise RuntimeError("Negative number of agents found");
+
+    #Returns the counts as a dictionary of arrays, which is stored in
+    # checkpoints in place of the agent state. Only the cohort engine can
+    # restore it (see restore_cohorts).
+    def get_state(self):
+        return {"children": self.children.copy(), "singleAdults": self.singleAdults.copy(), "couples": np.array([self.couples], dtype=np.int64)};
+
+
+#Initialise numAgents agents, with ages and sexes drawn in the same way as
+# simple_model.initialise_agents. Returns the Cohorts.
+def initialise_cohorts(numAgents, rng):
+    cohorts = Cohorts();
+    counts = rng.multinomial(numAgents, np.full((2*maxAge,), 1.0/(2*maxAge))).reshape(maxAge, 2);
+    cohorts.children[:] = counts[0:childAge+1];
+    cohorts.singleAdults[:] = np.sum(counts[childAge+1:], axis=0);
+    return cohorts;
+
+
+#Returns the Cohorts of an agent state: either saved by this engine (see
+# Cohorts.get_state), or the agents of another engine (see
+# simple_model.make_agent_state, e.g. a warm start from an agent based burn in).
+def restore_cohorts(agentState):
+    cohorts = Cohorts();
+    if "children" in agentState:
+        cohorts.children[:] = agentState["children"];
+        cohorts.singleAdults[:] = agentState["singleAdults"];
+        cohorts.couples = int(agentState["couples"][0]);
+        return cohorts;
+
+    ages, isFemale, partners = agentState["age"], agentState["isFemale"].astype(np.int64), agentState["partner"];
+    wChild = ages <= childAge;
+    cohorts.children[:] = np.bincount(ages[wChild]*2+isFemale[wChild], minlength=2*(childAge+1)).reshape(childAge+1, 2);
+    cohorts.singleAdults[:] = np.bincount(isFemale[(wChild == False) & (partners == NO_PARTNER)], minlength=2);
+    cohorts.couples = int(np.sum((isFemale == FEMALE) & (partners != NO_PARTNER)));
+    return cohorts;
+
+
+
+#The functions below mirror those in simple_model.py, but operate on Cohorts.
+
+#Performs partnering of unmarried adults: as many couples form as there are
+# unpartnered adults of the less common sex.
+def pair_unmarried_agents(cohorts):
+    numToMarry = np.min(cohorts.singleAdults);
+    cohorts.singleAdults -= numToMarry;
+    cohorts.couples += int(numToMarry);
+    return cohorts;
+
+
+#Reproduction, returns number of births. Each couple reproduces with
+# probability fertilityRate, and each newborn is female with probability 0.5.
+def do_reproduction(cohorts, fertilityRate, rng):
+    numBirths = rng.binomial(cohorts.couples, fertilityRate);
+    numFemaleBirths = rng.binomial(numBirths, 0.5);
+    cohorts.children[0] += [numBirths-numFemaleBirths, numFemaleBirths];
+    return cohorts, numBirths;
+
+
+#Mortality, returns number of deaths. Every agent (including newborns) dies with
+# probability mortalityRate. Couples are split by which partners survive: the
+# survivor of a couple where one partner dies becomes unpartnered.
+def do_mortality(cohorts, mortalityRate, rng):
+    survival = 1.0-mortalityRate;
+    survivingChildren = rng.binomial(cohorts.children, survival);
+    survivingSingleAdults = rng.binomial(cohorts.singleAdults, survival);
+    bothSurvive, maleSurvives, femaleSurvives, neitherSurvive = rng.multinomial(cohorts.couples, [survival*survival, survival*mortalityRate, mortalityRate*survival, mortalityRate*mortalityRate]);
+    numDeaths = np.sum(cohorts.children-survivingChildren) + np.sum(cohorts.singleAdults-survivingSingleAdults) + maleSurvives + femaleSurvives + 2*neitherSurvive;
+    cohorts.children[:] = survivingChildren;
+    cohorts.singleAdults[:] = survivingSingleAdults + [maleSurvives, femaleSurvives];
+    cohorts.couples = int(bothSurvive);
+    return cohorts, numDeaths;
+
+
+#Increments the age of all living agents. Children older than childAge become
+# unpartnered adults.
+def age_agents(cohorts):
+    cohorts.singleAdults += cohorts.children[childAge];
+    cohorts.children[1:] = cohorts.children[0:-1].copy();
+    cohorts.children[0] = 0;
+    return cohorts;
+
+
+
+#Runs the main simulation loop (see simple_model.simulate). Returns the time
+# series of population size, deaths and births.
+def simulate(params, rng, verbose=False, stopping=None, checkpointer=None, profiler=profiling.nullProfiler):
+    if stopping is None:
+        stopping = simple_model.StoppingCriteria(params);
+    if checkpointer is None:
+        checkpointer = checkpoints.Checkpointer(params);
+    initialPopulationSize = params["initialPopulationSize"];
+    tMax = params["maxTime"];
+    if params.get("fertilitySchedule") is not None or params.get("mortalitySchedule") is not None:
+        raise ValueError("The cohort engine doesn't support rate schedules (fertilitySchedule, mortalitySchedule)");
+    fertilityRate = params["fertilityRate"];
+    mortalityRate = params["mortalityRate"];
+
+    agentState, (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), startStep = checkpointer.start(rng, stopping);
+    if agentState is None:
+        population = initialise_cohorts(initialPopulationSize, rng);
+    else:
+        population = restore_cohorts(agentState);
+    profiler.tick("initialise");
+
+    for t in range(startStep, tMax):
+        if verbose:
+            print("t = ", t, " Population size: ", len(population));
+
+        population = pair_unmarried_agents(population);
+        profiler.tick("pairing");
+        population, numBirths = do_reproduction(population, fertilityRate, rng);
+        profiler.tick("reproduction");
+        population, numDeaths = do_mortality(population, mortalityRate, rng);
+        profiler.tick("mortality");
+        population = age_agents(population);
+        profiler.tick("ageing");
+        if simple_model.checkConsistency:
+            population.check_consistency();
+
+        deathsTimeSeries.append(int(numDeaths));
+        birthsTimeSeries.append(int(numBirths));
+        popSizeTimeSeries.append(len(population));
+
+        stopped = stopping.check(popSizeTimeSeries);
+        if stopped == False and checkpointer.is_due(t):
+            checkpointer.save(t, population.get_state(), (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), rng, stopping);
+        profiler.tick("bookkeeping");
+        profiler.end_step(len(population));
+
+        if stopped:
+            break;
+
+    return popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries;
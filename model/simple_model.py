@@ -3,10 +3,13 @@
 
 import pandas as pd;
 import numpy as np;
-from os import path, makedirs;
-import json;
+import time;
+import sys;
+import os;
+from os import path;
 
-from utilities import status_codes;
+from utilities import status_codes, output_formats, checkpoints, profiling, rate_schedules;
+from utilities.run_results import RunResult;
 
 ######
 #A simple example agent-based model.
@@ -16,6 +19,8 @@ from utilities import status_codes;
 #Partnered agents reproduce up to once per time step with a fixed probability.
 #On reproduction a new unpartnered agent, age 0 and random sex is added.
 #Mortality occurs with a fixed probability.
+#Alternatively the probabilities of reproduction and mortality can depend on
+# age and sex, given by rate schedules (see get_rates).
 #Output: time series of population size, number of death, and number of births.
 
 
@@ -25,26 +30,44 @@ childAge = 14; #Age of transition from child to adult (children can't form partn
 maxAge = 85; #Only used for generating the initial population
 NO_PARTNER = -1; #Used to indicate an agent has no partner
 
+#Identifies the version of the model's behaviour. Change this whenever a change
+# to the model changes its output for the same parameters and seed, so results
+# cached from earlier versions are no longer used (see result_cache.py).
+modelVersion = "1";
+
+#When True every simulation step is followed by a full check of the agent
+# state (see check_consistency). This is slow, so is only intended for tests.
+checkConsistency = False;
+
 
 #Initialise numAgents agents. Returns a pandas data frame containing agent state
-def initialise_agents(numAgents):
-    agents = pd.DataFrame();
-    #agents.index = np.arange(0, numAgents); #id
-    agents["age"] = np.random.randint(low=0, high=maxAge, size=numAgents);
-    agents["isFemale"] = np.random.choice([True, False], size=numAgents, replace=True);
+#The index holds each agent's ID. IDs increase monotonically and are never
+# reused, so they can be used to refer to other agents (e.g. partners).
+def initialise_agents(numAgents, rng):
+    agents = pd.DataFrame(index=np.arange(0, numAgents)); #id
+    agents["age"] = rng.integers(low=0, high=maxAge, size=numAgents);
+    agents["isFemale"] = rng.choice([True, False], size=numAgents, replace=True);
     agents["partner"] = np.full((numAgents,), NO_PARTNER);
+    agents.attrs["nextId"] = numAgents;
     return agents;
 
 
+#Returns the ID to give to the next newly created agent.
+def get_next_id(agents):
+    if "nextId" in agents.attrs:
+        return agents.attrs["nextId"];
+    return agents.index.max()+1 if len(agents) > 0 else 0;
+
+
 #Performs partnering of unmarried adults.
-def pair_unmarried_agents(agents):
+def pair_unmarried_agents(agents, rng):
     wUnmarriedFemales = agents["isFemale"] & (agents["age"] > childAge) & (agents["partner"] == NO_PARTNER);
     unmarriedFemales = agents.index[wUnmarriedFemales].to_numpy();
     wUnmarriedMales = (agents["isFemale"] == False) & (agents["age"] > childAge) & (agents["partner"] == NO_PARTNER);
     unmarriedMales = agents.index[wUnmarriedMales].to_numpy();
     
-    np.random.shuffle(unmarriedFemales);
-    np.random.shuffle(unmarriedMales);
+    rng.shuffle(unmarriedFemales);
+    rng.shuffle(unmarriedMales);
     
     numToMarry = min(len(unmarriedFemales), len(unmarriedMales));
     
@@ -55,19 +78,29 @@ def pair_unmarried_agents(agents):
 
 #Reproduction, returns number of births. add_newly_born_agents handles creation
 # of new agents.
-def do_reproduction(agents, fertilityRate):
-    canReproduceIds = agents.index[agents["isFemale"] & (agents["partner"] != NO_PARTNER)];
-    reproducing = canReproduceIds[np.random.random(len(canReproduceIds)) < fertilityRate];
+#fertilityRate: the probability of reproducing, or a table of rates by the
+# mother's age (see get_rates).
+def do_reproduction(agents, fertilityRate, rng):
+    wCanReproduce = (agents["isFemale"] & (agents["partner"] != NO_PARTNER)).to_numpy();
+    canReproduceIds = agents.index[wCanReproduce];
+    reproducing = canReproduceIds[rng.random(len(canReproduceIds)) < get_agent_rates(fertilityRate, agents["age"].to_numpy(), agents["isFemale"].to_numpy(), wCanReproduce)];
     numBirths = len(reproducing);
-    agents = add_newly_born_agents(agents, reproducing);
+    agents = add_newly_born_agents(agents, reproducing, rng);
     return agents, numBirths;
 
 
 #Checks for agent death and removes dead agents from the population.
+#Partners of dead agents become unpartnered.
 #Returns number of deaths.
-def do_mortality(agents, mortalityRate):
-    wSurviving = np.random.random(len(agents)) >= mortalityRate;
+#mortalityRate: the probability of dying, or a table of rates by age and sex
+# (see get_rates).
+def do_mortality(agents, mortalityRate, rng):
+    nextId = get_next_id(agents);
+    wSurviving = rng.random(len(agents)) >= get_agent_rates(mortalityRate, agents["age"].to_numpy(), agents["isFemale"].to_numpy());
+    widowedIds = agents["partner"].to_numpy()[wSurviving==False];
+    agents.loc[widowedIds[widowedIds != NO_PARTNER], "partner"] = NO_PARTNER;
     agents = agents.loc[wSurviving];
+    agents.attrs["nextId"] = nextId;
     return agents, np.sum(wSurviving==False);
 
 
@@ -78,91 +111,490 @@ def age_agents(agents):
 
 
 #Creates newly born agents, given the agent IDs (indices) of the reproducting agents.
-def add_newly_born_agents(agents, reproducingIDs):
+def add_newly_born_agents(agents, reproducingIDs, rng):
     numToAdd = len(reproducingIDs);
-    newAgents = pd.DataFrame();
+    nextId = get_next_id(agents);
+    newAgents = pd.DataFrame(index=np.arange(nextId, nextId+numToAdd));
     newAgents["age"] = np.zeros((numToAdd, ), int);
-    newAgents["isFemale"] = np.random.choice([True, False], size=numToAdd, replace=True);
+    newAgents["isFemale"] = rng.choice([True, False], size=numToAdd, replace=True);
     newAgents["partner"] = np.full((numToAdd,), NO_PARTNER);
-    agents = pd.concat([agents, newAgents], ignore_index=True);
+    agents = pd.concat([agents, newAgents]);
+    agents.attrs["nextId"] = nextId+numToAdd;
     return agents;
 
 
+#Returns the fertility and mortality rates used by a run: the fertilityRate and
+# mortalityRate parameters, or if the fertilitySchedule or mortalitySchedule
+# parameter is set, the table of rates compiled from that schedule (see
+# rate_schedules.py), indexed by [age, sex]. The parameter can also be the table
+# itself.
+def get_rates(params):
+    rates = [];
+    for rateName, scheduleName in (("fertilityRate", "fertilitySchedule"), ("mortalityRate", "mortalitySchedule")):
+        if params.get(scheduleName) is None:
+            rates.append(params[rateName]);
+        elif isinstance(params[scheduleName], str):
+            rates.append(rate_schedules.load_table(params[scheduleName]));
+        else:
+            rates.append(rate_schedules.as_table(params[scheduleName]));
+    return rates;
 
-#This is the main model function. It contains all the top-level model logic
-# and calls all the constituent functions. Having all the details in these
-# functions makes it easy to see the overall steps of the model here without
-# getting bogged down with details
-def run_model(params, verbose=False):
-    #First create the output directory if it doesn't already exist
-    #Doing this first means we can also use the existance of the directory as
-    # a hacky cue that a core is already dealing with this particular run, and
-    # prevent different cores duplicating/overwriting one another's work.
-    if path.exists(params["outputDirectory"]) == False:
-        makedirs(params["outputDirectory"]);
+
+#Returns the rate of each agent (selected by index from ages and isFemale, or
+# all of them if index is None). A single rate (rather than a table of rates
+# by [age, sex], see get_rates) is the same for every agent, so is returned as
+# it is. Agents older than the table use its last row.
+def get_agent_rates(rate, ages, isFemale, index=None):
+    if np.ndim(rate) == 0:
+        return rate;
+    if index is not None:
+        ages, isFemale = ages[index], isFemale[index];
+    return rate.ravel()[np.minimum(ages, len(rate)-1).astype(np.intp)*2 + isFemale];
+
+
+#Agent state saved in checkpoints (see checkpoints.py) doesn't depend on the
+# engine: it's a dictionary of arrays of the age, sex and partner of every
+# living agent in creation order, where partners are given by their position in
+# the arrays (NO_PARTNER if unpartnered) rather than their ID. Restoring it gives
+# the agents new IDs, which doesn't change how they're simulated.
+
+#Returns the agent state of agents with the given (increasing) IDs.
+def make_agent_state(ids, ages, isFemale, partnerIds):
+    partners = np.full((len(ids),), NO_PARTNER, dtype=np.int64);
+    wPartnered = partnerIds != NO_PARTNER;
+    partners[wPartnered] = np.searchsorted(ids, partnerIds[wPartnered]);
+    return {"age": np.asarray(ages, dtype=np.int64), "isFemale": np.asarray(isFemale, dtype=bool), "partner": partners};
+
+
+#Returns the agent state of a population.
+def get_agent_state(agents):
+    return make_agent_state(agents.index.to_numpy(), agents["age"].to_numpy(), agents["isFemale"].to_numpy(), agents["partner"].to_numpy());
+
+
+#Returns the IDs of the partners of agents restored from agentState, given
+# the IDs the agents were restored with.
+def get_partner_ids(agentState, ids):
+    partners = agentState["partner"];
+    partnerIds = np.full((len(partners),), NO_PARTNER, dtype=np.int64);
+    partnerIds[partners != NO_PARTNER] = ids[partners[partners != NO_PARTNER]];
+    return partnerIds;
+
+
+#Returns a population containing the agents in agentState.
+def restore_agents(agentState):
+    numAgents = len(agentState["age"]);
+    agents = pd.DataFrame(index=np.arange(0, numAgents)); #id
+    agents["age"] = agentState["age"];
+    agents["isFemale"] = agentState["isFemale"];
+    agents["partner"] = get_partner_ids(agentState, agents.index.to_numpy());
+    agents.attrs["nextId"] = numAgents;
+    return agents;
+
+
+#Checks the agent state is internally consistent, raising a RuntimeError if not:
+#IDs are unique and increasing, and every partner link points to a living
+# adult of the opposite sex who is partnered back.
+def check_consistency(agents):
+    if not (agents.index.is_unique and agents.index.is_monotonic_increasing):
+        raise RuntimeError("Agent IDs are not unique and increasing");
+    if len(agents) > 0 and agents.index.max() >= get_next_id(agents):
+        raise RuntimeError("Agent ID found which is not less than nextId");
+    partnered = agents.loc[agents["partner"] != NO_PARTNER];
+    if not np.all(partnered["partner"].isin(agents.index)):
+        raise RuntimeError("Partner links found pointing to dead agents");
+    partners = agents.loc[partnered["partner"]];
+    if not np.array_equal(partners["partner"].to_numpy(), partnered.index.to_numpy()):
+        raise RuntimeError("Partner links found which are not reciprocated");
+    if np.any(partners["isFemale"].to_numpy() == partnered["isFemale"].to_numpy()):
+        raise RuntimeError("Partner links found between agents of the same sex");
+    if np.any(partnered["age"] <= childAge):
+        raise RuntimeError("Partnered children found");
+
+
+
+#Decides when a run stops, and records why. A run always stops when the
+# population goes extinct ("extinct") or at maxTime ("maxTime"), but can also be
+# stopped early by the optional parameters (each is disabled when None):
+#maxPopulationSize: the population is larger than this ("maxPopulationSize").
+#   Populations growing exponentially quickly become very slow to simulate,
+#   long after their growth rate is clear.
+#growthRateWindow: the growth rate per time step over the last growthRateWindow
+#   steps differs from that over the previous growthRateWindow steps by less
+#   than growthRateTolerance ("growthRateConverged").
+#maxRunTime: the run has taken longer than this many seconds ("maxRunTime").
+#maxMemoryMB: the process is using more than this many megabytes of memory
+#   ("maxMemoryMB", see get_memory_usage_mb).
+#The reason and the (0 based) time step after which the run stopped are stored
+# in the run's metadata as "stopReason" and "stopStep" (see run_model). The time
+# series end at stopStep, so statistics calculated from them (e.g.
+# data_extractors.get_population_growth_rate) use the steps actually simulated.
+#Runs stopped by a budget (budgetStopReasons) depend on the machine and its load
+# as well as their parameters.
+class StoppingCriteria:
+    budgetStopReasons = ("maxRunTime", "maxMemoryMB");
+    
+    def __init__(self, params):
+        self.maxPopulationSize = params.get("maxPopulationSize");
+        self.growthRateWindow = params.get("growthRateWindow");
+        self.growthRateTolerance = params.get("growthRateTolerance", 0.001);
+        self.maxRunTime = params.get("maxRunTime");
+        self.maxMemoryMB = params.get("maxMemoryMB");
+        self.startTime = time.perf_counter();
+        self.reason = None;
+        self.step = None;
+    
+    #Returns the reason the population (given its size at each step so far)
+    # should stop, or None if it should carry on.
+    def check_population(self, popSizeTimeSeries):
+        popSize = popSizeTimeSeries[-1];
+        if popSize == 0:
+            return "extinct";
+        if self.maxPopulationSize is not None and popSize > self.maxPopulationSize:
+            return "maxPopulationSize";
+        window = self.growthRateWindow;
+        if window is not None and len(popSizeTimeSeries) > 2*window and popSizeTimeSeries[-1-2*window] > 0:
+            growthRate = np.log(popSizeTimeSeries[-1]/popSizeTimeSeries[-1-window])/window;
+            previousGrowthRate = np.log(popSizeTimeSeries[-1-window]/popSizeTimeSeries[-1-2*window])/window;
+            if abs(growthRate-previousGrowthRate) < self.growthRateTolerance:
+                return "growthRateConverged";
+        return None;
+    
+    #Returns the reason the run has used up its time or memory budget, or None.
+    def check_budget(self):
+        if self.maxRunTime is not None and time.perf_counter()-self.startTime > self.maxRunTime:
+            return "maxRunTime";
+        if self.maxMemoryMB is not None and get_memory_usage_mb() > self.maxMemoryMB:
+            return "maxMemoryMB";
+        return None;
     
-    #Now write the parameters to the output directory.
-    with open(path.join(params["outputDirectory"], "params_used.json"), "w") as file:
-        json.dump(params, file, indent=4);
+    #Checks every criterion after a time step. Returns True (and records the
+    # reason and step) if the run should stop.
+    def check(self, popSizeTimeSeries):
+        reason = self.check_population(popSizeTimeSeries);
+        if reason is None:
+            reason = self.check_budget();
+        if reason is not None:
+            self.stop(reason, len(popSizeTimeSeries)-1);
+        return reason is not None;
     
+    def stop(self, reason, step):
+        self.reason = reason;
+        self.step = step;
     
+    #Returns the stopping metadata of a run with numSteps time steps.
+    def get_metadata(self, numSteps):
+        if self.reason is None:
+            return {"stopReason": "maxTime", "stopStep": numSteps-1};
+        return {"stopReason": self.reason, "stopStep": self.step};
+
+
+#Returns the memory used by this process in megabytes: the resident set size
+# where it's available (Linux), otherwise the peak resident set size (which
+# includes earlier runs in the same process), or 0 if neither is available.
+def get_memory_usage_mb():
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/2**20;
+    except (OSError, ValueError, AttributeError):
+        pass;
+    try:
+        import resource;
+    except ImportError: #e.g. on Windows
+        return 0;
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss;
+    return peak/2**20 if sys.platform == "darwin" else peak/2**10; #bytes on macOS, kilobytes elsewhere
+
+
+
+#Runs the main simulation loop using the pandas DataFrame agent representation.
+#This is the reference engine: alternative engines (see get_engine) should
+# produce the same output. Returns the time series of population size, deaths
+# and births.
+#rng: the random number generator (np.random.Generator) for the run.
+#stopping: the StoppingCriteria for the run (created from params if None).
+#checkpointer: saves and restores the run's checkpoints (see checkpoints.py).
+#   By default the run is never checkpointed, but can still be warm started.
+#profiler: records the time spent in each phase of the run (see profiling.py).
+#   By default nothing is recorded.
+def simulate(params, rng, verbose=False, stopping=None, checkpointer=None, profiler=profiling.nullProfiler):
+    if stopping is None:
+        stopping = StoppingCriteria(params);
+    if checkpointer is None:
+        checkpointer = checkpoints.Checkpointer(params);
     #For convenience, extract parameters as local variables
     initialPopulationSize = params["initialPopulationSize"];
     tMax = params["maxTime"];
-    fertilityRate = params["fertilityRate"];
-    mortalityRate = params["mortalityRate"];
-
-
-    ###Pre simulation setup:
-    #Set the random seed
-    np.random.seed(params["seed"]);
-    #Initialise places to store output data
-    popSizeTimeSeries = [];
-    deathsTimeSeries = [];
-    birthsTimeSeries = [];
+    fertilityRate, mortalityRate = get_rates(params);
     
-    #initialise the agent population
-    population = initialise_agents(initialPopulationSize);
+    #Initialise places to store output data and the agent population, or
+    # restore them from a checkpoint (or warm start)
+    agentState, (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), startStep = checkpointer.start(rng, stopping);
+    if agentState is None:
+        population = initialise_agents(initialPopulationSize, rng);
+    else:
+        population = restore_agents(agentState);
+    profiler.tick("initialise");
     
     
     ###Main simulation loop:
-    for t in range(0, tMax):
+    for t in range(startStep, tMax):
         if verbose:
             print("t = ", t, " Population size: ", len(population));
         
         #Each step in the simulation is clearly layed out in human readable function names
         #details of each step can be found in their respective functions
-        population = pair_unmarried_agents(population);
-        population, numBirths = do_reproduction(population, fertilityRate);
-        population, numDeaths = do_mortality(population, mortalityRate);
+        population = pair_unmarried_agents(population, rng);
+        profiler.tick("pairing");
+        population, numBirths = do_reproduction(population, fertilityRate, rng);
+        profiler.tick("reproduction");
+        population, numDeaths = do_mortality(population, mortalityRate, rng);
+        profiler.tick("mortality");
         population = age_agents(population);
+        profiler.tick("ageing");
+        if checkConsistency:
+            check_consistency(population);
         
         #Store outputs
         deathsTimeSeries.append(numDeaths);
         birthsTimeSeries.append(numBirths);
         popSizeTimeSeries.append(len(population));
         
-        #Stop running if the population has gone extinct
-        if (len(population) == 0):
+        #Check whether the population has gone extinct (or another stopping
+        # criterion has been met). If not, save the state of the run when a
+        # checkpoint is due, so it can be resumed if it's interrupted
+        stopped = stopping.check(popSizeTimeSeries);
+        if stopped == False and checkpointer.is_due(t):
+            checkpointer.save(t, get_agent_state(population), (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), rng, stopping);
+        profiler.tick("bookkeeping");
+        profiler.end_step(len(population));
+        
+        #Stop running if a stopping criterion has been met
+        if stopped:
             break;
     
+    return popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries;
+
+
+#Returns the simulate function for the engine named by the 'engine' parameter.
+#"dataframe": the reference pandas implementation in this file.
+#"array": preallocated NumPy column arrays (see agent_store.py).
+#"cohort": counts of agents by age, sex and partnered status (see
+#   cohort_engine.py). Much faster for large populations, with the same
+#   distribution of output, but not identical output for the same seed.
+#Alternative engines are imported here rather than at the top of the file
+# because they reuse the constants defined in this file.
+def get_engine(engineName):
+    if engineName == "dataframe":
+        return simulate;
+    elif engineName == "array":
+        from model import agent_store;
+        return agent_store.simulate;
+    elif engineName == "cohort":
+        from model import cohort_engine;
+        return cohort_engine.simulate;
+    else:
+        raise ValueError("Unrecognised engine: "+str(engineName));
+
+
+
+#Returns a rough estimate of the cost of running a simulation with params, in
+# arbitrary units (approximately the number of agent time steps simulated). Used
+# to schedule runs (see run_tools.schedule_tasks), so only relative costs matter.
+#The population is assumed to grow exponentially at rate
+# fertilityRate*adultFemaleFraction - mortalityRate, where roughly 30% of the
+# population are partnered adult females who can reproduce. Growth is capped, as large
+# populations quickly become unrealistic. If a rate schedule is set (see
+# get_rates), its mean rate is used instead: the mean female fertility of adults
+# and the mean mortality of both sexes, over the ages of the initial population.
+#The cohort engine's cost doesn't depend on the population size, so it's about
+# that of simulating cohortStepCost agents each step.
+adultFemaleFraction = 0.3;
+runOverheadCost = 10000; #Fixed cost of each run (e.g. setting up and writing output), in agent time steps
+cohortStepCost = 100;
+def estimate_run_cost(params):
+    if params.get("engine") == "cohort":
+        return cohortStepCost*params["maxTime"] + runOverheadCost;
+    try:
+        fertilityRate, mortalityRate = get_rates(params);
+    except (ValueError, OSError): #an invalid schedule is reported by the run itself
+        fertilityRate, mortalityRate = params["fertilityRate"], params["mortalityRate"];
+    fertilityRate = get_mean_rate(fertilityRate, np.arange(childAge+1, maxAge), sex=1);
+    mortalityRate = get_mean_rate(mortalityRate, np.arange(0, maxAge));
+    growthRate = fertilityRate*adultFemaleFraction - mortalityRate;
+    tMax = params["maxTime"];
+    if abs(growthRate) < 1e-9:
+        totalPopulation = tMax;
+    else:
+        totalPopulation = np.expm1(min(growthRate*tMax, 50.0))/growthRate;
+    return params["initialPopulationSize"]*max(totalPopulation, 1.0) + runOverheadCost;
+
+
+#Returns the mean of a rate (see get_rates) over ages, for one sex or both if
+# sex is None.
+def get_mean_rate(rate, ages, sex=None):
+    if np.ndim(rate) == 0:
+        return rate;
+    rates = rate[np.minimum(ages, len(rate)-1)];
+    return float(np.mean(rates if sex is None else rates[:, sex]));
+
+
+#Returns the random number generator for a run. Each run's stream is defined by
+# its 'seed' (the entropy of the root of a SeedSequence tree, e.g. shared by a
+# whole sweep) and 'seedSpawnKey' (the run's position in the tree, e.g.
+# [parameter set index, repeat number]). Both are recorded in params_used.json
+# so any run can be reproduced exactly. See run_tools for how these are set.
+def make_rng(params):
+    seedSequence = np.random.SeedSequence(params["seed"], spawn_key=tuple(params.get("seedSpawnKey", [])));
+    return np.random.default_rng(seedSequence);
+
+
+#This is the main model function. It contains all the top-level model logic
+# and calls all the constituent functions. Having all the details in these
+# functions makes it easy to see the overall steps of the model here without
+# getting bogged down with details
+#writeOutput: if False nothing is written to disk (use returnResult to get the output).
+#returnResult: if True a RunResult containing the status, time series and
+#   metadata of the run is returned instead of just the status code.
+#checkpoint: if True the run saves checkpoints (every checkpointInterval time
+#   steps, if set) and resumes from its last checkpoint if it was interrupted
+#   (see checkpoints.py). By default the same as writeOutput. The checkpoint is
+#   removed once the output has been written.
+def run_model(params, verbose=False, writeOutput=True, returnResult=False, checkpoint=None):
+    #First create the output directory if it doesn't already exist, and write
+    # the parameters to it (see output_formats for how output is stored).
+    #The run only counts as complete once its output has been written (see
+    # output_formats), so a run which crashes part way through will be re-run.
+    if writeOutput:
+        writer = output_formats.get_writer(params);
+        writer.prepare(params);
+    
+    
+    ###Pre simulation setup:
+    #Create the random number generator from the seed
+    rng = make_rng(params);
+    #Choose the engine used to represent and update the agent population
+    simulate_agents = get_engine(params.get("engine", "array"));
+    
+    
+    ###Run the simulation (see simulate for the main simulation loop):
+    #Runs which write output save checkpoints (if checkpointInterval is set),
+    # and resume from their last checkpoint if they were interrupted
+    startTime = time.perf_counter();
+    stopping = StoppingCriteria(params);
+    checkpointer = checkpoints.Checkpointer(params, checkpoints.get_checkpoint_filepath(params) if (writeOutput if checkpoint is None else checkpoint) else None);
+    profiler = profiling.get_profiler(params);
+    popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries = simulate_agents(params, rng, verbose, stopping, checkpointer, profiler);
+    timeSeries = make_time_series(popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries);
+    metadata = {"runTime": time.perf_counter()-startTime};
+    metadata.update(stopping.get_metadata(len(popSizeTimeSeries)));
+    
+    
     ###Finished simulation
-    #Accumulate all the output into one data frame
-    output = pd.DataFrame();
-    output["popSize"] = popSizeTimeSeries;
-    output["deaths"] = deathsTimeSeries;
-    output["births"] = birthsTimeSeries;
-    
-    #Write output to file
-    outputFile = path.join(params["outputDirectory"], "time_series_outputs.csv")
-    output.to_csv(outputFile, sep=",");
-    if verbose:
-        print("Output written to", outputFile);
+    if writeOutput:
+        metadata["outputFilepath"] = writer.write(params, timeSeries, verbose, metadata);
+        checkpointer.remove();
+    
+    #If the run is profiled, its profile is written next to its output and
+    # returned in its metadata (see profiling.py)
+    if profiler.enabled:
+        profiler.tick("output");
+        metadata["profile"] = profiler.get_profile();
+        if writeOutput:
+            profiling.write_profile(params, metadata["profile"]);
     
     #Returning a value can be used to indicate success or failure or other
     # information aboutt he run, which other parts of the workflow can react
     # to. By convention returning 0 is success / no error
+    if returnResult:
+        return RunResult(status_codes.SUCCESSFUL, params, timeSeries, metadata);
     return status_codes.SUCCESSFUL;
+
+
+#Packs the output time series of a run into a dictionary of arrays.
+def make_time_series(popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries):
+    return {"popSize": np.asarray(popSizeTimeSeries, dtype=np.int64),
+            "deaths": np.asarray(deathsTimeSeries, dtype=np.int64),
+            "births": np.asarray(birthsTimeSeries, dtype=np.int64)};
+
+
+#Returns True if two parameter values are equal. Values may be arrays (e.g. a
+# table of rates, see get_rates).
+def param_values_equal(value, otherValue):
+    if isinstance(value, np.ndarray) or isinstance(otherValue, np.ndarray):
+        return value is otherValue or np.array_equal(value, otherValue);
+    return value == otherValue;
+
+
+#Runs a set of repeat simulations together using the batch engine (see
+# batch_engine.py). paramsList contains one parameter set per repeat, which
+# must be identical apart from their seed, seedSpawnKey and outputDirectory.
+#The output of each repeat is identical to running it with run_model, and is
+# written to its own outputDirectory in the same way.
+#Repeats using the cohort engine (which is already cheap for any population
+# size, and doesn't match the batch engine's output) or incremental pairing
+# (which the batch engine doesn't support) are run one at a time.
+#writeOutput, returnResults, checkpoint: as for run_model. Every repeat has its
+#   own checkpoint, and the batch is only resumed if they were all saved after
+#   the same time step (see checkpoints.start_batch).
+#Returns a list of status codes (or RunResults), one per repeat.
+def run_model_batch(paramsList, verbose=False, writeOutput=True, returnResults=False, checkpoint=None):
+    from model import batch_engine;
+    
+    sharedNames = [name for name in paramsList[0] if name not in ("seed", "seedSpawnKey", "outputDirectory")];
+    if any(set(params) != set(paramsList[0]) or any(param_values_equal(params[name], paramsList[0][name]) == False for name in sharedNames) for params in paramsList):
+        raise ValueError("Batched runs must only differ in their seed, seedSpawnKey and outputDirectory");
+    
+    if writeOutput:
+        writer = output_formats.get_writer(paramsList[0]);
+        for params in paramsList:
+            writer.prepare(params);
+    
+    startTime = time.perf_counter();
+    stoppings = [StoppingCriteria(params) for params in paramsList];
+    checkpointers = [checkpoints.Checkpointer(params, checkpoints.get_checkpoint_filepath(params) if (writeOutput if checkpoint is None else checkpoint) else None) for params in paramsList];
+    profiler = profiling.get_profiler(paramsList[0], batchSize=len(paramsList));
+    if paramsList[0].get("engine") == "cohort" or paramsList[0].get("incrementalPairing"):
+        simulate_agents = get_engine(paramsList[0].get("engine", "array"));
+        outputs = [simulate_agents(params, make_rng(params), verbose, stopping, checkpointer, profiler) for params, stopping, checkpointer in zip(paramsList, stoppings, checkpointers)];
+    else:
+        outputs = batch_engine.simulate_batch(paramsList[0], [make_rng(params) for params in paramsList], verbose, stoppings, checkpointers, profiler);
+    metadata = {"runTime": time.perf_counter()-startTime, "batchSize": len(paramsList)};
+    
+    results = [];
+    for params, (popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries), stopping, checkpointer in zip(paramsList, outputs, stoppings, checkpointers):
+        timeSeries = make_time_series(popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries);
+        results.append(RunResult(status_codes.SUCCESSFUL, params, timeSeries, dict(metadata, **stopping.get_metadata(len(popSizeTimeSeries)))));
+        if writeOutput:
+            results[-1].metadata["outputFilepath"] = writer.write(params, timeSeries, verbose, results[-1].metadata);
+            checkpointer.remove();
     
+    #The batch is profiled as a whole, and its profile kept with its first repeat
+    if profiler.enabled:
+        profiler.tick("output");
+        results[0].metadata["profile"] = profiler.get_profile();
+        if writeOutput:
+            profiling.write_profile(paramsList[0], results[0].metadata["profile"]);
+    return results if returnResults else [result.status for result in results];
 
 
+#Simulates params["maxTime"] time steps to let a population settle down (e.g.
+# from the uniform age distribution of initialise_agents), then saves its final
+# state to checkpointFilepath. Runs with the parameter warmStartCheckpoint set to
+# checkpointFilepath then start from this population instead of repeating the
+# burn in (see checkpoints.py).
+#Nothing is simulated if checkpointFilepath already holds the final state of a
+# burn in with the same params. If params["checkpointInterval"] is set the burn
+# in also saves checkpoints to checkpointFilepath as it goes, so it can be
+# resumed if interrupted.
+#Raises a RuntimeError if the population stops early (e.g. goes extinct).
+#Returns checkpointFilepath.
+def run_burn_in(params, checkpointFilepath, verbose=False):
+    if path.dirname(checkpointFilepath) != "":
+        os.makedirs(path.dirname(checkpointFilepath), exist_ok=True);
+    rng = make_rng(params);
+    stopping = StoppingCriteria(params);
+    checkpointer = checkpoints.Checkpointer(params, checkpointFilepath, interval=params.get("checkpointInterval") or params["maxTime"], saveLastStep=True);
+    get_engine(params.get("engine", "array"))(params, rng, verbose, stopping, checkpointer);
+    if stopping.reason is not None:
+        raise RuntimeError("Burn in stopped early ("+stopping.reason+"), so has no final population to save");
+    return checkpointFilepath;
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+
+from model import simple_model, agent_store;
+from model.simple_model import NO_PARTNER;
+from utilities import parameters;
+
+
+#The array engine should reproduce the reference DataFrame engine exactly for the same seed
+def test_engines_identical(monkeypatch):
+    #Compact small stores too, so compaction is exercised
+    monkeypatch.setattr(agent_store.AgentStore, "minCompactionSize", 0);
+    params = parameters.override_default_parameters({"initialPopulationSize": 800, "maxTime": 120, "fertilityRate": 0.1, "mortalityRate": 0.03});
+    for seed in [1, 2, 3]:
+        referenceOutput = simple_model.simulate(params, np.random.default_rng(seed));
+        arrayOutput = agent_store.simulate(params, np.random.default_rng(seed));
+        for referenceTS, arrayTS in zip(referenceOutput, arrayOutput):
+            assert np.array_equal(referenceTS, arrayTS);
+
+    #Params from before the engine parameter existed use the array engine
+    params["seed"] = 1;
+    oldParams = {name: value for name, value in params.items() if name != "engine"};
+    assert np.array_equal(simple_model.run_model(oldParams, writeOutput=False, returnResult=True).timeSeries["popSize"], simple_model.run_model(params, writeOutput=False, returnResult=True).timeSeries["popSize"]);
+
+
+#Deaths leave tombstones which are compacted away, and births reuse the freed space
+def test_store_growth_and_compaction():
+    store = agent_store.AgentStore(4);
+    slots = store.add(np.arange(10)+20, np.arange(10) % 2 == 0);
+    assert store.capacity >= 10 and len(store) == 10;
+    assert list(store.id[slots]) == list(range(10));
+    
+    store.partner[[2, 3]] = [3, 2];
+    store.minCompactionSize = 0; #Compact as soon as tombstones outnumber living agents
+    store.kill(np.arange(0, 2));
+    store.kill(np.arange(4, 10));
+    #Only agents 2 and 3 remain, moved to the front and still partnered by ID
+    assert store.size == 2 and len(store) == 2;
+    assert list(store.id[0:2]) == [2, 3];
+    assert list(store.partner[0:2]) == [3, 2];
+    assert list(store.slots_of([2, 3])) == [0, 1];
+    assert np.all(store.partner[2:] == NO_PARTNER);
+    
+    newSlots = store.add(np.zeros(3), np.ones(3, dtype=bool));
+    assert list(store.live_slots()) == [0, 1, 2, 3, 4];
+    assert list(store.id[newSlots]) == [10, 11, 12]; #IDs are never reused
+    store.check_consistency();
+
+
+#When an agent dies its partner becomes unpartnered
+def test_widowing():
+    store = agent_store.AgentStore(4);
+    store.add([20, 20, 30, 30], [True, False, True, False]);
+    store.partner[0:4] = [1, 0, 3, 2];
+    store.kill(np.array([0, 3]));
+    assert store.partner[1] == NO_PARTNER and store.partner[2] == NO_PARTNER;
+    store.check_consistency();
+
+
+#Run both engines with the consistency checks switched on
+def test_engines_consistent(monkeypatch):
+    monkeypatch.setattr(simple_model, "checkConsistency", True);
+    monkeypatch.setattr(agent_store.AgentStore, "minCompactionSize", 0);
+    params = parameters.override_default_parameters({"initialPopulationSize": 300, "maxTime": 60, "fertilityRate": 0.1, "mortalityRate": 0.05});
+    simple_model.simulate(params, np.random.default_rng(7));
+    agent_store.simulate(params, np.random.default_rng(7));
+
+
+#Simulates a population with the array engine's step functions, optionally
+# with incremental pairing. Returns the final population size, total births and
+# deaths, and the number of couples and mean age gap between partners at the end.
+def simulate_partnerships(params, rng, incrementalPairing):
+    store = agent_store.initialise_agents(params["initialPopulationSize"], rng);
+    if incrementalPairing:
+        store.singlePools = agent_store.SinglePools(store);
+    numBirths = numDeaths = 0;
+    for t in range(params["maxTime"]):
+        store = agent_store.pair_unmarried_agents(store, rng);
+        store, births = agent_store.do_reproduction(store, params["fertilityRate"], rng);
+        store, deaths = agent_store.do_mortality(store, params["mortalityRate"], rng);
+        store = agent_store.age_agents(store);
+        store.check_consistency();
+        numBirths, numDeaths = numBirths+births, numDeaths+deaths;
+    liveSlots = store.live_slots();
+    wives = liveSlots[store.isFemale[liveSlots] & (store.partner[liveSlots] != NO_PARTNER)];
+    ageGaps = np.abs(store.age[wives].astype(int)-store.age[store.slots_of(store.partner[wives])]);
+    return [len(store), numBirths, numDeaths, len(wives), np.mean(ageGaps)];
+
+
+#Incremental pairing (pools of unpartnered adults kept up to date, rather than
+# found by a scan every step) partners agents with the same distribution: the
+# population, births, deaths, number of couples and age gaps between partners
+# agree with the scanning version to within sampling error
+def test_incremental_pairing_matches_scan(monkeypatch):
+    monkeypatch.setattr(agent_store.AgentStore, "minCompactionSize", 0); #compaction mustn't lose pool members
+    params = parameters.override_default_parameters({"initialPopulationSize": 300, "maxTime": 30, "fertilityRate": 0.12, "mortalityRate": 0.04});
+    numReps = 300;
+    seedSequence = np.random.SeedSequence(23);
+    scanned = np.array([simulate_partnerships(params, np.random.default_rng(seed), False) for seed in seedSequence.spawn(numReps)], dtype=float);
+    pooled = np.array([simulate_partnerships(params, np.random.default_rng(seed), True) for seed in seedSequence.spawn(numReps)], dtype=float);
+    zScores = (np.mean(pooled, axis=0)-np.mean(scanned, axis=0))/np.sqrt((np.var(scanned, axis=0, ddof=1)+np.var(pooled, axis=0, ddof=1))/numReps);
+    assert np.max(np.abs(zScores)) < 4.5;
+    varianceRatios = np.var(pooled, axis=0, ddof=1)/np.var(scanned, axis=0, ddof=1);
+    assert np.all(np.abs(np.log(varianceRatios)) < 4.5*np.sqrt(4/(numReps-1)));
+
+
+#With incremental pairing, runs are consistent (the pools always match the
+# unpartnered adults), also when run as a set of batched repeats
+def test_incremental_pairing_runs(monkeypatch):
+    monkeypatch.setattr(simple_model, "checkConsistency", True);
+    params = parameters.override_default_parameters({"initialPopulationSize": 300, "maxTime": 60, "fertilityRate": 0.1, "mortalityRate": 0.05, "incrementalPairing": True});
+    output = agent_store.simulate(params, np.random.default_rng(7));
+    assert np.array_equal(output[0], agent_store.simulate(params, np.random.default_rng(7))[0]);
+    paramsList = [dict(params, seed=7, seedSpawnKey=[r], outputDirectory=str(r)) for r in range(3)];
+    results = simple_model.run_model_batch(paramsList, writeOutput=False, returnResults=True);
+    for params, result in zip(paramsList, results):
+        assert np.array_equal(result.timeSeries["popSize"], simple_model.run_model(params, writeOutput=False, returnResult=True).timeSeries["popSize"]);
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path, listdir, utime;
+from string import Template;
+import shutil;
+
+from utilities import parameters, run_tools, data_extractors, analysis_tools, output_formats, filepaths;
+
+
+def run_example_sweep(outputDirectory):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 30, "mortalityRate": 0.05, "outputDirectory": outputDirectory});
+    run_tools.run_sweep(baseParams, ["fertilityRate", "initialPopulationSize"], [[0.05, 0.1], [60, 80, 100]], numReps=3, verbose=False, seed=3);
+
+
+#The sweep cube should contain the same data as the nested dictionaries
+def test_sweep_cube_matches_dictionaries(tmp_path):
+    run_example_sweep(str(tmp_path));
+    paramNames, paramVals, growthRates = analysis_tools.extract_from_sweep(str(tmp_path), data_extractors.get_population_growth_rate);
+    cubeParamNames, cubeParamVals, growthRateCube = analysis_tools.extract_from_sweep(str(tmp_path), data_extractors.get_population_growth_rate, asCube=True);
+    assert cubeParamNames == paramNames and cubeParamVals == paramVals;
+    assert growthRateCube.axisNames == ["fertilityRate", "initialPopulationSize", "rep"] and growthRateCube.shape == (2, 3, 3);
+    assert np.allclose(growthRateCube.sel(fertilityRate=0.1, initialPopulationSize=80).values, growthRates[0.1][80], equal_nan=True);
+    meanCube = growthRateCube.mean("rep");
+    assert np.isclose(meanCube.sel(fertilityRate=0.05, initialPopulationSize=100).values, np.nanmean(growthRates[0.05][100]));
+
+    #Time series are padded with NaN after extinction
+    popSizeCube = analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_pop_size_time_series);
+    assert popSizeCube.axisNames[-1] == "time" and popSizeCube.shape[-1] == 30;
+    popSizes = data_extractors.get_pop_size_time_series(path.join(str(tmp_path), "fertilityRate=0.05_initialPopulationSize=60", "rep=2"));
+    series = popSizeCube.sel(fertilityRate=0.05, initialPopulationSize=60, rep=2).values;
+    assert np.array_equal(series[0:len(popSizes)], popSizes) and np.all(np.isnan(series[len(popSizes):]));
+
+
+#A stored cube is reused until newer simulation output is written
+def test_sweep_cube_cache(tmp_path):
+    run_example_sweep(str(tmp_path));
+    analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_population_growth_rate);
+    cubeFilepath = path.join(str(tmp_path), [f for f in listdir(str(tmp_path)) if f.endswith(".npy")][0]);
+    utime(cubeFilepath, (1e10, 1e10));
+    cube = analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_population_growth_rate);
+    assert isinstance(cube.values, np.memmap) and path.getmtime(cubeFilepath) == 1e10;
+
+    utime(cubeFilepath, (1, 1)); #now older than the simulation output
+    analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_population_growth_rate);
+    assert path.getmtime(cubeFilepath) > 1;
+
+    #A cube extracted with a different repDirTemplate is stored separately
+    for paramSetDir in listdir(str(tmp_path)):
+        if path.isdir(path.join(str(tmp_path), paramSetDir)):
+            shutil.copytree(path.join(str(tmp_path), paramSetDir, "rep=2"), path.join(str(tmp_path), paramSetDir, "copy=0"));
+    cube = analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_population_growth_rate);
+    otherCube = analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_population_growth_rate, repDirTemplate=Template("copy=${repNum}"));
+    assert otherCube.shape == (2, 3, 1) and np.array_equal(otherCube.values[..., 0], cube.values[..., 2], equal_nan=True);
+    assert analysis_tools.extract_sweep_cube(str(tmp_path), data_extractors.get_population_growth_rate).shape == (2, 3, 3);
+    assert len([f for f in listdir(str(tmp_path)) if f.endswith(".npy")]) == 2;
+
+
+#Parallel and cached extraction give the same results as serial extraction,
+# and cached values are only reused while the run's output is unchanged
+def test_parallel_cached_extraction(tmp_path, monkeypatch):
+    monkeypatch.setattr(filepaths, "extractionCacheDir", path.join(str(tmp_path), "cache"));
+    sweepDirectory = path.join(str(tmp_path), "sweep");
+    run_example_sweep(sweepDirectory);
+    expected = analysis_tools.extract_from_sweep(sweepDirectory, data_extractors.get_population_growth_rate);
+    assert analysis_tools.extract_from_sweep(sweepDirectory, data_extractors.get_population_growth_rate, numWorkers=2, useCache=True) == expected;
+    assert len(listdir(path.join(str(tmp_path), "cache"))) == 18;
+
+    calls = [];
+    def counting_extractor(directory):
+        calls.append(directory);
+        return data_extractors.get_population_growth_rate(directory);
+    monkeypatch.setattr(counting_extractor, "__qualname__", "get_population_growth_rate");
+    monkeypatch.setattr(counting_extractor, "__module__", data_extractors.__name__);
+    assert analysis_tools.extract_from_sweep(sweepDirectory, counting_extractor, useCache=True) == expected;
+    assert calls == [];
+
+    repDirectory = path.join(sweepDirectory, "fertilityRate=0.1_initialPopulationSize=80", "rep=1");
+    utime(path.join(repDirectory, "time_series_outputs.csv"), (1, 1));
+    analysis_tools.extract_from_repeats(path.dirname(repDirectory), counting_extractor, useCache=True);
+    assert calls == [repDirectory];
+
+
+#The extraction cache is bounded by removing the least recently used values,
+# and can be cleared after an extractor is changed
+def test_extraction_cache_eviction(tmp_path, monkeypatch):
+    cacheDirectory = path.join(str(tmp_path), "cache");
+    monkeypatch.setattr(filepaths, "extractionCacheDir", cacheDirectory);
+    sweepDirectory = path.join(str(tmp_path), "sweep");
+    run_example_sweep(sweepDirectory);
+    analysis_tools.extract_from_sweep(sweepDirectory, data_extractors.get_population_growth_rate, useCache=True);
+    cacheFilepaths = sorted(path.join(cacheDirectory, f) for f in listdir(cacheDirectory));
+    for i, cacheFilepath in enumerate(cacheFilepaths):
+        utime(cacheFilepath, (i+1, i+1));
+    entryBytes = path.getsize(cacheFilepaths[0]);
+    analysis_tools.evict_extraction_cache(maxBytes=entryBytes*len(cacheFilepaths)-1);
+    assert sorted(path.join(cacheDirectory, f) for f in listdir(cacheDirectory)) == cacheFilepaths[1:];
+
+    analysis_tools.clear_extraction_cache();
+    assert path.exists(cacheDirectory) == False;
+
+
+#Several extractors applied in one pass give the same results as separate
+# passes, while reading each run's output only once
+def test_extract_many_from_sweep(tmp_path, monkeypatch):
+    run_example_sweep(str(tmp_path));
+    extractors = {"popSize": data_extractors.get_pop_size_time_series,
+                  "growthRate": data_extractors.get_population_growth_rate,
+                  "birthDeathRatio": data_extractors.get_birth_death_ratio_time_series,
+                  "initialPopulationSize": lambda run: data_extractors.get_params_file(run)["initialPopulationSize"]};
+    separate = {name: analysis_tools.extract_from_sweep(str(tmp_path), extractorFunc)[2] for name, extractorFunc in extractors.items()};
+
+    reads = [];
+    loadTimeSeries = output_formats.load_time_series;
+    monkeypatch.setattr(output_formats, "load_time_series", lambda directory, columns=None: reads.append(directory) or loadTimeSeries(directory, columns));
+    paramNames, paramVals, combined = analysis_tools.extract_many_from_sweep(str(tmp_path), extractors);
+    assert len(reads) == 18;
+    assert paramNames == ["fertilityRate", "initialPopulationSize"];
+    assert combined["initialPopulationSize"][0.1][80] == [80, 80, 80];
+    for fertilityRate in paramVals["fertilityRate"]:
+        for initialPopulationSize in paramVals["initialPopulationSize"]:
+            for name in ["popSize", "growthRate", "birthDeathRatio"]:
+                for combinedValue, separateValue in zip(combined[name][fertilityRate][initialPopulationSize], separate[name][fertilityRate][initialPopulationSize]):
+                    assert np.array_equal(combinedValue, separateValue, equal_nan=True);
+
+
+#Streaming statistics match those calculated from every time series at once,
+# and merging partial aggregates gives the same result as aggregating in one go
+def test_time_series_aggregator(tmp_path):
+    rng = np.random.default_rng(0);
+    runs = [{"popSize": rng.integers(0, 5000, size=length), "deaths": rng.integers(0, 50, size=length), "births": rng.integers(0, 50, size=length)} for length in [20]*30+[12, 7]];
+    aggregator = analysis_tools.TimeSeriesAggregator();
+    partialAggregators = [analysis_tools.TimeSeriesAggregator(), analysis_tools.TimeSeriesAggregator()];
+    for i, run in enumerate(runs):
+        aggregator.add(run);
+        partialAggregators[i % 2].add(run);
+    merged = partialAggregators[0].merge(partialAggregators[1]);
+
+    popSizes = np.full((len(runs), 20), np.nan);
+    for i, run in enumerate(runs):
+        popSizes[i, 0:len(run["popSize"])] = run["popSize"];
+    for stats in [aggregator, merged]:
+        assert np.array_equal(stats.count(), np.sum(np.isfinite(popSizes), axis=0));
+        assert np.allclose(stats.mean("popSize"), np.nanmean(popSizes, axis=0));
+        assert np.allclose(stats.std("popSize"), np.nanstd(popSizes, axis=0, ddof=1));
+        assert np.array_equal(stats.min("popSize"), np.nanmin(popSizes, axis=0));
+        assert np.array_equal(stats.max("popSize"), np.nanmax(popSizes, axis=0));
+        for q in [0, 0.1, 0.5, 0.9, 1]:
+            exact = np.nanquantile(popSizes, q, axis=0, method="lower");
+            assert np.all(np.abs(stats.quantile("popSize", q)-exact) <= 0.01*exact+1e-9);
+    assert np.array_equal(aggregator.quantile("births", 0.5), merged.quantile("births", 0.5));
+
+    #Aggregating runs from their output files
+    params = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 30, "outputDirectory": str(tmp_path)});
+    run_tools.run_reps(params, numReps=6, verbose=False, seed=1);
+    fromFiles = analysis_tools.aggregate_from_repeats(str(tmp_path), numWorkers=2, fillToLength=30);
+    births = np.array(analysis_tools.extract_from_repeats(str(tmp_path), lambda run: np.pad(data_extractors.load_time_series(run)["births"], (0, 30))[0:30]));
+    assert fromFiles.numRuns == 6 and np.allclose(fromFiles.mean("births"), np.mean(births, axis=0));
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+import pandas as pd;
+from os import path;
+import json;
+import pytest;
+
+from model import simple_model, agent_store, batch_engine;
+from utilities import parameters, run_tools, data_extractors;
+
+
+#Each replicate in a batch should be identical to a standalone run with the same seed
+def test_batch_matches_standalone(monkeypatch):
+    monkeypatch.setattr(simple_model, "checkConsistency", True);
+    #High mortality so some replicates go extinct before maxTime
+    params = parameters.override_default_parameters({"initialPopulationSize": 40, "maxTime": 80, "fertilityRate": 0.05, "mortalityRate": 0.1});
+    seeds = [11, 12, 13, 14, 15, 16];
+    batchOutputs = batch_engine.simulate_batch(params, [np.random.default_rng(seed) for seed in seeds]);
+    
+    extinctions = 0;
+    for seed, batchOutput in zip(seeds, batchOutputs):
+        standaloneOutput = agent_store.simulate(params, np.random.default_rng(seed));
+        for standaloneTS, batchTS in zip(standaloneOutput, batchOutput):
+            assert np.array_equal(standaloneTS, batchTS);
+        extinctions += len(batchOutput[0]) < params["maxTime"];
+    assert extinctions > 0;
+
+
+#Batched repeats are written to their own rep=# directories and can be replicated from their parameter files
+def test_run_reps_batched(tmp_path):
+    params = parameters.override_default_parameters({"initialPopulationSize": 200, "maxTime": 30, "outputDirectory": str(tmp_path)});
+    statuses = run_tools.run_reps(params, numReps=3, verbose=False, batched=True);
+    assert list(statuses) == [0, 0, 0];
+    
+    repDir = path.join(str(tmp_path), "rep=2");
+    replicaParams = parameters.override_default_parameters({"initialPopulationSize": 200, "maxTime": 30, "outputDirectory": path.join(str(tmp_path), "replica")});
+    with open(path.join(repDir, "params_used.json")) as file:
+        repParams = json.load(file);
+    assert repParams["seedSpawnKey"] == [2];
+    replicaParams["seedSpawnKey"] = repParams["seedSpawnKey"];
+    run_tools.run_single(replicaParams, overwriteSeed=repParams["seed"]);
+    original = pd.read_csv(path.join(repDir, "time_series_outputs.csv"));
+    replica = pd.read_csv(path.join(replicaParams["outputDirectory"], "time_series_outputs.csv"));
+    assert original.equals(replica);
+
+
+#Runs stopped early by a population cap or a converged growth rate stop at the
+# same step in every engine, and the reason and step are stored with the output
+def test_early_stopping(tmp_path):
+    for stoppingParams, reason in [({"maxPopulationSize": 400}, "maxPopulationSize"), ({"growthRateWindow": 10, "growthRateTolerance": 0.01}, "growthRateConverged")]:
+        overrides = {"initialPopulationSize": 200, "maxTime": 200, "fertilityRate": 0.2, "mortalityRate": 0.01, "outputFormat": "npz", "outputDirectory": path.join(str(tmp_path), reason)};
+        params = parameters.override_default_parameters(dict(overrides, **stoppingParams));
+        results = run_tools.run_reps(params, numReps=3, verbose=False, seed=2, writeOutput=False, returnResults=True);
+        batchResults = run_tools.run_reps(params, numReps=3, verbose=False, seed=2, batched=True, returnResults=True);
+        for result, batchResult in zip(results, batchResults):
+            assert result.metadata["stopReason"] == reason and result.metadata["stopStep"] < 100;
+            assert reason != "maxPopulationSize" or (result.timeSeries["popSize"][-1] > 400 and result.timeSeries["popSize"][-2] <= 400);
+            assert result.metadata["stopStep"] == len(result.timeSeries["popSize"])-1;
+            assert np.array_equal(result.timeSeries["popSize"], batchResult.timeSeries["popSize"]);
+            assert data_extractors.get_run_metadata(batchResult.outputDirectory)["stopStep"] == result.metadata["stopStep"];
+            assert data_extractors.get_stop_reason(batchResult.outputDirectory) == reason;
+            dataframeParams = dict(result.params, engine="dataframe");
+            assert np.array_equal(simple_model.run_model(dataframeParams, writeOutput=False, returnResult=True).timeSeries["popSize"], result.timeSeries["popSize"]);
+
+    #Budgets stop every run, and runs without a criterion stop at maxTime
+    params = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 20, "maxRunTime": 0, "outputDirectory": str(tmp_path)});
+    params["seed"] = 4;
+    assert simple_model.run_model(params, writeOutput=False, returnResult=True).metadata == {"runTime": pytest.approx(0, abs=1), "stopReason": "maxRunTime", "stopStep": 0};
+    params.update({"maxRunTime": None, "fertilityRate": 0.1, "mortalityRate": 0.01});
+    assert simple_model.run_model(params, writeOutput=False, returnResult=True).metadata["stopReason"] == "maxTime";
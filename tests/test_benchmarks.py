@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path;
+
+from utilities import benchmarks, analysis_tools, data_extractors;
+
+
+tinySuite = {"run_model": {"engine": ["array", "cohort"], "initialPopulationSize": [200], "maxTime": [5]},
+             "cohort_run_model": {"initialPopulationSize": [200, 10**9], "maxTime": [5]},
+             "model_step": {"engine": ["array", "dataframe", "cohort"], "initialPopulationSize": [500], "step": ["pairing", "reproduction", "mortality", "ageing"]},
+             "run_reps": {"numReps": [2], "numCores": [None], "batched": [False, True], "initialPopulationSize": [100], "maxTime": [5]},
+             "extract_from_sweep": {"sweepSize": [2], "numReps": [2], "outputFormat": ["csv", "sweep"], "numWorkers": [None]}};
+
+
+#Every case runs, and its results are appended to the history and can be
+# compared with the previous run
+def test_run_and_compare(tmp_path):
+    historyFilepath = path.join(str(tmp_path), "history.json");
+    results = benchmarks.run_suite(tinySuite, numRepeats=2, verbose=False);
+    assert len(results) == 2+2+12+2+2;
+    assert all(len(result["times"]) == 2 and 0 <= result["minSeconds"] <= result["seconds"] for result in results);
+    benchmarks.append_history(benchmarks.make_history_entry(results, tinySuite), historyFilepath);
+
+    assert benchmarks.main(["--history", historyFilepath, "run", "--suite", "quick", "--case", "run_model", "--repeats", "1"]) == 0;
+    history = benchmarks.load_history(historyFilepath);
+    assert len(history) == 2 and history[1]["suite"] == "quick";
+    assert benchmarks.compare_history(historyFilepath, verbose=False) == []; #the runs have no cases in common
+
+    benchmarks.append_history(benchmarks.make_history_entry(results, tinySuite), historyFilepath);
+    comparisons = benchmarks.compare_history(historyFilepath, baseline=0, verbose=False);
+    assert len(comparisons) == len(results) and all(comparison["ratio"] == 1 and comparison["regressed"] == False for comparison in comparisons);
+
+
+#Cases slower than the baseline by more than the threshold are flagged, and
+# make the compare command fail
+def test_regressions_flagged(tmp_path):
+    historyFilepath = path.join(str(tmp_path), "history.json");
+    makeResult = lambda name, seconds: {"name": name, "params": {"n": 1}, "seconds": seconds, "minSeconds": seconds, "times": [seconds]};
+    baseline = benchmarks.make_history_entry([makeResult("a", 1.0), makeResult("b", 1.0), makeResult("c", 1.0)], "quick");
+    current = benchmarks.make_history_entry([makeResult("a", 1.1), makeResult("b", 1.5), makeResult("d", 9.0)], "quick");
+    benchmarks.append_history(baseline, historyFilepath);
+    benchmarks.append_history(current, historyFilepath);
+
+    comparisons = benchmarks.compare_history(historyFilepath, threshold=0.2, verbose=False);
+    assert [(comparison["key"], comparison["regressed"]) for comparison in comparisons] == [(benchmarks.get_case_key("a", {"n": 1}), False), (benchmarks.get_case_key("b", {"n": 1}), True)];
+    assert benchmarks.main(["--history", historyFilepath, "compare"]) == 1;
+    assert benchmarks.main(["--history", historyFilepath, "compare", "--threshold", "0.6"]) == 0;
+
+
+#Synthetic sweeps can be read with the analysis tools like simulated ones
+def test_synthetic_sweep(tmp_path):
+    for outputFormat in ["csv", "npz", "sweep"]:
+        rootDirectory = path.join(str(tmp_path), outputFormat);
+        benchmarks.write_synthetic_sweep(rootDirectory, sweepSize=3, numReps=2, outputFormat=outputFormat, maxTime=20);
+        paramNames, sweepInfo, growthRates = analysis_tools.extract_from_sweep(rootDirectory, data_extractors.get_population_growth_rate);
+        assert paramNames == ["fertilityRate"] and len(sweepInfo["fertilityRate"]) == 3;
+        assert all(len(values) == 2 and np.all(np.isfinite(values)) for values in growthRates.values());
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path;
+import pytest;
+
+from model import simple_model, agent_store, batch_engine;
+from utilities import parameters, run_tools, checkpoints, output_formats, result_cache;
+
+
+class Interrupted(Exception):
+    pass;
+
+
+#Makes the step after interruptStep raise Interrupted, as if the run had been
+# killed straight after saving its checkpoint at interruptStep.
+def interrupt_after(monkeypatch, interruptStep):
+    originalIsDue = checkpoints.Checkpointer.is_due;
+    def is_due(self, t):
+        if t == interruptStep+1:
+            raise Interrupted();
+        return originalIsDue(self, t);
+    monkeypatch.setattr(checkpoints.Checkpointer, "is_due", is_due);
+
+
+#Counts the number of new populations initialised by the engines (rather than
+# restored from a checkpoint).
+def count_initialisations(monkeypatch):
+    initialisations = [];
+    for module in (simple_model, agent_store, batch_engine):
+        def initialise_agents(*args, original=module.initialise_agents):
+            initialisations.append(args);
+            return original(*args);
+        monkeypatch.setattr(module, "initialise_agents", initialise_agents);
+    return initialisations;
+
+
+#Interrupted runs resume from their last checkpoint, in any output format and
+# with every engine, and give exactly the same output as an uninterrupted run
+@pytest.mark.parametrize("engine, outputFormat, batched, incrementalPairing", [("array", "npz", False, False), ("dataframe", "csv", False, False), ("array", "sweep", True, False), ("array", "npz", False, True)])
+def test_resume_from_checkpoint(tmp_path, monkeypatch, engine, outputFormat, batched, incrementalPairing):
+    monkeypatch.setattr(simple_model, "checkConsistency", True);
+    params = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 40, "mortalityRate": 0.05, "fertilityRate": 0.2, "incrementalPairing": incrementalPairing,
+                                                     "engine": engine, "outputFormat": outputFormat, "outputDirectory": path.join(str(tmp_path), "reference")});
+    reference = run_tools.run_reps(params, numReps=3, verbose=False, seed=5, batched=batched, writeOutput=False, returnResults=True);
+
+    params["outputDirectory"] = path.join(str(tmp_path), "resumed");
+    params["checkpointInterval"] = 10;
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 29);
+        with pytest.raises(Interrupted):
+            run_tools.run_reps(params, numReps=3, verbose=False, seed=5, batched=batched);
+    with monkeypatch.context() as patch:
+        initialisations = count_initialisations(patch);
+        resumed = run_tools.run_reps(params, numReps=3, verbose=False, seed=5, batched=batched, returnResults=True);
+    assert len(initialisations) == (0 if batched else 2); #only the repeats which hadn't started
+
+    for referenceResult, resumedResult in zip(reference, resumed):
+        for name in output_formats.timeSeriesNames:
+            assert np.array_equal(referenceResult.timeSeries[name], resumedResult.timeSeries[name]);
+        assert referenceResult.metadata["stopReason"] == resumedResult.metadata["stopReason"];
+        assert path.exists(checkpoints.get_checkpoint_filepath(resumedResult.params)) == False;
+
+
+#Runs warm started from a burned in population start from its agents, but
+# each run still follows its own random number stream
+def test_warm_start(tmp_path, monkeypatch):
+    burnInParams = parameters.override_default_parameters({"initialPopulationSize": 300, "maxTime": 50, "mortalityRate": 0.02, "fertilityRate": 0.1, "checkpointInterval": 20});
+    burnInParams["seed"] = 3;
+    checkpointFilepath = path.join(str(tmp_path), "burn_in", "checkpoint.npz");
+    simple_model.run_burn_in(burnInParams, checkpointFilepath);
+    burnedIn = checkpoints.load_checkpoint(checkpointFilepath);
+    assert burnedIn["step"] == 49 and len(burnedIn["agents"]["age"]) == burnedIn["timeSeries"][0][-1];
+    assert np.min(burnedIn["agents"]["age"]) == 1; #children born during the burn in, rather than the initial uniform ages
+
+    #A finished burn in isn't repeated
+    modifiedTime = path.getmtime(checkpointFilepath);
+    simple_model.run_burn_in(burnInParams, checkpointFilepath);
+    assert path.getmtime(checkpointFilepath) == modifiedTime;
+
+    params = parameters.override_default_parameters({"initialPopulationSize": 10, "maxTime": 20, "warmStartCheckpoint": checkpointFilepath, "outputDirectory": str(tmp_path)});
+    results = run_tools.run_reps(params, numReps=3, verbose=False, seed=8, writeOutput=False, returnResults=True);
+    batchResults = run_tools.run_reps(params, numReps=3, verbose=False, seed=8, batched=True, writeOutput=False, returnResults=True);
+    dataframeResults = run_tools.run_reps(dict(params, engine="dataframe"), numReps=3, verbose=False, seed=8, writeOutput=False, returnResults=True);
+    for result, batchResult, dataframeResult in zip(results, batchResults, dataframeResults):
+        assert abs(result.timeSeries["popSize"][0]-len(burnedIn["agents"]["age"])) < 0.1*len(burnedIn["agents"]["age"]);
+        assert np.array_equal(result.timeSeries["popSize"], batchResult.timeSeries["popSize"]);
+        assert np.array_equal(result.timeSeries["popSize"], dataframeResult.timeSeries["popSize"]);
+    assert len(set(tuple(result.timeSeries["popSize"]) for result in results)) == 3;
+
+    #Runs without checkpointing don't hash the warm start checkpoint
+    hashed = [];
+    hashFile = output_formats.hash_file;
+    monkeypatch.setattr(output_formats, "hash_file", lambda filepath: hashed.append(filepath) or hashFile(filepath));
+    run_tools.run_reps(params, numReps=2, verbose=False, seed=8);
+    assert checkpointFilepath not in hashed;
+    monkeypatch.undo();
+
+    #The result cache identifies a warm start by its contents, and ignores the checkpoint interval
+    assert result_cache.get_cache_key(params) == result_cache.get_cache_key(dict(params, checkpointInterval=5));
+    cacheKey = result_cache.get_cache_key(params);
+    simple_model.run_burn_in(dict(burnInParams, seed=4), checkpointFilepath);
+    assert result_cache.get_cache_key(params) != cacheKey;
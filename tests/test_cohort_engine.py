@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+
+from model import simple_model, batch_engine, cohort_engine;
+from utilities import parameters, run_tools;
+
+
+#Returns the mean and variance of the population size at each step, and of the
+# total births and deaths, over a set of outputs (runs must not go extinct).
+def summarise(outputs):
+    popSizes = np.array([popSizeTimeSeries for popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries in outputs], dtype=float);
+    totals = np.array([[np.sum(birthsTimeSeries), np.sum(deathsTimeSeries)] for popSizeTimeSeries, deathsTimeSeries, birthsTimeSeries in outputs], dtype=float);
+    values = np.concatenate([popSizes, totals], axis=1);
+    return np.mean(values, axis=0), np.var(values, axis=0, ddof=1), len(outputs);
+
+
+#The cohort engine's output has the same distribution as the agent based
+# reference: the means of the population size (at every step) and of the total
+# births and deaths agree to within sampling error, as do their variances.
+def test_cohort_engine_matches_agents(monkeypatch):
+    monkeypatch.setattr(simple_model, "checkConsistency", True);
+    params = parameters.override_default_parameters({"initialPopulationSize": 300, "maxTime": 30, "fertilityRate": 0.15, "mortalityRate": 0.03});
+    numReps = 400;
+    seedSequence = np.random.SeedSequence(20);
+    agentOutputs = batch_engine.simulate_batch(params, [np.random.default_rng(seed) for seed in seedSequence.spawn(numReps)]);
+    cohortOutputs = [cohort_engine.simulate(params, np.random.default_rng(seed)) for seed in seedSequence.spawn(numReps)];
+
+    agentMeans, agentVariances, n = summarise(agentOutputs);
+    cohortMeans, cohortVariances, n = summarise(cohortOutputs);
+    zScores = (cohortMeans-agentMeans)/np.sqrt((agentVariances+cohortVariances)/n);
+    assert np.max(np.abs(zScores)) < 4.5;
+    #The variance of a sample variance is roughly 2*variance^2/(n-1) for approximately normal output
+    varianceRatios = cohortVariances/agentVariances;
+    assert np.all(np.abs(np.log(varianceRatios)) < 4.5*np.sqrt(4/(n-1)));
+    #The population grows, so the comparison isn't dominated by the initial population
+    assert agentMeans[params["maxTime"]-1] > 1.25*params["initialPopulationSize"];
+
+
+#Huge populations can be simulated, and grow at the rate expected from the
+# small population runs. That they take no longer than small ones is tracked by
+# the cohort_run_model benchmark case (see utilities/benchmarks.py).
+def test_cohort_engine_large_population():
+    params = parameters.override_default_parameters({"initialPopulationSize": 10**9, "maxTime": 50, "engine": "cohort"});
+    params["seed"] = 1;
+    result = simple_model.run_model(params, writeOutput=False, returnResult=True);
+    assert len(result.timeSeries["popSize"]) == 50;
+    popSizes = result.timeSeries["popSize"];
+    assert np.all(popSizes[1:] == popSizes[0:-1]+result.timeSeries["births"][1:]-result.timeSeries["deaths"][1:]);
+
+    smallResults = run_tools.run_reps(dict(params, initialPopulationSize=10**5), numReps=4, verbose=False, seed=2, writeOutput=False, returnResults=True);
+    smallGrowth = np.mean([smallResult.timeSeries["popSize"][-1]/10**5 for smallResult in smallResults]);
+    assert abs(popSizes[-1]/10**9/smallGrowth-1) < 0.01;
@@ -13,13 +13,13 @@ import numpy as np;
 # Example unit tests. User-written functions should be tested.
 
 
-from model.simple_model import initialise_agents, age_agents, pair_unmarried_agents, maxAge, childAge, NO_PARTNER;
+from model.simple_model import initialise_agents, age_agents, pair_unmarried_agents, do_mortality, add_newly_born_agents, check_consistency, maxAge, childAge, NO_PARTNER;
 
 
 #Test that initialised agents have the expected data format
 def test_initialise_agents():
     n=5000;
-    agents = initialise_agents(numAgents = n);
+    agents = initialise_agents(numAgents = n, rng = np.random.default_rng());
     assert isinstance(agents, pd.DataFrame);
     assert len(agents) == n;
     assert list(agents.keys()) == ["age", "isFemale", "partner"];
@@ -29,7 +29,7 @@ def test_initialise_agents():
 
 def test_age_agents():
     n=100;
-    agents = initialise_agents(numAgents = n);
+    agents = initialise_agents(numAgents = n, rng = np.random.default_rng());
     
     firstAges = agents["age"];
     age_agents(agents);
@@ -38,12 +38,12 @@ def test_age_agents():
 
 def test_pair_unmarried_agents():
     n=5000;
-    agents = initialise_agents(numAgents = n);
+    agents = initialise_agents(numAgents = n, rng = np.random.default_rng());
     #agents are initialised with no partner
     assert np.all(agents["partner"] == NO_PARTNER);
     
     #After partnering, at least some agents will be partnered.
-    pair_unmarried_agents(agents);
+    pair_unmarried_agents(agents, np.random.default_rng());
     assert np.any(agents["partner"] != NO_PARTNER);
     
     #Check no children are partnered
@@ -55,12 +55,26 @@ def test_pair_unmarried_agents():
     couple["age"] = [20, 20];
     couple["isFemale"] = [True, False];
     couple["partner"] = [NO_PARTNER, NO_PARTNER];
-    pair_unmarried_agents(couple);
+    pair_unmarried_agents(couple, np.random.default_rng());
     assert np.all(couple["partner"] == [1, 0]); #They should be partnered with each other.
 
 
+#Surviving partners of dead agents become unpartnered, and IDs are never reused
+def test_do_mortality_widows_partners():
+    n=1000;
+    agents = initialise_agents(numAgents = n, rng = np.random.default_rng());
+    agents["age"] = childAge+1;
+    pair_unmarried_agents(agents, np.random.default_rng());
+    agents, numDeaths = do_mortality(agents, 0.5, np.random.default_rng());
+    assert numDeaths > 0;
+    check_consistency(agents); #Fails if any partner link points to a dead agent
+    
+    agents = add_newly_born_agents(agents, [0, 1], np.random.default_rng());
+    assert list(agents.index[-2:]) == [n, n+1];
+    check_consistency(agents);
+
+
 if __name__ == "__main__":
-    np.random.seed();
     retcode = pytest.main();
 
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path, listdir;
+
+from utilities import parameters, run_tools, output_formats, data_extractors, analysis_tools;
+
+
+#Every output format should read back the same time series and parameters
+def test_formats_read_back_identically(tmp_path):
+    timeSeries = {};
+    for outputFormat in ["csv", "npz", "sweep"]:
+        params = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 20, "outputFormat": outputFormat, "outputDirectory": path.join(str(tmp_path), outputFormat)});
+        run_tools.run_reps(params, numReps=2, verbose=False, seed=99);
+        repDirectory = path.join(str(tmp_path), outputFormat, "rep=1");
+        timeSeries[outputFormat] = output_formats.load_time_series(repDirectory);
+        assert data_extractors.get_params_file(repDirectory)["seedSpawnKey"] == [1];
+        assert len(analysis_tools.extract_from_repeats(path.join(str(tmp_path), outputFormat), data_extractors.get_population_growth_rate)) == 2;
+
+    #The sweep format has no per-run directories, just the consolidated dataset
+    assert path.exists(path.join(str(tmp_path), "sweep", "rep=1")) == False;
+    assert output_formats.datasetFilename in listdir(path.join(str(tmp_path), "sweep"));
+    assert path.exists(path.join(str(tmp_path), "npz", "rep=1", output_formats.csvFilename)) == False;
+    for name in output_formats.timeSeriesNames:
+        assert np.array_equal(timeSeries["csv"][name], timeSeries["npz"][name]);
+        assert np.array_equal(timeSeries["csv"][name], timeSeries["sweep"][name]);
+
+
+#extract_from_sweep finds the (virtual) run directories stored in a sweep dataset
+def test_extract_from_sweep_dataset(tmp_path):
+    sweepData = {};
+    for outputFormat in ["csv", "sweep"]:
+        baseParams = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 20, "outputFormat": outputFormat, "outputDirectory": path.join(str(tmp_path), outputFormat)});
+        run_tools.run_sweep(baseParams, ["fertilityRate", "mortalityRate"], [[0.05, 0.1], [0.01, 0.02]], numReps=3, verbose=False, seed=5);
+        sweepData[outputFormat] = analysis_tools.extract_from_sweep(path.join(str(tmp_path), outputFormat), data_extractors.get_population_growth_rate);
+
+    assert sweepData["csv"] == sweepData["sweep"];
+    assert len(sweepData["sweep"][2][0.1][0.02]) == 3;
+    index = output_formats.load_dataset_index(path.join(str(tmp_path), "sweep"));
+    assert len(index) == 12 and sorted(set(index["rep"])) == [0, 1, 2];
+
+    #Runs stored in the dataset are skipped when the sweep is run again
+    datasetFilepath = path.join(str(tmp_path), "sweep", output_formats.datasetFilename);
+    modifiedTime = path.getmtime(datasetFilepath);
+    run_tools.run_sweep(baseParams, ["fertilityRate", "mortalityRate"], [[0.05, 0.1], [0.01, 0.02]], numReps=3, verbose=False, seed=5);
+    assert path.getmtime(datasetFilepath) == modifiedTime;
+    assert listdir(path.join(str(tmp_path), "sweep", output_formats.datasetPartsDirname)) == [];
+
+
+#Checking whether a run of a sweep dataset has already been written only reads
+# its part file and the run paths of the consolidated dataset, never merging
+# the whole dataset, and works for params written before outputFormat existed
+def test_sweep_run_exists_without_loading_dataset(tmp_path, monkeypatch):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 50, "maxTime": 5, "outputFormat": "sweep", "outputDirectory": str(tmp_path)});
+    def fail(datasetDirectory):
+        raise AssertionError("Dataset loaded while running a sweep");
+    monkeypatch.setattr(output_formats, "load_dataset", fail);
+    run_tools.run_sweep(baseParams, ["fertilityRate"], [[0.05, 0.1]], numReps=2, verbose=False, seed=5);
+    datasetFilepath = path.join(str(tmp_path), output_formats.datasetFilename);
+    modifiedTime = path.getmtime(datasetFilepath);
+    run_tools.run_sweep(baseParams, ["fertilityRate"], [[0.05, 0.1]], numReps=2, verbose=False, seed=5);
+    assert path.getmtime(datasetFilepath) == modifiedTime;
+
+    params = dict(baseParams, datasetDirectory=str(tmp_path), outputDirectory=path.join(str(tmp_path), "fertilityRate=0.1", "rep=1"));
+    assert output_formats.get_writer(params).exists(params);
+    assert output_formats.get_writer(params).exists(dict(params, outputDirectory=path.join(str(tmp_path), "fertilityRate=0.1", "rep=5"))) == False;
+    del params["outputFormat"];
+    assert isinstance(output_formats.get_writer(params), output_formats.CsvWriter);
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path;
+import json;
+
+from utilities import parameters, run_tools, profiling, output_formats;
+
+
+#Profiled runs store the time of each phase of every step next to their
+# output, without changing it, and sweeps summarise the profiles of their runs
+def test_profiled_sweep(tmp_path):
+    params = parameters.override_default_parameters({"initialPopulationSize": 200, "maxTime": 25, "outputDirectory": path.join(str(tmp_path), "unprofiled")});
+    unprofiled = run_tools.run_sweep(params, ["fertilityRate"], [[0.05, 0.1]], numReps=2, verbose=False, seed=3, returnResults=True);
+    assert profiling.find_profile_filepaths(params["outputDirectory"]) == [];
+    params.update({"profile": "time", "outputDirectory": path.join(str(tmp_path), "profiled")});
+    profiled = run_tools.run_sweep(params, ["fertilityRate"], [[0.05, 0.1]], numReps=2, verbose=False, seed=3, returnResults=True);
+
+    for unprofiledResult, result in zip(unprofiled, profiled):
+        assert np.array_equal(unprofiledResult.timeSeries["popSize"], result.timeSeries["popSize"]);
+        profile = profiling.load_profile(path.join(result.outputDirectory, profiling.profileFilename));
+        assert profile["stepSeconds"].shape == (len(result.timeSeries["popSize"]), len(profiling.stepPhaseNames));
+        assert np.all(profile["stepSeconds"] >= 0) and np.all(profile["memoryMB"] > 0);
+        assert np.array_equal(profile["popSize"], result.timeSeries["popSize"]);
+        assert set(profile["runPhaseNames"]) == {"initialise", "output"};
+        assert "profile" not in output_formats.load_metadata(result.outputDirectory);
+
+    with open(path.join(params["outputDirectory"], profiling.sweepProfileFilename)) as file:
+        summary = json.load(file);
+    assert summary["numRuns"] == 4 and summary["numSteps"] == 4*25;
+    assert set(summary["phases"].keys()) == set(profiling.stepPhaseNames) | {"initialise", "output"};
+    assert abs(sum(phase["fraction"] for phase in summary["phases"].values())-1) < 1e-9;
+    assert "memory" not in summary;
+
+
+#Memory profiles of batched runs stored in a sweep dataset are kept next to
+# the first repeat's part file, and count every repeat in the batch
+def test_memory_profile_of_batch(tmp_path):
+    params = parameters.override_default_parameters({"initialPopulationSize": 300, "maxTime": 10, "outputFormat": "sweep", "profile": "memory", "outputDirectory": str(tmp_path)});
+    results = run_tools.run_reps(params, numReps=3, verbose=False, seed=4, batched=True, returnResults=True);
+    profileFilepaths = profiling.find_profile_filepaths(str(tmp_path));
+    assert profileFilepaths == [profiling.get_profile_filepath(results[0].params)];
+    profile = profiling.load_profile(profileFilepaths[0]);
+    assert int(profile["batchSize"]) == 3 and profile["stepNetBytes"].shape == (10, len(profiling.stepPhaseNames));
+    assert np.max(profile["stepPeakBytes"][:, list(profiling.stepPhaseNames).index("reproduction")]) > 0;
+    assert np.array_equal(profile["popSize"], np.sum([result.timeSeries["popSize"] for result in results], axis=0));
+
+    summary = profiling.write_sweep_profile(str(tmp_path));
+    assert summary["numRuns"] == 3 and summary["numProfiles"] == 1;
+    assert set(summary["memory"].keys()) == set(profiling.stepPhaseNames);
+    assert len(output_formats.list_subdirectories(str(tmp_path))) == 3; #profiles aren't mistaken for runs
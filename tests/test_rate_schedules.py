@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path, listdir, makedirs;
+import pytest;
+
+from model import simple_model, agent_store, batch_engine, cohort_engine;
+from utilities import parameters, rate_schedules, result_cache, filepaths;
+
+
+#Uses a temporary input data directory and schedule cache, and returns a
+# function which writes a schedule file to it.
+@pytest.fixture
+def write_schedule(tmp_path, monkeypatch):
+    monkeypatch.setattr(filepaths, "inputDataDir", path.join(str(tmp_path), "input_data"));
+    monkeypatch.setattr(filepaths, "rateScheduleCacheDir", path.join(str(tmp_path), "cache"));
+    monkeypatch.setattr(rate_schedules, "loadedTables", {});
+    def write(filename, text):
+        makedirs(filepaths.inputDataDir, exist_ok=True);
+        filepath = path.join(filepaths.inputDataDir, filename);
+        with open(filepath, "w") as file:
+            file.write(text);
+        return filename;
+    return write;
+
+
+#Schedules in age bands are expanded to one row per age, with sexes in columns
+def test_compile_schedule(write_schedule):
+    table = rate_schedules.load_table(write_schedule("life_table.csv", "age,male,female\n0,0.1,0.2\n2,0.3,0.4\n5,0.5,0.6\n"));
+    assert table.shape == (6, 2);
+    assert np.array_equal(table, [[0.1, 0.2], [0.1, 0.2], [0.3, 0.4], [0.3, 0.4], [0.3, 0.4], [0.5, 0.6]]);
+    #Agents older than the schedule use its last row
+    rates = simple_model.get_agent_rates(table, np.array([0, 3, 5, 90], dtype=np.int16), np.array([True, False, True, False]));
+    assert np.array_equal(rates, [0.2, 0.3, 0.6, 0.5]);
+    assert np.array_equal(rate_schedules.load_table(write_schedule("both.csv", "age,rate\n0,0.25\n")), [[0.25, 0.25]]);
+
+    for text in ["age,rate\n1,0.1\n", "age,rate\n0,0.1\n5,0.2\n3,0.1\n", "age,rate\n0,1.5\n", "age,male\n0,0.1\n", "years,rate\n0,0.1\n"]:
+        with pytest.raises(ValueError):
+            rate_schedules.load_table(write_schedule("bad.csv", text));
+
+
+#Compiled tables are stored once and shared as read-only memory maps, and
+# recompiled when the schedule changes
+def test_table_cache(write_schedule, monkeypatch):
+    schedule = write_schedule("life_table.csv", "age,rate\n0,0.01\n50,0.2\n");
+    table = rate_schedules.load_table(schedule);
+    assert isinstance(table, np.memmap) and table.flags.writeable == False;
+    assert rate_schedules.load_table(schedule) is table;
+    rate_schedules.loadedTables.clear(); #as in a new worker process
+    assert np.array_equal(rate_schedules.load_table(schedule), table) and len(listdir(filepaths.rateScheduleCacheDir)) == 1;
+
+    params = parameters.override_default_parameters({"mortalitySchedule": schedule});
+    params["seed"] = 1;
+    key = result_cache.get_cache_key(params);
+    write_schedule("life_table.csv", "age,rate\n0,0.01\n50,0.3\n");
+    assert rate_schedules.load_table(schedule)[50, 0] == 0.3;
+    assert result_cache.get_cache_key(params) != key;
+    assert len(rate_schedules.loadedTables) == 1; #the old table was dropped
+
+    #Only the most recently loaded schedules are kept
+    monkeypatch.setattr(rate_schedules, "maxLoadedTables", 2);
+    others = [write_schedule("other"+str(i)+".csv", "age,rate\n0,0.0"+str(i+1)+"\n") for i in range(2)];
+    for other in others:
+        rate_schedules.load_table(other);
+    assert len(rate_schedules.loadedTables) == 2 and rate_schedules.load_table(others[1]) is rate_schedules.load_table(others[1]);
+
+
+#Schedules with the same rate at every age give exactly the same output as the
+# single rates, with every agent based engine
+def test_constant_schedules_match_rates(write_schedule):
+    params = parameters.override_default_parameters({"initialPopulationSize": 400, "maxTime": 40, "fertilityRate": 0.1, "mortalityRate": 0.03});
+    scheduleParams = dict(params, fertilitySchedule=write_schedule("fertility.csv", "age,rate\n0,0.1\n"), mortalitySchedule=write_schedule("mortality.csv", "age,male,female\n0,0.03,0.03\n"));
+    for simulate in (simple_model.simulate, agent_store.simulate):
+        assert np.array_equal(simulate(params, np.random.default_rng(3)), simulate(scheduleParams, np.random.default_rng(3)));
+    rngs = lambda: [np.random.default_rng(seed) for seed in (4, 5)];
+    assert np.array_equal(batch_engine.simulate_batch(params, rngs()), batch_engine.simulate_batch(scheduleParams, rngs()));
+    with pytest.raises(ValueError):
+        cohort_engine.simulate(scheduleParams, np.random.default_rng(3));
+
+
+#Rates depend on each agent's age and sex
+def test_age_and_sex_specific_rates(write_schedule):
+    mortality = rate_schedules.load_table(write_schedule("mortality.csv", "age,male,female\n0,0,0\n60,1,0\n"));
+    fertility = rate_schedules.load_table(write_schedule("fertility.csv", "age,male,female\n0,1,0\n20,1,1\n30,1,0\n"));
+    rng = np.random.default_rng(6);
+    for engine in (simple_model, agent_store):
+        population = engine.initialise_agents(2000, rng);
+        population = engine.pair_unmarried_agents(population, rng);
+        state = engine.get_agent_state(population);
+        wMothers = state["isFemale"] & (state["partner"] != simple_model.NO_PARTNER) & (state["age"] >= 20) & (state["age"] < 30);
+        population, numBirths = engine.do_reproduction(population, fertility, rng);
+        assert numBirths == np.sum(wMothers) > 0; #only (and all) mothers aged 20-29 reproduce
+        population, numDeaths = engine.do_mortality(population, mortality, rng);
+        assert numDeaths == np.sum((state["age"] >= 60) & (state["isFemale"] == False)); #only (and all) men aged 60+ die
+
+
+#Run costs are estimated from the mean rates of a schedule, rather than the
+# single rates it replaces
+def test_schedule_run_cost(write_schedule):
+    params = parameters.override_default_parameters({"initialPopulationSize": 400, "maxTime": 40, "fertilityRate": 0.1, "mortalityRate": 0.03});
+    constant = dict(params, fertilitySchedule=write_schedule("fertility.csv", "age,rate\n0,0.1\n"), mortalitySchedule=write_schedule("mortality.csv", "age,rate\n0,0.03\n"));
+    assert simple_model.estimate_run_cost(constant) == pytest.approx(simple_model.estimate_run_cost(params));
+    declining = dict(constant, mortalitySchedule=np.full((100, 2), 0.2));
+    assert simple_model.estimate_run_cost(declining) < simple_model.estimate_run_cost(params);
+    childless = dict(constant, fertilitySchedule=write_schedule("childless.csv", "age,male,female\n0,0.5,0.5\n10,0,0\n"));
+    assert simple_model.estimate_run_cost(childless) < simple_model.estimate_run_cost(params);
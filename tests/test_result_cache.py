@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path, stat, listdir, utime;
+
+from model import simple_model;
+from utilities import parameters, run_tools, output_formats, filepaths, result_cache;
+
+
+#Runs already in the cache are copied from it (under any outputDirectory and in
+# any output format) instead of being simulated again
+def test_cache_hits_reuse_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(filepaths, "resultCacheDir", path.join(str(tmp_path), "cache"));
+    ran = [];
+    runModel = simple_model.run_model;
+    monkeypatch.setattr(simple_model, "run_model", lambda params, *args, **kwargs: ran.append(params["outputDirectory"]) or runModel(params, *args, **kwargs));
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "first")});
+    first = run_tools.run_sweep(baseParams, "fertilityRate", [0.05, 0.1], numReps=2, verbose=False, seed=8, returnResults=True, useResultCache=True);
+    assert len(ran) == 4 and len(listdir(filepaths.resultCacheDir)) == 4;
+
+    del ran[:];
+    for outputFormat in ["csv", "npz"]:
+        baseParams.update({"outputFormat": outputFormat, "outputDirectory": path.join(str(tmp_path), outputFormat)});
+        second = run_tools.run_sweep(baseParams, "fertilityRate", [0.05, 0.1], numReps=2, verbose=False, seed=8, returnResults=True, useResultCache=True);
+        assert ran == [];
+        for firstResult, secondResult in zip(first, second):
+            assert secondResult.metadata["cacheHit"] and output_formats.load_params(secondResult.outputDirectory)["outputDirectory"] == secondResult.outputDirectory;
+            for name in output_formats.timeSeriesNames:
+                assert np.array_equal(secondResult.timeSeries[name], firstResult.timeSeries[name]);
+                assert np.array_equal(output_formats.load_time_series(secondResult.outputDirectory)[name], firstResult.timeSeries[name]);
+    #CSV output is hard linked rather than copied
+    assert stat(output_formats.get_output_filepath(second[0].outputDirectory.replace("npz", "csv"))).st_ino == stat(output_formats.get_output_filepath(first[0].outputDirectory)).st_ino;
+
+    #A different seed or model version isn't a hit
+    run_tools.run_reps(baseParams, 1, verbose=False, seed=9, useResultCache=True);
+    monkeypatch.setattr(simple_model, "modelVersion", "test");
+    run_tools.run_single(first[0].params.copy(), skipIfExists=False, overwriteSeed=8, useResultCache=True);
+    assert len(ran) == 2;
+
+
+#The least recently used entries are removed when the cache is too big
+def test_cache_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(filepaths, "resultCacheDir", path.join(str(tmp_path), "cache"));
+    params = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "reps")});
+    results = run_tools.run_reps(params, 3, verbose=False, seed=1, writeOutput=False, returnResults=True, useResultCache=True);
+    entries = [result_cache.lookup(result.params) for result in results];
+    for i, entryDirectory in enumerate(entries):
+        utime(entryDirectory, (i, i));
+    result_cache.lookup(results[0].params); #now the most recently used
+    entrySize = sum(stat(path.join(entries[1], filename)).st_size for filename in listdir(entries[1]));
+    result_cache.evict(maxBytes=2*entrySize+10);
+    assert [path.exists(entryDirectory) for entryDirectory in entries] == [True, False, True];
+
+
+#Runs cut short by a time or memory budget aren't cached, as their result
+# depends on the machine, and profiling doesn't change a run's key
+def test_cache_skips_budget_stops(tmp_path, monkeypatch):
+    monkeypatch.setattr(filepaths, "resultCacheDir", path.join(str(tmp_path), "cache"));
+    params = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "maxRunTime": 0, "outputDirectory": path.join(str(tmp_path), "budget")});
+    results = run_tools.run_reps(params, 2, verbose=False, seed=1, writeOutput=False, returnResults=True, useResultCache=True);
+    assert all(result.metadata["stopReason"] == "maxRunTime" for result in results);
+    assert path.exists(filepaths.resultCacheDir) == False or listdir(filepaths.resultCacheDir) == [];
+
+    params.update({"maxRunTime": None, "profile": "time"});
+    results = run_tools.run_reps(params, 2, verbose=False, seed=1, writeOutput=False, returnResults=True, useResultCache=True);
+    assert len(listdir(filepaths.resultCacheDir)) == 2;
+    assert result_cache.lookup(dict(results[0].params, profile=None)) is not None;
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+import pandas as pd;
+from os import path, remove;
+import pytest;
+import json;
+
+from model import simple_model;
+from utilities import parameters, run_tools, status_codes, output_formats, sweep_manifest, data_extractors, analysis_tools;
+
+
+#A run's random number generator is its node in the SeedSequence tree rooted at params["seed"]
+def test_seed_tree():
+    seed = run_tools.generate_seed();
+    assert json.loads(json.dumps(seed)) == seed; #128 bit seeds survive being written to params_used.json
+    params = {"seed": seed, "seedSpawnKey": [2, 1]};
+    expected = np.random.default_rng(np.random.SeedSequence(seed).spawn(3)[2].spawn(2)[1]);
+    assert simple_model.make_rng(params).random() == expected.random();
+
+
+#Running a sweep again with the same root seed reproduces every run
+def test_param_sets_reproducible_from_seed(tmp_path):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 20});
+    for name in ["first", "second"]:
+        baseParams["outputDirectory"] = path.join(str(tmp_path), name);
+        run_tools.run_param_sets(baseParams, ["low", "high"], [{"fertilityRate": 0.05}, {"fertilityRate": 0.1}], numReps=2, verbose=False, seed=1234);
+    
+    for paramSetName in ["low", "high"]:
+        for rep in ["rep=0", "rep=1"]:
+            with open(path.join(str(tmp_path), "first", paramSetName, rep, "params_used.json")) as file:
+                assert json.load(file)["seedSpawnKey"] == [["low", "high"].index(paramSetName), int(rep[-1])];
+            first = pd.read_csv(path.join(str(tmp_path), "first", paramSetName, rep, "time_series_outputs.csv"));
+            second = pd.read_csv(path.join(str(tmp_path), "second", paramSetName, rep, "time_series_outputs.csv"));
+            assert first.equals(second);
+
+
+#Results can be returned in memory without writing anything to disk, or
+# written asynchronously by the calling process, with identical output
+def test_in_memory_and_async_results(tmp_path):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "in_memory")});
+    results = run_tools.run_param_sets(baseParams, ["low", "high"], [{"fertilityRate": 0.05}, {"fertilityRate": 0.1}], numReps=2, verbose=False, seed=42, writeOutput=False, returnResults=True);
+    assert path.exists(baseParams["outputDirectory"]) == False;
+    assert [result.status for result in results] == [status_codes.SUCCESSFUL]*4;
+    assert [result.params["seedSpawnKey"] for result in results] == [[0, 0], [0, 1], [1, 0], [1, 1]];
+    assert results[3].metadata["runTime"] > 0;
+
+    baseParams["outputDirectory"] = path.join(str(tmp_path), "async");
+    statuses = run_tools.run_param_sets(baseParams, ["low", "high"], [{"fertilityRate": 0.05}, {"fertilityRate": 0.1}], numReps=2, numCores=2, verbose=False, seed=42, writeOutput="async");
+    assert statuses == [status_codes.SUCCESSFUL]*4;
+    for result in results:
+        written = pd.read_csv(path.join(str(tmp_path), "async", path.relpath(result.outputDirectory, path.join(str(tmp_path), "in_memory")), "time_series_outputs.csv"));
+        for name, values in result.timeSeries.items():
+            assert np.array_equal(written[name].to_numpy(), values);
+
+    #Batched repeats return the same results as unbatched repeats
+    repResults = run_tools.run_reps(baseParams, 3, verbose=False, seed=7, writeOutput=False, returnResults=True);
+    batchResults = run_tools.run_reps(baseParams, 3, verbose=False, seed=7, batched=True, writeOutput=False, returnResults=True);
+    for repResult, batchResult in zip(repResults, batchResults):
+        assert all(np.array_equal(repResult.timeSeries[name], batchResult.timeSeries[name]) for name in repResult.timeSeries);
+
+
+#Expensive tasks are scheduled first and cheap tasks are chunked together,
+# but results are returned in the original order
+def test_scheduler(tmp_path):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 50, "maxTime": 20, "outputDirectory": str(tmp_path)});
+    paramSetOverrides = [{"initialPopulationSize": n} for n in [50]*6+[5000]];
+    tasks = [(str(i), run_tools.run_single, (parameters.override_default_parameters(overrides),), {}) for i, overrides in enumerate(paramSetOverrides)];
+    chunks = run_tools.schedule_tasks(tasks, numCores=2);
+    assert chunks[0] == [6];
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(7)) and len(chunks) < 7;
+
+    results = run_tools.run_param_sets(baseParams, [str(i) for i in range(7)], paramSetOverrides, numReps=2, numCores=2, verbose=False, writeOutput=False, returnResults=True);
+    assert [result.params["seedSpawnKey"] for result in results] == [[i, r] for i in range(7) for r in range(2)];
+    assert results[-1].timeSeries["popSize"][0] > 1000;
+
+
+#Worker processes are started once and reused by consecutive calls
+def test_runner_reuses_workers(tmp_path):
+    params = parameters.override_default_parameters({"initialPopulationSize": 50, "maxTime": 10});
+    with run_tools.Runner(2, startMethod="forkserver") as runner:
+        for name in ["first", "second", "third"]:
+            params["outputDirectory"] = path.join(str(tmp_path), name);
+            statuses = run_tools.run_reps(params, 4, verbose=False, runner=runner);
+            assert list(statuses) == [status_codes.SUCCESSFUL]*4;
+        assert runner.numWorkersStarted == 2;
+    assert runner.executor is None;
+    assert run_tools.get_runner(2) is run_tools.get_runner(2);
+
+
+#An interrupted sweep is resumed by running it again: runs the manifest records
+# as done are skipped, and runs left queued, running or half written are re-run
+def test_resume_from_manifest(tmp_path, monkeypatch):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": str(tmp_path)});
+    expected = run_tools.run_sweep(baseParams, "fertilityRate", [0.05, 0.1], numReps=3, verbose=False, seed=4, returnResults=True);
+    manifestFilepath = sweep_manifest.get_manifest_filepath(str(tmp_path));
+    runDirectories = [result.outputDirectory for result in expected];
+    assert set(sweep_manifest.get_states(manifestFilepath, runDirectories).values()) == {sweep_manifest.DONE};
+    assert all(sweep_manifest.verify_run(manifestFilepath, runDirectory) for runDirectory in runDirectories);
+
+    #Simulate a crash: one run was killed after writing only its parameters,
+    # another was still queued
+    interrupted, queued = runDirectories[1], runDirectories[4];
+    remove(path.join(interrupted, output_formats.csvFilename));
+    sweep_manifest.set_states(manifestFilepath, [interrupted], sweep_manifest.RUNNING);
+    sweep_manifest.set_states(manifestFilepath, [queued], sweep_manifest.QUEUED);
+
+    ran = [];
+    runModel = simple_model.run_model;
+    monkeypatch.setattr(simple_model, "run_model", lambda params, *args, **kwargs: ran.append(params["outputDirectory"]) or runModel(params, *args, **kwargs));
+    csvExists = output_formats.CsvWriter.exists;
+    monkeypatch.setattr(output_formats.CsvWriter, "exists", lambda self, params: csvExists(self, params) if params["outputDirectory"] in [interrupted, queued] else pytest.fail("done runs shouldn't be looked for on disk"));
+    #Without a seed, the resumed runs use the seed recorded in the manifest
+    resumed = run_tools.run_sweep(baseParams, "fertilityRate", [0.05, 0.1], numReps=3, verbose=False, returnResults=True);
+    assert sorted(ran) == sorted([interrupted, queued]);
+    assert [result.status for result in resumed] == [status_codes.SKIPPED if runDirectory not in ran else status_codes.SUCCESSFUL for runDirectory in runDirectories];
+    assert np.array_equal(resumed[1].timeSeries["popSize"], expected[1].timeSeries["popSize"]);
+    assert sweep_manifest.verify_run(manifestFilepath, interrupted);
+
+    #Output changed since it was recorded no longer verifies
+    with open(path.join(queued, output_formats.csvFilename), "a") as file:
+        file.write("\n");
+    assert sweep_manifest.verify_run(manifestFilepath, queued) == False;
+
+    #The same goes for repeats first run without a seed
+    monkeypatch.undo();
+    repsParams = dict(baseParams, outputDirectory=path.join(str(tmp_path), "reps"));
+    first = run_tools.run_reps(repsParams, 2, verbose=False, returnResults=True);
+    remove(path.join(first[1].outputDirectory, output_formats.csvFilename));
+    sweep_manifest.set_states(sweep_manifest.get_manifest_filepath(repsParams["outputDirectory"]), [first[1].outputDirectory], sweep_manifest.RUNNING);
+    second = run_tools.run_reps(repsParams, 2, verbose=False, returnResults=True);
+    assert second[0].status == status_codes.SKIPPED and second[1].params["seed"] == first[1].params["seed"];
+    assert np.array_equal(second[1].timeSeries["popSize"], first[1].timeSeries["popSize"]);
+
+
+#Adaptive repeats stop each parameter set once its confidence interval is
+# narrow enough, and match the same repeats of a fixed size sweep
+def test_adaptive_reps(tmp_path):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 200, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "adaptive")});
+    adaptiveReps = run_tools.AdaptiveReps(data_extractors.get_population_growth_rate, tolerance=0.004, minReps=3, waveSize=4, maxReps=15);
+    results = run_tools.run_sweep(baseParams, "mortalityRate", [0.01, 0.05], numReps=adaptiveReps, verbose=False, seed=21, returnResults=True);
+    growthRates = analysis_tools.extract_from_sweep(baseParams["outputDirectory"], data_extractors.get_population_growth_rate)[2];
+    for mortalityRate in [0.01, 0.05]:
+        numReps = len(growthRates[mortalityRate]);
+        assert numReps in (3, 7, 11, 15);
+        low, high = analysis_tools.get_confidence_interval(growthRates[mortalityRate]);
+        assert high-low < 0.004 or numReps == 15;
+        if numReps > 3: #the previous wave hadn't converged
+            low, high = analysis_tools.get_confidence_interval(growthRates[mortalityRate][0:numReps-4]);
+            assert high-low >= 0.004;
+    assert [len(growthRates[0.01]), len(growthRates[0.05])] == [3, 7];
+    assert len(results) == sum(len(values) for values in growthRates.values());
+
+    baseParams["outputDirectory"] = path.join(str(tmp_path), "fixed");
+    fixed = run_tools.run_sweep(baseParams, "mortalityRate", [0.01, 0.05], numReps=3, verbose=False, seed=21, returnResults=True);
+    assert np.array_equal(fixed[0].timeSeries["popSize"], results[0].timeSeries["popSize"]);
+
+    #t quantiles used for the intervals
+    assert np.isclose(analysis_tools.get_t_quantile(0.975, 1), 12.7062, rtol=1e-5) and np.isclose(analysis_tools.get_t_quantile(0.975, 10), 2.228139, rtol=1e-5);
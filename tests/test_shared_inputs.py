@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path, listdir, makedirs;
+import subprocess;
+import pickle;
+import sys;
+import pytest;
+
+from model import simple_model;
+from utilities import parameters, run_tools, shared_inputs, output_formats, result_cache;
+
+
+#Uses a temporary directory for broadcasts, and broadcasts arrays of any size.
+@pytest.fixture
+def broadcastRoot(tmp_path, monkeypatch):
+    broadcastRoot = path.join(str(tmp_path), "broadcasts");
+    makedirs(broadcastRoot);
+    monkeypatch.setattr(shared_inputs, "broadcastRoot", broadcastRoot);
+    monkeypatch.setattr(shared_inputs, "minBroadcastBytes", 1000);
+    return broadcastRoot;
+
+
+#Large arrays are replaced by handles to a single copy, which workers attach
+# as read-only memory maps and detach from their results
+def test_broadcast_tasks(broadcastRoot):
+    table = np.full((200, 2), 0.02);
+    paramsList = [{"mortalitySchedule": table, "small": np.zeros(3), "seed": i} for i in range(3)];
+    tasks = [("run", run_tools.run_single, (params,), {}) for params in paramsList]+[("batch", run_tools.run_batch, (paramsList,), {})];
+    with shared_inputs.Broadcast() as broadcast:
+        sharedTasks = broadcast.share_tasks(tasks);
+        assert len(listdir(broadcast.directory)) == 1;
+        assert len(pickle.dumps(sharedTasks)) < table.nbytes;
+        handle = sharedTasks[0][2][0]["mortalitySchedule"];
+        assert isinstance(handle, shared_inputs.ArrayHandle) and sharedTasks[3][2][0][2]["mortalitySchedule"].filepath == handle.filepath;
+        assert paramsList[0]["mortalitySchedule"] is table; #the caller's params are unchanged
+
+        attached = {};
+        args, detach_results = shared_inputs.attach_task_args(sharedTasks[3][2], attached);
+        attachedTable = args[0][0]["mortalitySchedule"];
+        assert isinstance(attachedTable, np.memmap) and attachedTable.flags.writeable == False and np.array_equal(attachedTable, table);
+        assert args[0][1]["mortalitySchedule"] is attachedTable and len(attached) == 1;
+        results = detach_results([run_tools.RunResult(0, params) for params in args[0]]);
+        assert all(result.params["mortalitySchedule"].filepath == handle.filepath for result in results);
+        assert broadcast.restore_results([results])[0][0].params["mortalitySchedule"] is table;
+        directory = broadcast.directory;
+    assert path.exists(directory) == False;
+
+
+#Sweeps run on several cores with a large array parameter give the same
+# results as running them serially, return the original array in their params,
+# store its description with their output, and remove the broadcast when they finish
+def test_sweep_with_array_params(tmp_path, broadcastRoot):
+    table = np.full((600, 2), 0.02);
+    table[60:, :] = 0.1;
+    params = parameters.override_default_parameters({"initialPopulationSize": 200, "maxTime": 20, "mortalitySchedule": table, "outputFormat": "npz", "outputDirectory": path.join(str(tmp_path), "serial")});
+    serial = run_tools.run_sweep(params, ["fertilityRate"], [[0.05, 0.1]], numReps=2, verbose=False, seed=2, returnResults=True);
+    params["outputDirectory"] = path.join(str(tmp_path), "parallel");
+    try:
+        parallel = run_tools.run_sweep(params, ["fertilityRate"], [[0.05, 0.1]], numReps=2, numCores=2, verbose=False, seed=2, returnResults=True);
+    finally:
+        run_tools.shutdown_shared_runner();
+    for serialResult, result in zip(serial, parallel):
+        assert np.array_equal(serialResult.timeSeries["popSize"], result.timeSeries["popSize"]);
+        assert result.params["mortalitySchedule"] is table;
+        assert output_formats.load_params(result.outputDirectory)["mortalitySchedule"] == output_formats.describe_array(table);
+    assert listdir(broadcastRoot) == [];
+
+
+#The broadcast is removed when a task fails, and broadcasts left by processes
+# which were killed are removed by the next broadcast
+def test_broadcast_cleanup(broadcastRoot):
+    deadProcess = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True);
+    staleDirectory = path.join(broadcastRoot, shared_inputs.broadcastPrefix+deadProcess.stdout.strip()+"_0");
+    makedirs(staleDirectory);
+
+    params = parameters.override_default_parameters({"initialPopulationSize": 100, "maxTime": 5, "engine": "cohort", "mortalitySchedule": np.full((150, 2), 0.02)});
+    try:
+        with pytest.raises(ValueError):
+            run_tools.run_reps(params, numReps=2, numCores=2, verbose=False, seed=1, writeOutput=False);
+    finally:
+        run_tools.shutdown_shared_runner();
+    assert listdir(broadcastRoot) == [];
+
+
+#Large array parameters are stored in params files, sweep datasets and cache
+# keys as a description (hash, shape and dtype) rather than every value, while
+# small ones are stored as lists
+def test_array_params_stored_as_descriptions(tmp_path):
+    table = np.full((600, 2), 0.02);
+    params = {"mortalitySchedule": table, "small": np.arange(3), "outputDirectory": str(tmp_path)};
+    output_formats.write_params_file(params, path.join(str(tmp_path), output_formats.paramsFilename));
+    stored = output_formats.load_params(str(tmp_path));
+    assert stored["small"] == [0, 1, 2] and output_formats.is_array_description(stored["mortalitySchedule"]);
+    assert stored["mortalitySchedule"]["shape"] == [600, 2] and path.getsize(path.join(str(tmp_path), output_formats.paramsFilename)) < 1000;
+    arrays = output_formats.make_dataset_arrays(["rep=0"], [params], [{name: np.zeros(3) for name in output_formats.timeSeriesNames}]);
+    assert len(str(arrays["params"][0])) < 1000;
+
+    #Arrays with the same contents have the same key, different contents don't
+    key = result_cache.get_cache_key(params);
+    assert result_cache.get_cache_key(dict(params, mortalitySchedule=table.copy())) == key;
+    changed = table.copy();
+    changed[100, 1] = 0.03;
+    assert result_cache.get_cache_key(dict(params, mortalitySchedule=changed)) != key;
+    #A description can't be used to run the model again
+    with pytest.raises(ValueError):
+        simple_model.get_rates(dict(parameters.override_default_parameters({}), mortalitySchedule=stored["mortalitySchedule"]));
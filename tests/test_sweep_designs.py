@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path;
+
+from model import simple_model;
+from utilities import parameters, run_tools, sweep_designs, analysis_tools, data_extractors, status_codes;
+
+
+#Sobol points match the published sequence and, like Latin hypercube samples,
+# put exactly one point in each of numPoints equal intervals of every dimension
+def test_designs_are_stratified():
+    assert np.array_equal(sweep_designs.sobol_sequence(8, 3), [[0, 0, 0], [0.5, 0.5, 0.5], [0.75, 0.25, 0.25], [0.25, 0.75, 0.75],
+                                                               [0.375, 0.375, 0.625], [0.875, 0.875, 0.125], [0.625, 0.125, 0.875], [0.125, 0.625, 0.375]]);
+    assert np.array_equal(sweep_designs.sobol_sequence(4, 5, skip=4), sweep_designs.sobol_sequence(8, 5)[4:]);
+    for points in [sweep_designs.sobol_sequence(256, 21), sweep_designs.latin_hypercube(256, 4, np.random.default_rng(1))]:
+        for dim in range(points.shape[1]):
+            assert np.array_equal(np.sort(np.floor(points[:, dim]*256)), np.arange(256));
+
+    scaled = sweep_designs.scale_points(sweep_designs.sobol_sequence(16, 2), [(0.01, 0.05), (50, 99)]);
+    assert all(0.01 <= fertilityRate < 0.05 and isinstance(popSize, int) and 50 <= popSize <= 99 for fertilityRate, popSize in scaled);
+    assert np.allclose(sweep_designs.scale_points(sweep_designs.unscale_points(scaled, [(0.01, 0.05), (50, 99)]), [(0.01, 0.05), (50, 99)]), scaled);
+
+
+#New points are added where the output changes fastest
+def test_refinement_points_follow_gradient():
+    rng = np.random.default_rng(2);
+    unitPoints = sweep_designs.sobol_sequence(64, 2);
+    values = [[1.0 if x > 0.5 else 0.0]*3 for x, y in unitPoints];
+    newPoints = sweep_designs.choose_refinement_points(unitPoints, values, 8, rng, criterion="gradient");
+    assert newPoints.shape == (8, 2) and np.all(np.abs(newPoints[:, 0]-0.5) < 0.2);
+
+
+#A sampled sweep can be loaded by analysis_tools and refined with new points,
+# without re-running the existing ones
+def test_sampled_sweep_and_refinement(tmp_path, monkeypatch):
+    baseParams = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": str(tmp_path)});
+    statuses = run_tools.run_sampled_sweep(baseParams, {"fertilityRate": (0.05, 0.15), "initialPopulationSize": (40, 80)}, 8, method="lhs", numReps=2, verbose=False, seed=6);
+    assert list(statuses) == [status_codes.SUCCESSFUL]*16;
+    #Repeating it without the seed uses the design's seed, so every run is skipped
+    assert list(run_tools.run_sampled_sweep(baseParams, {"fertilityRate": (0.05, 0.15), "initialPopulationSize": (40, 80)}, 8, method="lhs", numReps=2, verbose=False)) == [status_codes.SKIPPED]*16;
+    paramNames, points, growthRates = analysis_tools.extract_from_design(str(tmp_path), data_extractors.get_population_growth_rate);
+    assert paramNames == ["fertilityRate", "initialPopulationSize"] and points.shape == (8, 2) and len(growthRates[3]) == 2;
+    params = data_extractors.get_params_file(path.join(str(tmp_path), "point=3", "rep=1"));
+    assert [params["fertilityRate"], params["initialPopulationSize"]] == list(points[3]) and params["seedSpawnKey"] == [3, 1];
+
+    ran = [];
+    runModel = simple_model.run_model;
+    monkeypatch.setattr(simple_model, "run_model", lambda params, *args, **kwargs: ran.append(params["outputDirectory"]) or runModel(params, *args, **kwargs));
+    run_tools.refine_sweep(baseParams, 3, verbose=False);
+    assert sorted(ran) == sorted(path.join(str(tmp_path), "point="+str(i), "rep="+str(r)) for i in range(8, 11) for r in range(2));
+    paramNames, refinedPoints, refinedGrowthRates = analysis_tools.extract_from_design(str(tmp_path), data_extractors.get_population_growth_rate);
+    assert refinedPoints.shape == (11, 2) and np.array_equal(refinedPoints[0:8], points) and refinedGrowthRates[0:8] == growthRates;
+    assert sweep_designs.load_design(str(tmp_path))["seed"] == 6;
+
+
+#Designs are stored in full however many points they have
+def test_large_design_round_trip(tmp_path):
+    unitPoints = sweep_designs.latin_hypercube(600, 2, np.random.default_rng(1));
+    sweep_designs.write_design(str(tmp_path), {"paramNames": ["a", "b"], "points": unitPoints.tolist(), "unitPoints": unitPoints, "seed": 1});
+    assert np.array_equal(sweep_designs.load_design(str(tmp_path))["unitPoints"], unitPoints);
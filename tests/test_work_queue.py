@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np;
+from os import path, environ, listdir;
+import subprocess;
+import sys;
+import time;
+import pytest;
+
+from utilities import parameters, run_tools, work_queue, output_formats, filepaths, status_codes;
+
+
+#A sweep run by several worker processes through the work queue gives the same
+# output as running it locally
+def test_sweep_with_queue_workers(tmp_path):
+    queueFilepath = path.join(str(tmp_path), "queue.sqlite");
+    environment = dict(environ, PYTHONPATH=filepaths.projectRoot);
+    workers = [subprocess.Popen([sys.executable, "-m", "utilities.work_queue", queueFilepath, "--worker", "worker"+str(i), "--idle-timeout", "60", "--poll-interval", "0.1"], cwd=filepaths.projectRoot, env=environment) for i in range(3)];
+    try:
+        baseParams = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "queued")});
+        queued = run_tools.run_sweep(baseParams, ["fertilityRate", "mortalityRate"], [[0.05, 0.1], [0.01, 0.02]], numReps=3, verbose=False, seed=12, returnResults=True, workQueue=queueFilepath);
+    finally:
+        for worker in workers:
+            worker.terminate();
+            worker.wait();
+    baseParams["outputDirectory"] = path.join(str(tmp_path), "local");
+    local = run_tools.run_sweep(baseParams, ["fertilityRate", "mortalityRate"], [[0.05, 0.1], [0.01, 0.02]], numReps=3, verbose=False, seed=12, returnResults=True);
+    assert [result.status for result in queued] == [status_codes.SUCCESSFUL]*12;
+    for queuedResult, localResult in zip(queued, local):
+        assert np.array_equal(queuedResult.timeSeries["popSize"], localResult.timeSeries["popSize"]);
+        assert np.array_equal(output_formats.load_time_series(queuedResult.outputDirectory)["births"], localResult.timeSeries["births"]);
+
+    #The tasks were shared between the workers
+    connection = work_queue.connect(queueFilepath);
+    workerNames = [row[0] for row in connection.execute("SELECT worker FROM tasks WHERE state = ?", (work_queue.DONE,))];
+    connection.close();
+    assert len(workerNames) == 12 and len(set(workerNames)) > 1;
+
+
+#A task whose worker stops renewing its lease is given to another worker, and
+# the first worker's late result is ignored
+def test_expired_lease_is_reclaimed(tmp_path):
+    queueFilepath = path.join(str(tmp_path), "queue.sqlite");
+    params = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "run")});
+    run_tools.set_seed(params, 5, [0]);
+    taskIds = work_queue.submit_tasks(queueFilepath, [("run", run_tools.run_single, (params,), {"overwriteSeed": 5})]);
+    assert work_queue.claim_task(queueFilepath, "lost worker", leaseSeconds=0.1)[0] == taskIds[0];
+    assert work_queue.claim_task(queueFilepath, "other worker") is None;
+    time.sleep(0.2);
+    assert work_queue.run_worker(queueFilepath, worker="new worker", idleTimeout=0, pollInterval=0.01) == 1;
+    work_queue.finish_task(queueFilepath, taskIds[0], "lost worker", work_queue.ERROR, "too late");
+    assert work_queue.wait_for_tasks(queueFilepath, taskIds) == [status_codes.SUCCESSFUL];
+    assert output_formats.output_exists(params["outputDirectory"]);
+
+
+#A task whose lease expires on every attempt (e.g. one which crashes its
+# workers) is marked as failed after maxAttempts, and reported by the coordinator
+def test_poison_task_fails_after_max_attempts(tmp_path):
+    queueFilepath = path.join(str(tmp_path), "queue.sqlite");
+    params = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "outputDirectory": path.join(str(tmp_path), "run")});
+    taskIds = work_queue.submit_tasks(queueFilepath, [("poison", run_tools.run_single, (params,), {"overwriteSeed": 5})]);
+    for attempt in range(2):
+        assert work_queue.claim_task(queueFilepath, "crashing worker", leaseSeconds=0.01, maxAttempts=2)[0] == taskIds[0];
+        time.sleep(0.05);
+    assert work_queue.claim_task(queueFilepath, "next worker", maxAttempts=2) is None;
+    with pytest.raises(RuntimeError, match="poison.*\n.*2 attempts"):
+        work_queue.wait_for_tasks(queueFilepath, taskIds, pollInterval=0.01);
+
+
+#Large array arguments are saved once next to the queue rather than copied into
+# every task, and workers run the tasks with the original values
+def test_array_params_stored_as_files(tmp_path):
+    queueFilepath = path.join(str(tmp_path), "queue.sqlite");
+    table = np.full((600, 2), 0.02);
+    table[60:, :] = 0.1;
+    params = parameters.override_default_parameters({"initialPopulationSize": 60, "maxTime": 20, "mortalitySchedule": table});
+    tasks = [];
+    for i in range(2):
+        repParams = dict(params, outputDirectory=path.join(str(tmp_path), "rep="+str(i)));
+        run_tools.set_seed(repParams, 5, [i]);
+        tasks.append(("rep "+str(i), run_tools.run_single, (repParams,), {"overwriteSeed": 5}));
+    taskIds = work_queue.submit_tasks(queueFilepath, tasks);
+    assert len(listdir(work_queue.get_arrays_directory(queueFilepath))) == 1;
+    connection = work_queue.connect(queueFilepath);
+    assert all(len(row[0]) < 5000 for row in connection.execute("SELECT spec FROM tasks"));
+    connection.close();
+
+    taskId, name, spec = work_queue.claim_task(queueFilepath, "worker", leaseSeconds=0.01);
+    assert np.array_equal(spec["args"][0]["mortalitySchedule"], table);
+    time.sleep(0.05);
+    assert work_queue.run_worker(queueFilepath, worker="worker", idleTimeout=0, pollInterval=0.01) == 2;
+    assert work_queue.wait_for_tasks(queueFilepath, taskIds) == [status_codes.SUCCESSFUL]*2;
+    run_tools.run_single(dict(tasks[1][2][0], outputDirectory=path.join(str(tmp_path), "local")), overwriteSeed=5);
+    assert np.array_equal(output_formats.load_time_series(path.join(str(tmp_path), "rep=1"))["popSize"], output_formats.load_time_series(path.join(str(tmp_path), "local"))["popSize"]);
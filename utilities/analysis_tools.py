@@ -6,13 +6,18 @@ Created on Fri Aug 26 09:05:00 2022
 """
 
 import numpy as np;
-from os import path, listdir;
+from os import path, replace, getpid, makedirs, stat, scandir, remove, utime;
+import shutil;
 from string import Template;
+from concurrent.futures import ProcessPoolExecutor;
 import re;
 import json;
+import pickle;
+import hashlib;
 from copy import deepcopy;
+from statistics import NormalDist;
 
-from utilities import data_extractors;
+from utilities import data_extractors, output_formats, filepaths, sweep_designs;
 
 
 
@@ -21,20 +26,143 @@ from utilities import data_extractors;
 #extractorFunc: function to use to extract/calculate data from a simulation run
 #repDirTemplate: allows changing the directory name for repeats. If set to None it
 #                applies the extractorFunc to the rootDirectory only
-def extract_from_repeats(rootDirectory, extractorFunc, repDirTemplate = Template("rep=${repNum}")):
-    output = [];
+#numWorkers: number of processes to extract data with. None means everything
+#            is done in the current process.
+#useCache: store each extracted value on disk (see extract_from_run_directories)
+#          so later calls with the same extractorFunc don't need to read the output.
+#          Extractors are identified by name, so cached values aren't updated
+#          when an extractor's code changes: call clear_extraction_cache after
+#          editing one.
+def extract_from_repeats(rootDirectory, extractorFunc, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, useCache=False):
+    return extract_many_from_repeats(rootDirectory, {"data": extractorFunc}, repDirTemplate, numWorkers=numWorkers, useCache=useCache)["data"];
+
+
+#Same as extract_from_repeats, but applies several extractors in a single pass
+# over the repeats. Each run's output is only read once, and shared between the
+# extractors (see data_extractors.RunRecord).
+#extractors: dictionary of {name: extractorFunc}.
+#Returns a dictionary of {name: [extracted value for each repeat]}.
+def extract_many_from_repeats(rootDirectory, extractors, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, useCache=False):
+    return extract_from_run_directories(get_repeat_directories(rootDirectory, repDirTemplate), extractors, numWorkers=numWorkers, useCache=useCache);
+
+
+#Returns a list of the directories of each repeat run in rootDirectory.
+#repDirTemplate: see extract_from_repeats.
+def get_repeat_directories(rootDirectory, repDirTemplate = Template("rep=${repNum}")):
+    if repDirTemplate is None: #no repeat dir (this means it's not actually a directory of repeats)
+        return [rootDirectory];
+    repDirs = [];
     repNum = 0;
-    if repDirTemplate is not None:
-        while (True): #Keep looping until we generate a repeat directory which is invalid
-            repDir = path.join(rootDirectory, repDirTemplate.safe_substitute(repNum=repNum));
-            if path.exists(repDir) == False:
-                break; #Assume there are no more repeats
-            else:
-                output.append(extractorFunc(repDir));
-                repNum += 1; #check the next repeat number next
-    else: #no repeat dir (this means it's not actually a directory of repeats)
-        output.append(extractorFunc(rootDirectory));
-    return output;
+    while (True): #Keep looping until we generate a repeat directory which is invalid
+        repDir = path.join(rootDirectory, repDirTemplate.safe_substitute(repNum=repNum));
+        if output_formats.output_exists(repDir) == False:
+            break; #Assume there are no more repeats
+        else:
+            repDirs.append(repDir);
+            repNum += 1; #check the next repeat number next
+    return repDirs;
+
+
+
+#Applies each extractor in extractors ({name: extractorFunc}) to each directory
+# in runDirs. Returns a dictionary of {name: [extracted value for each run]}.
+#numWorkers: number of processes to use. None means everything is done in the
+#   current process. Workers must be able to import the extractors (so they
+#   can't be lambdas or functions defined inside another function).
+#useCache: if True each value is memoised on disk in filepaths.extractionCacheDir.
+#   Values are keyed on the run directory, the size and modification time of the
+#   file its output is stored in, and the qualified name of the extractor, so
+#   they're recalculated if the run's output changes. They are NOT recalculated
+#   if the extractor itself is changed: call clear_extraction_cache if you do this.
+#   Extractors without a stable name (e.g. lambdas) are never cached. The cache
+#   is limited to maxExtractionCacheBytes by removing the least recently used
+#   values (see evict_extraction_cache), so values of runs which have since been
+#   deleted or overwritten are eventually removed.
+def extract_from_run_directories(runDirs, extractors, numWorkers=None, useCache=False):
+    cacheDirectory = filepaths.extractionCacheDir if useCache else None;
+    if numWorkers is None or len(runDirs) <= 1:
+        extracted = [extract_from_run(runDir, extractors, cacheDirectory) for runDir in runDirs];
+    else:
+        with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+            chunksize = max(1, len(runDirs)//(numWorkers*4));
+            extracted = list(executor.map(extract_from_run, runDirs, [extractors]*len(runDirs), [cacheDirectory]*len(runDirs), chunksize=chunksize));
+    if useCache:
+        evict_extraction_cache();
+    return {name: [values[name] for values in extracted] for name in extractors};
+
+
+#Maximum total size of the extraction cache in bytes.
+maxExtractionCacheBytes = 256*1024**2;
+
+
+#Removes the least recently used values from the extraction cache until it's no
+# bigger than maxBytes (default maxExtractionCacheBytes).
+def evict_extraction_cache(maxBytes=None):
+    if maxBytes is None:
+        maxBytes = maxExtractionCacheBytes;
+    if path.isdir(filepaths.extractionCacheDir) == False:
+        return;
+    entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in scandir(filepaths.extractionCacheDir) if entry.name.endswith(".pkl")];
+    totalBytes = sum(size for lastUsed, size, filepath in entries);
+    for lastUsed, size, filepath in sorted(entries):
+        if totalBytes <= maxBytes:
+            break;
+        try:
+            remove(filepath);
+        except FileNotFoundError: #removed by another process
+            pass;
+        totalBytes -= size;
+
+
+#Removes every value from the extraction cache (e.g. after changing an extractor).
+def clear_extraction_cache():
+    shutil.rmtree(filepaths.extractionCacheDir, ignore_errors=True);
+
+
+#Returns a stable name for extractorFunc (its module and qualified name), or
+# None if it doesn't have one (e.g. it's a lambda or a nested function).
+def get_extractor_name(extractorFunc):
+    extractorName = extractorFunc.__module__+"."+extractorFunc.__qualname__;
+    return extractorName if "<" not in extractorName else None;
+
+
+#Applies each extractor in extractors ({name: extractorFunc}) to runDir, and
+# returns a dictionary of {name: extracted value}. The extractors share a single
+# RunRecord, so the run's output is read at most once. If cacheDirectory isn't
+# None values are read from, or stored in, the cache (see
+# extract_from_run_directories), and the output isn't read at all if every
+# value is already cached.
+def extract_from_run(runDir, extractors, cacheDirectory=None):
+    record = data_extractors.RunRecord(runDir);
+    if cacheDirectory is None:
+        return {name: extractorFunc(record) for name, extractorFunc in extractors.items()};
+    
+    outputFilepath = output_formats.get_output_filepath(runDir);
+    outputStat = stat(outputFilepath);
+    values = {};
+    for name, extractorFunc in extractors.items():
+        if get_extractor_name(extractorFunc) is None:
+            values[name] = extractorFunc(record);
+            continue;
+        
+        cacheKey = json.dumps([path.abspath(runDir), path.abspath(outputFilepath), outputStat.st_mtime_ns, outputStat.st_size, get_extractor_name(extractorFunc)]);
+        cacheFilepath = path.join(cacheDirectory, hashlib.sha1(cacheKey.encode()).hexdigest()+".pkl");
+        if path.exists(cacheFilepath):
+            try:
+                with open(cacheFilepath, "rb") as file:
+                    values[name] = pickle.load(file);
+                utime(cacheFilepath); #mark as recently used, see evict_extraction_cache
+                continue;
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass; #Treat an unreadable cache file as a cache miss
+        
+        values[name] = extractorFunc(record);
+        makedirs(cacheDirectory, exist_ok=True);
+        tempFilepath = cacheFilepath+".tmp"+str(getpid());
+        with open(tempFilepath, "wb") as file:
+            pickle.dump(values[name], file);
+        replace(tempFilepath, cacheFilepath);
+    return values;
 
 
 
@@ -51,6 +179,9 @@ def extract_from_repeats(rootDirectory, extractorFunc, repDirTemplate = Template
 # data[0.05][0.2]["high"] for a 3-parameter sweep, for example. Here the three
 # index values correspond to a unique set of parameter values used to in the
 # parameter sweep. The order is defined by the paramNames (first tuple element)
+#If asCube is True the third element is instead a SweepCube (see below): a
+# dense array with one axis per parameter, then the repeats (and then time, if
+# extractorFunc returns a time series).
 #Function arguments:
 #rootDirectory: the sweep's root directory
 #extractorFunc: a function which extracts or calculates the particular piece of
@@ -58,7 +189,26 @@ def extract_from_repeats(rootDirectory, extractorFunc, repDirTemplate = Template
 #repDirTemplate: allows changing the directory name for repeats. If set to None it
 #                applies the extractorFunc to the rootDirectory only (i.e. from a
 #                sweep with no repeat runs performed)
-def extract_from_sweep(rootDirectory, extractorFunc, repDirTemplate = Template("rep=${repNum}")):
+#asCube: return the data as a SweepCube instead of nested dictionaries.
+#numWorkers, useCache: see extract_from_repeats. Runs from every parameter set
+#   are shared between the same set of workers.
+def extract_from_sweep(rootDirectory, extractorFunc, repDirTemplate = Template("rep=${repNum}"), asCube=False, numWorkers=None, useCache=False):
+    if asCube:
+        cube = extract_sweep_cube(rootDirectory, extractorFunc, repDirTemplate, numWorkers=numWorkers, useCache=useCache);
+        return cube.paramNames, cube.paramVals, cube;
+    
+    paramNames, sweepInfo, data = extract_many_from_sweep(rootDirectory, {"data": extractorFunc}, repDirTemplate, numWorkers=numWorkers, useCache=useCache);
+    return paramNames, sweepInfo, data["data"];
+
+
+#Same as extract_from_sweep, but applies several extractors in a single pass
+# over the sweep. Each run's output is only read once, and shared between the
+# extractors (see data_extractors.RunRecord).
+#extractors: dictionary of {name: extractorFunc}.
+#Returns the same tuple as extract_from_sweep, except the third element is a
+# dictionary of {name: N-dimensional grid (nested dictionaries)}, e.g.
+# data["growthRate"][0.05][0.2]["high"].
+def extract_many_from_sweep(rootDirectory, extractors, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, useCache=False):
     def construct_recursive_dictionary_storage(paramNames, paramValues):
         output = None;
         for paramName in paramNames[::-1]:
@@ -73,25 +223,458 @@ def extract_from_sweep(rootDirectory, extractorFunc, repDirTemplate = Template("
             set_recursive_dictionary_value(dictionary[keys[0]], keys[1:], valueToStore);
     
     
+    paramNames, sweepInfo, sweepDirs = get_sweep_directories(rootDirectory, repDirTemplate);
+    
+    #Create a nested dictionaries for each extractor, where keys correspond to
+    # paramNames (in order) and the innermost of which contain one element for
+    # each parameter value combination
+    data = {name: construct_recursive_dictionary_storage(paramNames, sweepInfo) for name in extractors};
+    
+    #extract and store the data we're interested in
+    for paramVals, extractedData in extract_from_sweep_directories(sweepDirs, extractors, repDirTemplate, numWorkers, useCache):
+        for name in extractors:
+            set_recursive_dictionary_value(data[name], paramVals, extractedData[name]);
+    
+    return paramNames, sweepInfo, data;
+
+
+#Returns the parameter names and values of a sweep (from sweep_info.json), and
+# a list containing (parameter values, directory) for each parameter set.
+def get_sweep_directories(rootDirectory, repDirTemplate = Template("rep=${repNum}")):
     with open(path.join(rootDirectory, "sweep_info.json"), 'r') as file:
         sweepInfo = json.load(file);
-    
-    #Create a nested dictionaries where keys correspond to paramNames (in order)
-    # and the innermost of which contain one element for each parameter value combination
     paramNames = list(sweepInfo.keys());
-    data = construct_recursive_dictionary_storage(paramNames, sweepInfo);
-    
-    #get list of all the directories in the rootDirectory
-    sweepDirs = [path.join(rootDirectory, directory) for directory in listdir(rootDirectory) if path.isdir(path.join(rootDirectory, directory))];
     
-    for sweepDir in sweepDirs:
+    #get list of all the directories in the rootDirectory (including those
+    # stored in a sweep dataset, see output_formats)
+    sweepDirs = [];
+    for sweepDir in output_formats.list_subdirectories(rootDirectory):
         #extracting parameter values from the parameter file (rather than the directory name)
         exampleSimDir = sweepDir if repDirTemplate is None else path.join(sweepDir, repDirTemplate.safe_substitute(repNum=0));
         params = data_extractors.get_params_file(exampleSimDir);
-        paramVals = [params[paramName] for paramName in paramNames];
+        sweepDirs.append(([params[paramName] for paramName in paramNames], sweepDir));
+    return paramNames, sweepInfo, sweepDirs;
+
+
+#Extracts data from the repeats in each parameter set's directory (as returned
+# by get_sweep_directories) with each extractor in extractors ({name: extractorFunc}).
+#Returns a list of (parameter values, {name: [extracted value for each repeat]}).
+def extract_from_sweep_directories(sweepDirs, extractors, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, useCache=False):
+    repDirLists = [get_repeat_directories(sweepDir, repDirTemplate) for paramVals, sweepDir in sweepDirs];
+    extracted = extract_from_run_directories([repDir for repDirs in repDirLists for repDir in repDirs], extractors, numWorkers=numWorkers, useCache=useCache);
+    output = [];
+    start = 0;
+    for (paramVals, sweepDir), repDirs in zip(sweepDirs, repDirLists):
+        output.append((paramVals, {name: extracted[name][start:start+len(repDirs)] for name in extractors}));
+        start += len(repDirs);
+    return output;
+
+
+
+#Extracts data from a sampled sweep (a design of scattered points, see
+# run_tools.run_design and sweep_designs.py), with the same arguments as
+# extract_from_sweep.
+#Returns a tuple of:
+#   paramNames: the names of the parameters varied.
+#   points: (numPoints, numParams) array of the parameter values of each point.
+#   data: list containing, for each point, a list of the value extracted from
+#         each repeat (empty if the point hasn't been run).
+def extract_from_design(rootDirectory, extractorFunc, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, useCache=False):
+    paramNames, points, data = extract_many_from_design(rootDirectory, {"data": extractorFunc}, repDirTemplate, numWorkers=numWorkers, useCache=useCache);
+    return paramNames, points, data["data"];
+
+
+#Same as extract_from_design, but applies several extractors in a single pass
+# (see extract_many_from_sweep). The third element returned is a dictionary of
+# {name: list of extracted values for each point}.
+def extract_many_from_design(rootDirectory, extractors, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, useCache=False):
+    design = sweep_designs.load_design(rootDirectory);
+    if design is None:
+        raise FileNotFoundError("No "+sweep_designs.designFilename+" found in "+str(rootDirectory));
+    if design["numReps"] is None:
+        repDirTemplate = None;
+    pointDirs = [(point, path.join(rootDirectory, sweep_designs.get_point_name(i))) for i, point in enumerate(design["points"])];
+    ranPointDirs = [(point, pointDir) for point, pointDir in pointDirs if output_formats.output_exists(pointDir)];
+    extracted = {pointDir: values for (point, pointDir), (paramVals, values) in zip(ranPointDirs, extract_from_sweep_directories(ranPointDirs, extractors, repDirTemplate, numWorkers, useCache))};
+    data = {name: [extracted[pointDir][name] if pointDir in extracted else [] for point, pointDir in pointDirs] for name in extractors};
+    return design["paramNames"], np.array(design["points"]), data;
+
+
+
+#Returns the (low, high) confidence interval of the mean of values (e.g. the
+# values extracted from a set of repeats), using Student's t distribution.
+# Values which aren't finite (e.g. the growth rate of an extinct population)
+# are ignored. Returns (nan, nan) if there are fewer than 2 finite values.
+def get_confidence_interval(values, confidence=0.95):
+    values = np.asarray(values, dtype=float);
+    values = values[np.isfinite(values)];
+    if len(values) < 2:
+        return np.nan, np.nan;
+    halfWidth = get_t_quantile(0.5+confidence/2, len(values)-1)*np.std(values, ddof=1)/np.sqrt(len(values));
+    mean = np.mean(values);
+    return mean-halfWidth, mean+halfWidth;
+
+
+#Returns the quantile of Student's t distribution with the given degrees of
+# freedom at probability p. Exact for 1 and 2 degrees of freedom, otherwise
+# the Cornish-Fisher expansion around the normal quantile (for 95% intervals
+# this is within about 0.1% with 3 degrees of freedom, and closer with more).
+def get_t_quantile(p, degreesOfFreedom):
+    if degreesOfFreedom == 1:
+        return np.tan(np.pi*(p-0.5));
+    if degreesOfFreedom == 2:
+        return (2*p-1)/np.sqrt(2*p*(1-p));
+    z = NormalDist().inv_cdf(p);
+    v = degreesOfFreedom;
+    return (z + (z**3+z)/(4*v) + (5*z**5+16*z**3+3*z)/(96*v**2)
+              + (3*z**7+19*z**5+17*z**3-15*z)/(384*v**3)
+              + (79*z**9+776*z**7+1482*z**5-1920*z**3-945*z)/(92160*v**4));
+
+
+
+#Dense N-dimensional array of data extracted from a sweep, with labelled axes.
+#values has one axis per parameter (in paramNames order), then "rep" (one
+# element per repeat) and, if the extracted data are time series, "time".
+# Missing data (e.g. fewer repeats for some parameter sets, or time series
+# which end early because the population went extinct) are NaN.
+#Axes can be referred to by name, and parameter axes indexed by parameter value:
+# cube.sel(fertilityRate=0.1, initialPopulationSize=4000).mean("rep")
+# returns a SweepCube over the remaining axes containing the mean over repeats.
+#values may be a read-only memory-mapped array (see extract_sweep_cube), so
+# whole sweeps can be sliced and reduced without loading them into memory.
+class SweepCube:
+    def __init__(self, values, axisNames, axisValues):
+        self.values = values;
+        self.axisNames = list(axisNames);
+        self.axisValues = {name: list(axisValues[name]) for name in self.axisNames};
+    
+    #Names of the parameter axes.
+    @property
+    def paramNames(self):
+        return [name for name in self.axisNames if name not in ("rep", "time")];
+    
+    #{paramName: [paramValues]} for the parameter axes.
+    @property
+    def paramVals(self):
+        return {name: self.axisValues[name] for name in self.paramNames};
+    
+    @property
+    def shape(self):
+        return self.values.shape;
+    
+    def __array__(self, dtype=None):
+        return np.asarray(self.values, dtype=dtype);
+    
+    #Returns the position of the named axis.
+    def axis(self, axisName):
+        return self.axisNames.index(axisName);
+    
+    #Selects a single value along one or more axes, e.g.
+    # cube.sel(fertilityRate=0.1, rep=0). Parameter axes are indexed by parameter
+    # value, "rep" and "time" by position. Selected axes are removed.
+    def sel(self, **labels):
+        index = [];
+        for axisName in self.axisNames:
+            if axisName not in labels:
+                index.append(slice(None));
+            elif axisName in ("rep", "time"):
+                index.append(labels[axisName]);
+            else:
+                index.append(self.axisValues[axisName].index(labels[axisName]));
+        remainingAxes = [axisName for axisName in self.axisNames if axisName not in labels];
+        return SweepCube(self.values[tuple(index)], remainingAxes, {name: self.axisValues[name] for name in remainingAxes});
+    
+    #Applies reduceFunc (e.g. np.nanmean) over the named axis.
+    def reduce(self, reduceFunc, axisName="rep"):
+        remainingAxes = [name for name in self.axisNames if name != axisName];
+        return SweepCube(reduceFunc(self.values, axis=self.axis(axisName)), remainingAxes, {name: self.axisValues[name] for name in remainingAxes});
+    
+    #Mean over the named axis, ignoring missing (NaN) data.
+    def mean(self, axisName="rep"):
+        return self.reduce(np.nanmean, axisName);
+    
+    #Standard deviation over the named axis, ignoring missing (NaN) data.
+    def std(self, axisName="rep"):
+        return self.reduce(np.nanstd, axisName);
+
+
+#Returns a SweepCube containing the data extracted by extractorFunc for every
+# run in a sweep (see extract_from_sweep for arguments).
+#The cube is stored as a memory-mapped .npy file in the sweep's root directory
+# (with its axes in a .json file alongside it), named by the extractor and a
+# hash of repDirTemplate. Later calls with the same extractorFunc and
+# repDirTemplate reuse the stored cube unless any simulation output in the sweep
+# has been written since it was created. Extractors without a stable name
+# (e.g. lambdas) are never stored, and as extractors are identified by name a
+# stored cube isn't updated when an extractor's code changes (use
+# useStoredCube=False).
+#The axes file is written (atomically) before the cube is moved into place, so
+# if the cube's replacement is interrupted the old cube is left out of date
+# and is extracted again. A cube is also only reused if its shape matches its axes.
+#useStoredCube: set to False to always extract the data again.
+#numWorkers, useCache: see extract_from_repeats.
+def extract_sweep_cube(rootDirectory, extractorFunc, repDirTemplate = Template("rep=${repNum}"), useStoredCube=True, numWorkers=None, useCache=False):
+    extractorName = get_extractor_name(extractorFunc);
+    canCache = useStoredCube and extractorName is not None;
+    templateText = repDirTemplate.template if repDirTemplate is not None else None;
+    templateHash = hashlib.sha1(json.dumps(templateText).encode()).hexdigest()[0:8];
+    cubeFilepath = path.join(rootDirectory, "sweep_cube_"+re.sub(r"[^\w.]", "_", str(extractorName))+"_"+templateHash+".npy");
+    axesFilepath = cubeFilepath[0:-len(".npy")]+".json";
+    
+    if canCache and path.exists(cubeFilepath) and path.exists(axesFilepath):
+        if path.getmtime(cubeFilepath) > output_formats.get_latest_output_time(rootDirectory):
+            with open(axesFilepath, "r") as file:
+                axes = json.load(file);
+            cubeValues = np.load(cubeFilepath, mmap_mode="r");
+            if axes.get("repDirTemplate") == templateText and list(cubeValues.shape) == [len(axes["axisValues"][axisName]) for axisName in axes["axisNames"]]:
+                return SweepCube(cubeValues, axes["axisNames"], axes["axisValues"]);
+    
+    #Extract everything into compact per-parameter set arrays first, to find the
+    # size of the rep and time axes.
+    paramNames, sweepInfo, sweepDirs = get_sweep_directories(rootDirectory, repDirTemplate);
+    extracted = [(paramVals, [np.asarray(value, dtype=np.float64) for value in extractedData["data"]]) for paramVals, extractedData in extract_from_sweep_directories(sweepDirs, {"data": extractorFunc}, repDirTemplate, numWorkers, useCache)];
+    numReps = max([len(values) for paramVals, values in extracted]+[1]);
+    isTimeSeries = any(value.ndim > 0 for paramVals, values in extracted for value in values);
+    axisNames = paramNames+["rep"];
+    shape = [len(sweepInfo[paramName]) for paramName in paramNames]+[numReps];
+    if isTimeSeries:
+        axisNames.append("time");
+        shape.append(max(len(value) for paramVals, values in extracted for value in values));
+    axisValues = {paramName: sweepInfo[paramName] for paramName in paramNames};
+    axisValues.update({axisName: list(range(shape[i])) for i, axisName in enumerate(axisNames) if axisName in ("rep", "time")});
+    
+    if canCache:
+        tempFilepath = cubeFilepath+".tmp"+str(getpid());
+        cubeValues = np.lib.format.open_memmap(tempFilepath, mode="w+", dtype=np.float64, shape=tuple(shape));
+    else:
+        cubeValues = np.empty(tuple(shape), dtype=np.float64);
+    cubeValues[...] = np.nan;
+    
+    paramIndices = [{val: i for i, val in enumerate(sweepInfo[paramName])} for paramName in paramNames];
+    for paramVals, values in extracted:
+        index = tuple(paramIndices[d][val] for d, val in enumerate(paramVals));
+        for rep, value in enumerate(values):
+            if isTimeSeries:
+                cubeValues[index+(rep, slice(0, len(value)))] = value;
+            else:
+                cubeValues[index+(rep,)] = value;
+    
+    if canCache == False:
+        return SweepCube(cubeValues, axisNames, axisValues);
+    
+    cubeValues.flush();
+    del cubeValues;
+    output_formats.write_params_file({"extractor": extractorName, "repDirTemplate": templateText, "axisNames": axisNames, "axisValues": axisValues}, axesFilepath);
+    replace(tempFilepath, cubeFilepath);
+    return SweepCube(np.load(cubeFilepath, mmap_mode="r"), axisNames, axisValues);
+
+
+
+#Streaming summary statistics of time series (by default the model's popSize,
+# deaths and births) across any number of runs, using memory proportional to
+# the length of the time series rather than the number of runs.
+#For each time step it keeps the count, mean and variance (using Welford's
+# algorithm), min, max and a quantile sketch. The quantile sketch is a histogram
+# with logarithmically sized bins (as in DDSketch), so any quantile is estimated
+# to within relativeAccuracy of a value of the true quantile. Quantiles can only
+# be calculated for non-negative values.
+#Aggregators are mergeable: runs can be aggregated separately (e.g. in
+# different worker processes) and the partial aggregates combined with merge,
+# giving the same result as aggregating every run in one place.
+#Runs whose time series end early (e.g. because the population went extinct)
+# only contribute to the time steps they have values for, unless fillToLength
+# is set, in which case they are padded with fillValue up to that length (e.g.
+# fillToLength=params["maxTime"] and fillValue=0 treats extinct populations as
+# having size 0).
+#E.g.:
+# stats = TimeSeriesAggregator();
+# for repDir in repDirs:
+#     stats.add_run(repDir);
+# stats.mean("popSize"), stats.quantile("popSize", 0.95), stats.summary("births")
+class TimeSeriesAggregator:
+    def __init__(self, names=output_formats.timeSeriesNames, relativeAccuracy=0.01, fillToLength=None, fillValue=0):
+        self.names = list(names);
+        self.relativeAccuracy = relativeAccuracy;
+        self.gamma = (1+relativeAccuracy)/(1-relativeAccuracy);
+        self.fillToLength = fillToLength;
+        self.fillValue = fillValue;
+        self.numRuns = 0;
+        self.length = 0;
+        self.counts = np.zeros((0,), dtype=np.int64);
+        self.means = {name: np.zeros((0,)) for name in self.names};
+        self.sumSquaredDifferences = {name: np.zeros((0,)) for name in self.names};
+        self.minimums = {name: np.zeros((0,)) for name in self.names};
+        self.maximums = {name: np.zeros((0,)) for name in self.names};
+        #Quantile sketch: zeroCounts[name][t] is the number of zeros at time
+        # step t, and binCounts[name][t, k] the number of values in
+        # (gamma^(k+binOffset-1), gamma^(k+binOffset)].
+        self.zeroCounts = {name: np.zeros((0,), dtype=np.int64) for name in self.names};
+        self.binCounts = {name: np.zeros((0, 0), dtype=np.int64) for name in self.names};
+        self.binOffsets = {name: 0 for name in self.names};
+    
+    #Adds a run's time series, given as a dictionary of {name: values}.
+    #Note: every run's time series must be the same length, except where a run ends early.
+    def add(self, timeSeries):
+        values = {name: np.asarray(timeSeries[name], dtype=np.float64) for name in self.names};
+        if self.fillToLength is not None:
+            values = {name: np.concatenate([series, np.full((max(self.fillToLength-len(series), 0),), float(self.fillValue))]) for name, series in values.items()};
+        length = len(values[self.names[0]]);
+        self._grow(length);
         
-        #extract and store the data we're interested in
-        extractedData = extract_from_repeats(path.join(rootDirectory, sweepDir), extractorFunc);
-        set_recursive_dictionary_value(data, paramVals, extractedData);
+        self.numRuns += 1;
+        self.counts[0:length] += 1;
+        n = self.counts[0:length];
+        for name in self.names:
+            #Welford's update of the mean and sum of squared differences from the mean
+            mean = self.means[name][0:length];
+            delta = values[name] - mean;
+            mean += delta/n;
+            self.sumSquaredDifferences[name][0:length] += delta*(values[name]-mean);
+            np.minimum(self.minimums[name][0:length], values[name], out=self.minimums[name][0:length]);
+            np.maximum(self.maximums[name][0:length], values[name], out=self.maximums[name][0:length]);
+            self._add_to_sketch(name, values[name]);
     
-    return paramNames, sweepInfo, data;
+    #Reads a run's output from its directory (or a data_extractors.RunRecord) and adds it.
+    def add_run(self, directory):
+        self.add(data_extractors.load_time_series(directory, columns=self.names));
+    
+    #Combines another aggregator's runs into this one (Chan et al.'s parallel
+    # variant of Welford's algorithm). Both must have the same names and
+    # relativeAccuracy. Returns self.
+    def merge(self, other):
+        if other.names != self.names or other.relativeAccuracy != self.relativeAccuracy:
+            raise ValueError("Only aggregators with the same names and relativeAccuracy can be merged");
+        length = other.length;
+        self._grow(length);
+        nA = self.counts[0:length].astype(np.float64);
+        nB = other.counts.astype(np.float64);
+        n = np.maximum(nA+nB, 1);
+        for name in self.names:
+            delta = other.means[name] - self.means[name][0:length];
+            self.means[name][0:length] += delta*nB/n;
+            self.sumSquaredDifferences[name][0:length] += other.sumSquaredDifferences[name] + delta**2*nA*nB/n;
+            np.minimum(self.minimums[name][0:length], other.minimums[name], out=self.minimums[name][0:length]);
+            np.maximum(self.maximums[name][0:length], other.maximums[name], out=self.maximums[name][0:length]);
+            self.zeroCounts[name][0:length] += other.zeroCounts[name];
+            if other.binCounts[name].shape[1] > 0:
+                self._grow_bins(name, other.binOffsets[name], other.binOffsets[name]+other.binCounts[name].shape[1]);
+                start = other.binOffsets[name]-self.binOffsets[name];
+                self.binCounts[name][0:length, start:start+other.binCounts[name].shape[1]] += other.binCounts[name];
+        self.counts[0:length] += other.counts;
+        self.numRuns += other.numRuns;
+        return self;
+    
+    #Number of runs with a value at each time step.
+    def count(self):
+        return self.counts.copy();
+    
+    #Mean at each time step.
+    def mean(self, name):
+        return np.where(self.counts > 0, self.means[name], np.nan);
+    
+    #Variance at each time step (ddof=1 gives the sample variance, as used by np.var).
+    def variance(self, name, ddof=1):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.counts > ddof, self.sumSquaredDifferences[name]/(self.counts-ddof), np.nan);
+    
+    #Standard deviation at each time step.
+    def std(self, name, ddof=1):
+        return np.sqrt(self.variance(name, ddof));
+    
+    #Minimum at each time step.
+    def min(self, name):
+        return np.where(self.counts > 0, self.minimums[name], np.nan);
+    
+    #Maximum at each time step.
+    def max(self, name):
+        return np.where(self.counts > 0, self.maximums[name], np.nan);
+    
+    #Estimate of the q'th quantile (0 <= q <= 1) at each time step, accurate to
+    # within relativeAccuracy.
+    def quantile(self, name, q):
+        binCounts = self.binCounts[name];
+        rank = np.floor(q*(self.counts-1));
+        cumulativeCounts = np.cumsum(binCounts, axis=1) + self.zeroCounts[name][:, np.newaxis];
+        bins = np.argmax(cumulativeCounts > rank[:, np.newaxis], axis=1) if binCounts.shape[1] > 0 else np.zeros((self.length,), dtype=np.int64);
+        estimate = 2*self.gamma**(bins+self.binOffsets[name])/(self.gamma+1);
+        estimate = np.where(self.zeroCounts[name] > rank, 0.0, estimate);
+        #The estimate can't be outside the range of the values seen
+        estimate = np.clip(estimate, self.minimums[name], self.maximums[name]);
+        return np.where(self.counts > 0, estimate, np.nan);
+    
+    #Returns a pandas DataFrame with one row per time step and columns for the
+    # count, mean, std, min, max and each quantile in quantiles.
+    def summary(self, name, quantiles=(0.05, 0.5, 0.95)):
+        import pandas as pd;
+        summary = pd.DataFrame({"count": self.count(), "mean": self.mean(name), "std": self.std(name), "min": self.min(name), "max": self.max(name)});
+        for q in quantiles:
+            summary["q"+str(q)] = self.quantile(name, q);
+        return summary;
+    
+    #Extends every per-time step array to at least length time steps.
+    def _grow(self, length):
+        if length <= self.length:
+            return;
+        extra = length-self.length;
+        self.counts = np.concatenate([self.counts, np.zeros((extra,), dtype=np.int64)]);
+        for name in self.names:
+            self.means[name] = np.concatenate([self.means[name], np.zeros((extra,))]);
+            self.sumSquaredDifferences[name] = np.concatenate([self.sumSquaredDifferences[name], np.zeros((extra,))]);
+            self.minimums[name] = np.concatenate([self.minimums[name], np.full((extra,), np.inf)]);
+            self.maximums[name] = np.concatenate([self.maximums[name], np.full((extra,), -np.inf)]);
+            self.zeroCounts[name] = np.concatenate([self.zeroCounts[name], np.zeros((extra,), dtype=np.int64)]);
+            self.binCounts[name] = np.pad(self.binCounts[name], ((0, extra), (0, 0)));
+        self.length = length;
+    
+    #Extends the quantile sketch of name to cover the bins [firstBin, endBin).
+    def _grow_bins(self, name, firstBin, endBin):
+        numBins = self.binCounts[name].shape[1];
+        if numBins == 0:
+            self.binCounts[name] = np.zeros((self.length, endBin-firstBin), dtype=np.int64);
+            self.binOffsets[name] = firstBin;
+            return;
+        padBefore = max(self.binOffsets[name]-firstBin, 0);
+        padAfter = max(endBin-(self.binOffsets[name]+numBins), 0);
+        if padBefore > 0 or padAfter > 0:
+            self.binCounts[name] = np.pad(self.binCounts[name], ((0, 0), (padBefore, padAfter)));
+            self.binOffsets[name] -= padBefore;
+    
+    #Adds one run's values of name to its quantile sketch.
+    def _add_to_sketch(self, name, values):
+        if np.any(values < 0):
+            raise ValueError("Quantiles can only be calculated for non-negative values ("+name+")");
+        wPositive = values > 0;
+        self.zeroCounts[name][0:len(values)] += wPositive == False;
+        if np.any(wPositive):
+            bins = np.ceil(np.log(values[wPositive])/np.log(self.gamma)).astype(np.int64);
+            self._grow_bins(name, bins.min(), bins.max()+1);
+            np.add.at(self.binCounts[name], (np.flatnonzero(wPositive), bins-self.binOffsets[name]), 1);
+
+
+#Aggregates the time series of every run in runDirs with a TimeSeriesAggregator
+# without holding them all in memory at once. With numWorkers each process
+# aggregates a share of the runs, and the partial aggregates are merged.
+#aggregatorOptions: passed to TimeSeriesAggregator (e.g. names, fillToLength).
+def aggregate_run_directories(runDirs, numWorkers=None, **aggregatorOptions):
+    if numWorkers is None or len(runDirs) <= 1:
+        return aggregate_runs(runDirs, aggregatorOptions);
+    
+    aggregator = TimeSeriesAggregator(**aggregatorOptions);
+    with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+        for partialAggregator in executor.map(aggregate_runs, [list(runDirChunk) for runDirChunk in np.array_split(runDirs, min(numWorkers, len(runDirs)))], [aggregatorOptions]*numWorkers):
+            aggregator.merge(partialAggregator);
+    return aggregator;
+
+
+#Returns a TimeSeriesAggregator containing every run in runDirs.
+def aggregate_runs(runDirs, aggregatorOptions):
+    aggregator = TimeSeriesAggregator(**aggregatorOptions);
+    for runDir in runDirs:
+        aggregator.add_run(runDir);
+    return aggregator;
+
+
+#Same as aggregate_run_directories, for the repeat runs in rootDirectory (see
+# extract_from_repeats).
+def aggregate_from_repeats(rootDirectory, repDirTemplate = Template("rep=${repNum}"), numWorkers=None, **aggregatorOptions):
+    return aggregate_run_directories(get_repeat_directories(rootDirectory, repDirTemplate), numWorkers=numWorkers, **aggregatorOptions);
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Benchmarks of the time taken by the model, the run_tools executors and the
+# analysis_tools extraction, for tracking performance as the code changes.
+#Each benchmark case is run for every combination of the values in its grid of
+# parameters (see benchmarkSuites), and the results are appended to a JSON
+# history file, so later runs can be compared with earlier ones:
+#   PYTHONPATH=. python3 -m utilities.benchmarks run [--suite quick|full] [--case run_model]
+#   PYTHONPATH=. python3 -m utilities.benchmarks compare [--threshold 0.2]
+#compare exits with status 1 if any case is slower than in the baseline by more
+# than the threshold, so it can be used to fail a CI job.
+#Cases:
+#   run_model: a whole run (simple_model.run_model, without writing output), by
+#       engine, initialPopulationSize and maxTime.
+#   cohort_run_model: a whole run of the cohort engine, by initialPopulationSize
+#       and maxTime, including populations far too large for the agent based
+#       engines (its time shouldn't depend on the population size).
+#   model_step: one call of a step function (see profiling.stepPhaseNames) of
+#       an engine on a population of initialPopulationSize partnered agents.
+#   run_reps: run_tools.run_reps (writing output), by numReps, numCores and batched.
+#   extract_from_sweep: analysis_tools.extract_from_sweep of the growth rate
+#       from a synthetic sweep tree (see write_synthetic_sweep), by sweepSize
+#       (number of parameter sets), numReps, outputFormat and numWorkers.
+#Each case is timed numRepeats times (default 3), with any setup (e.g. creating
+# the population or sweep tree) done before the timer starts. The median time
+# is used for comparisons, and the minimum is stored too.
+#Timings are only comparable between runs on the same machine, which is
+# recorded in the history.
+
+from os import path, makedirs, cpu_count;
+import argparse;
+import itertools;
+import json;
+import platform;
+import shutil;
+import subprocess;
+import tempfile;
+import time;
+import sys;
+import numpy as np;
+
+from utilities import filepaths, parameters, run_tools, analysis_tools, data_extractors, output_formats;
+
+
+#Default history file.
+historyFilepath = path.join(filepaths.benchmarkDir, "benchmark_history.json");
+
+#Default fractional slow down above which a case counts as a regression.
+defaultThreshold = 0.2;
+
+
+###Cases
+#Each case function takes the directory to use for any files it writes and the
+# case's parameters, does any setup, and returns a function which prepares a
+# single timed repeat: it's called before each repeat and returns the function
+# that is timed.
+
+#Times a whole run without writing output.
+def run_model_case(workDirectory, engine, initialPopulationSize, maxTime):
+    from model import simple_model;
+    params = parameters.override_default_parameters({"engine": engine, "initialPopulationSize": initialPopulationSize, "maxTime": maxTime});
+    params["seed"] = 1;
+    return lambda: lambda: simple_model.run_model(params, writeOutput=False);
+
+
+#Times a whole run of the cohort engine without writing output.
+def cohort_run_model_case(workDirectory, initialPopulationSize, maxTime):
+    return run_model_case(workDirectory, "cohort", initialPopulationSize, maxTime);
+
+
+#Returns the module containing the step functions of an engine.
+def get_engine_module(engine):
+    from model import simple_model, agent_store, cohort_engine;
+    engineModules = {"dataframe": simple_model, "array": agent_store, "cohort": cohort_engine};
+    if engine not in engineModules:
+        raise ValueError("Unrecognised engine: "+str(engine));
+    return engineModules[engine];
+
+
+#Applies the step function of an engine for one phase (see
+# profiling.stepPhaseNames) to population.
+def run_step(engineModule, step, population, params, rng):
+    from model import cohort_engine;
+    if step == "pairing":
+        if engineModule is cohort_engine:
+            return engineModule.pair_unmarried_agents(population);
+        return engineModule.pair_unmarried_agents(population, rng);
+    elif step == "reproduction":
+        return engineModule.do_reproduction(population, params["fertilityRate"], rng);
+    elif step == "mortality":
+        return engineModule.do_mortality(population, params["mortalityRate"], rng);
+    elif step == "ageing":
+        return engineModule.age_agents(population);
+    raise ValueError("Unrecognised step: "+str(step));
+
+
+#Times one step function. Each repeat starts from a new population which has
+# already been partnered, so reproduction has couples to work with.
+def model_step_case(workDirectory, engine, initialPopulationSize, step):
+    engineModule = get_engine_module(engine);
+    params = parameters.override_default_parameters({"engine": engine, "initialPopulationSize": initialPopulationSize});
+    rng = np.random.default_rng(1);
+    def prepare():
+        population = engineModule.initialise_agents(initialPopulationSize, rng) if hasattr(engineModule, "initialise_agents") else engineModule.initialise_cohorts(initialPopulationSize, rng);
+        population = run_step(engineModule, "pairing", population, params, rng);
+        return lambda: run_step(engineModule, step, population, params, rng);
+    return prepare;
+
+
+#Times run_tools.run_reps, including writing the output. Each repeat writes to
+# a new directory, so no runs are skipped.
+def run_reps_case(workDirectory, numReps, numCores, batched, initialPopulationSize, maxTime):
+    params = parameters.override_default_parameters({"initialPopulationSize": initialPopulationSize, "maxTime": maxTime, "outputFormat": "npz"});
+    repeatNums = itertools.count();
+    def prepare():
+        repeatParams = dict(params, outputDirectory=path.join(workDirectory, "repeat="+str(next(repeatNums))));
+        return lambda: run_tools.run_reps(repeatParams, numReps, verbose=False, numCores=numCores, batched=batched, seed=1);
+    return prepare;
+
+
+#Writes a sweep over fertilityRate with sweepSize parameter sets of numReps
+# repeats each to rootDirectory, in the same layout as run_tools.run_sweep, but
+# with random time series instead of simulated ones so large sweeps are quick
+# to create.
+def write_synthetic_sweep(rootDirectory, sweepSize, numReps, outputFormat, maxTime=100, seed=1):
+    rng = np.random.default_rng(seed);
+    fertilityRates = [round(value, 6) for value in np.linspace(0.05, 0.1, sweepSize)];
+    baseParams = parameters.override_default_parameters({"maxTime": maxTime, "outputFormat": outputFormat, "outputDirectory": rootDirectory});
+    ownsDataset = run_tools.claim_dataset_directory(baseParams);
+    makedirs(rootDirectory, exist_ok=True);
+    with open(path.join(rootDirectory, "sweep_info.json"), "w") as file:
+        json.dump({"fertilityRate": fertilityRates}, file, indent=2);
+    for fertilityRate in fertilityRates:
+        for r in range(numReps):
+            params = dict(baseParams, fertilityRate=fertilityRate, outputDirectory=path.join(rootDirectory, "fertilityRate="+str(fertilityRate), "rep="+str(r)));
+            run_tools.set_seed(params, seed, [r]);
+            births = rng.poisson(fertilityRate*baseParams["initialPopulationSize"]*0.3, size=maxTime);
+            deaths = rng.poisson(baseParams["mortalityRate"]*baseParams["initialPopulationSize"], size=maxTime);
+            popSize = baseParams["initialPopulationSize"]+np.cumsum(births-deaths);
+            output_formats.write_run(params, {"popSize": popSize, "deaths": deaths, "births": births});
+    if ownsDataset:
+        output_formats.consolidate_dataset(baseParams["datasetDirectory"]);
+
+
+#Times extracting the growth rate of every run in a synthetic sweep.
+def extract_from_sweep_case(workDirectory, sweepSize, numReps, outputFormat, numWorkers):
+    rootDirectory = path.join(workDirectory, "sweep");
+    write_synthetic_sweep(rootDirectory, sweepSize, numReps, outputFormat);
+    return lambda: lambda: analysis_tools.extract_from_sweep(rootDirectory, data_extractors.get_population_growth_rate, numWorkers=numWorkers);
+
+
+benchmarkCases = {"run_model": run_model_case,
+                  "cohort_run_model": cohort_run_model_case,
+                  "model_step": model_step_case,
+                  "run_reps": run_reps_case,
+                  "extract_from_sweep": extract_from_sweep_case};
+
+
+#Grids of parameters for each case: {suiteName: {caseName: {paramName: values}}}.
+#Every combination of the values is run.
+benchmarkSuites = {
+    "quick": {"run_model": {"engine": ["array", "cohort"], "initialPopulationSize": [1000, 10000], "maxTime": [50]},
+              "cohort_run_model": {"initialPopulationSize": [10**5, 10**9], "maxTime": [50]},
+              "model_step": {"engine": ["array", "dataframe", "cohort"], "initialPopulationSize": [100000], "step": ["pairing", "reproduction", "mortality", "ageing"]},
+              "run_reps": {"numReps": [8], "numCores": [None, 2], "batched": [False, True], "initialPopulationSize": [1000], "maxTime": [50]},
+              "extract_from_sweep": {"sweepSize": [10], "numReps": [3], "outputFormat": ["csv", "npz", "sweep"], "numWorkers": [None]}},
+    "full": {"run_model": {"engine": ["array", "dataframe", "cohort"], "initialPopulationSize": [1000, 10000, 100000], "maxTime": [50, 200]},
+             "cohort_run_model": {"initialPopulationSize": [10**5, 10**7, 10**9], "maxTime": [50, 200]},
+             "model_step": {"engine": ["array", "dataframe", "cohort"], "initialPopulationSize": [10000, 100000, 1000000], "step": ["pairing", "reproduction", "mortality", "ageing"]},
+             "run_reps": {"numReps": [8, 32], "numCores": [None, 4], "batched": [False, True], "initialPopulationSize": [1000, 10000], "maxTime": [200]},
+             "extract_from_sweep": {"sweepSize": [10, 100], "numReps": [10], "outputFormat": ["csv", "npz", "sweep"], "numWorkers": [None, 4]}},
+    };
+
+
+#Returns a list of the parameters of every combination of values in grid.
+def expand_grid(grid):
+    names = list(grid.keys());
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])];
+
+
+#Returns the key identifying a case with the given parameters in the history.
+def get_case_key(name, caseParams):
+    return name+" "+json.dumps(caseParams, sort_keys=True);
+
+
+
+###Running
+#Times a single case with the given parameters numRepeats times.
+#Returns a dictionary of the case's name, parameters, median and minimum time
+# (in seconds) and the time of each repeat.
+def run_case(name, caseParams, numRepeats=3, workDirectory=None):
+    ownsWorkDirectory = workDirectory is None;
+    if ownsWorkDirectory:
+        workDirectory = tempfile.mkdtemp(prefix="benchmark_");
+    try:
+        prepare = benchmarkCases[name](workDirectory, **caseParams);
+        times = [];
+        for repeat in range(numRepeats):
+            timedFunction = prepare();
+            startTime = time.perf_counter();
+            timedFunction();
+            times.append(time.perf_counter()-startTime);
+    finally:
+        if ownsWorkDirectory:
+            shutil.rmtree(workDirectory, ignore_errors=True);
+    return {"name": name, "params": caseParams, "seconds": float(np.median(times)), "minSeconds": min(times), "times": times};
+
+
+#Runs every case of a suite (optionally only the cases named in caseNames).
+#suite: the name of a suite in benchmarkSuites, or a dictionary of grids in the
+#   same format.
+#Returns the list of results (see run_case).
+def run_suite(suite="quick", caseNames=None, numRepeats=3, verbose=True):
+    grids = benchmarkSuites[suite] if isinstance(suite, str) else suite;
+    results = [];
+    try:
+        for name, grid in grids.items():
+            if caseNames is not None and name not in caseNames:
+                continue;
+            for caseParams in expand_grid(grid):
+                result = run_case(name, caseParams, numRepeats);
+                if verbose:
+                    print("{:.4f}s".format(result["seconds"]), get_case_key(name, caseParams));
+                results.append(result);
+    finally:
+        run_tools.shutdown_shared_runner();
+    return results;
+
+
+#Returns the hash of the current git commit, or None if it isn't available.
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=filepaths.projectRoot, capture_output=True, text=True, check=True).stdout.strip();
+    except (OSError, subprocess.CalledProcessError):
+        return None;
+
+
+#Returns a history entry for a set of results, recording when, where and on
+# which version of the code they were measured.
+def make_history_entry(results, suite):
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": get_git_commit(),
+            "suite": suite if isinstance(suite, str) else "custom",
+            "machine": platform.node(),
+            "cpuCount": cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "results": results};
+
+
+#Reads the history file: a list of entries (see make_history_entry), oldest
+# first. Returns an empty list if there's no history yet.
+def load_history(filepath=historyFilepath):
+    if path.exists(filepath) == False:
+        return [];
+    with open(filepath) as file:
+        return json.load(file);
+
+
+#Appends an entry to the history file.
+def append_history(entry, filepath=historyFilepath):
+    history = load_history(filepath);
+    history.append(entry);
+    if path.dirname(filepath) != "":
+        makedirs(path.dirname(filepath), exist_ok=True);
+    output_formats.write_params_file(history, filepath);
+    return history;
+
+
+
+###Comparison
+#Compares the results of two history entries. Cases in both are compared by
+# their median time.
+#Returns a list of dictionaries, one per case in both entries, containing the
+# case's key, baseline and current times, their ratio and whether the case has
+# regressed (is slower by more than threshold, as a fraction of the baseline).
+def compare_entries(baselineEntry, currentEntry, threshold=defaultThreshold):
+    baselineSeconds = {get_case_key(result["name"], result["params"]): result["seconds"] for result in baselineEntry["results"]};
+    comparisons = [];
+    for result in currentEntry["results"]:
+        key = get_case_key(result["name"], result["params"]);
+        if key not in baselineSeconds:
+            continue;
+        ratio = result["seconds"]/baselineSeconds[key] if baselineSeconds[key] > 0 else float("inf");
+        comparisons.append({"key": key, "baselineSeconds": baselineSeconds[key], "currentSeconds": result["seconds"], "ratio": ratio, "regressed": ratio > 1+threshold});
+    return comparisons;
+
+
+#Compares two entries of the history file, given by their index (by default the
+# latest entry against the one before). Prints the comparison if verbose.
+#Returns the comparisons (see compare_entries).
+def compare_history(filepath=historyFilepath, baseline=-2, current=-1, threshold=defaultThreshold, verbose=True):
+    history = load_history(filepath);
+    if len(history) < 2:
+        raise ValueError("At least two benchmark runs are needed for a comparison, found "+str(len(history))+" in "+filepath);
+    baselineEntry, currentEntry = history[baseline], history[current];
+    comparisons = compare_entries(baselineEntry, currentEntry, threshold);
+    if verbose:
+        print("Baseline:", baselineEntry["timestamp"], baselineEntry["commit"], "Current:", currentEntry["timestamp"], currentEntry["commit"]);
+        if baselineEntry["machine"] != currentEntry["machine"]:
+            print("Warning: the runs were on different machines ("+str(baselineEntry["machine"])+", "+str(currentEntry["machine"])+")");
+        for comparison in comparisons:
+            print("{:>10.4f}s {:>10.4f}s {:>7.2f}x {}{}".format(comparison["baselineSeconds"], comparison["currentSeconds"], comparison["ratio"], comparison["key"], "  REGRESSION" if comparison["regressed"] else ""));
+        print(sum(comparison["regressed"] for comparison in comparisons), "of", len(comparisons), "cases regressed by more than", "{:.0%}".format(threshold));
+    return comparisons;
+
+
+
+#Command line entry point (see the top of this file).
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run benchmarks of the model and analysis tools, or compare benchmark runs (see utilities/benchmarks.py).");
+    parser.add_argument("--history", default=historyFilepath, help="path of the benchmark history file");
+    subparsers = parser.add_subparsers(dest="command", required=True);
+    runParser = subparsers.add_parser("run", help="run benchmarks and append the results to the history");
+    runParser.add_argument("--suite", default="quick", choices=list(benchmarkSuites.keys()));
+    runParser.add_argument("--case", action="append", default=None, choices=list(benchmarkCases.keys()), help="only run this case (can be repeated)");
+    runParser.add_argument("--repeats", type=int, default=3, help="number of times each case is timed");
+    compareParser = subparsers.add_parser("compare", help="compare two benchmark runs in the history");
+    compareParser.add_argument("--baseline", type=int, default=-2, help="index of the baseline run in the history (default: the second to last)");
+    compareParser.add_argument("--current", type=int, default=-1, help="index of the run to compare (default: the last)");
+    compareParser.add_argument("--threshold", type=float, default=defaultThreshold, help="fractional slow down counted as a regression");
+    args = parser.parse_args(argv);
+
+    if args.command == "run":
+        results = run_suite(args.suite, args.case, args.repeats);
+        append_history(make_history_entry(results, args.suite), args.history);
+        return 0;
+    comparisons = compare_history(args.history, args.baseline, args.current, args.threshold);
+    return 1 if any(comparison["regressed"] for comparison in comparisons) else 0;
+
+
+if __name__ == "__main__":
+    sys.exit(main());
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Checkpoints save the full state of a run part way through: every living agent,
+# the time series output so far and the state of the run's random number
+# generator. They're used in two ways:
+#Restarting: with the 'checkpointInterval' parameter set, a run saves a
+#   checkpoint every checkpointInterval time steps (replacing the last one). If
+#   the run is interrupted (e.g. its job is preempted) running it again resumes
+#   from the checkpoint, and gives exactly the same output as an uninterrupted
+#   run. The checkpoint is removed once the run's output has been written.
+#Warm starting: simple_model.run_burn_in simulates a population until it has
+#   settled down and saves its final state. Runs with the 'warmStartCheckpoint'
+#   parameter set to the path of that checkpoint start from its population
+#   (instead of simple_model.initialise_agents), so the burn in isn't repeated
+#   by every run in a sweep. Only the agents are used: each run still uses its
+#   own random number generator, and its time series start from the warm start.
+#Agents are stored in an engine independent format (see
+# simple_model.make_agent_state), so any engine can restore them.
+#A checkpoint is only resumed by the run which saved it, identified by the same
+# key as the result cache (its parameters, apart from where its output is
+# stored, and the model version). The wall clock budget (maxRunTime) restarts
+# when a run is resumed.
+
+from os import path, remove;
+import json;
+import numpy as np;
+
+from utilities import output_formats;
+
+
+#Name of a run's checkpoint file in its output directory, and its extension for
+# runs stored in a sweep dataset (see output_formats.get_run_extra_filepath).
+checkpointFilename = "run_checkpoint.npz";
+checkpointExtension = ".checkpoint";
+
+#Names of the time series stored in a checkpoint, in the order they're returned
+# by the engines' simulate functions.
+checkpointTimeSeriesNames = ("popSize", "deaths", "births");
+
+
+#Returns the path of the checkpoint file of a run.
+def get_checkpoint_filepath(params):
+    return output_formats.get_run_extra_filepath(params, checkpointFilename, checkpointExtension);
+
+
+#Writes a checkpoint. checkpoint is a dictionary containing:
+#step: the last time step simulated.
+#agents: the agent state (see simple_model.make_agent_state).
+#timeSeries: the population size, deaths and births time series so far.
+#rngState: the state of the run's random number generator (bit_generator.state).
+#runKey: identifies the run (see Checkpointer).
+#stopReason, stopStep: the run's stopping reason and step if it has already
+#   stopped (a replicate stopped early in a batch), otherwise None.
+def save_checkpoint(filepath, checkpoint):
+    arrays = {"agent_"+name: values for name, values in checkpoint["agents"].items()};
+    for name, values in zip(checkpointTimeSeriesNames, checkpoint["timeSeries"]):
+        arrays[name] = np.asarray(values, dtype=np.int64);
+    info = {name: checkpoint[name] for name in ("step", "rngState", "runKey", "stopReason", "stopStep")};
+    arrays["info"] = np.array(json.dumps(info, default=int));
+    output_formats.write_npz_atomic(filepath, arrays);
+
+
+#Reads a checkpoint written by save_checkpoint. Returns None if there isn't one.
+def load_checkpoint(filepath):
+    if path.exists(filepath) == False:
+        return None;
+    with np.load(filepath) as file:
+        checkpoint = json.loads(str(file["info"]));
+        checkpoint["agents"] = {key[len("agent_"):]: file[key] for key in file.files if key.startswith("agent_")};
+        checkpoint["timeSeries"] = tuple(file[name].tolist() for name in checkpointTimeSeriesNames);
+    return checkpoint;
+
+
+#Saves and restores the checkpoints of a single run. Engines call start before
+# the main simulation loop, then save whenever is_due.
+#filepath: where the run's checkpoints are saved (None to never save or resume).
+#interval: time steps between checkpoints (default: params["checkpointInterval"]).
+#saveLastStep: also save a checkpoint after the last time step (used for burn in).
+#The run's key is only calculated when a checkpoint is saved or found, as it
+# hashes the warm start checkpoint and any rate schedule files (see
+# result_cache.get_cache_key), and every run which writes output has a Checkpointer.
+class Checkpointer:
+    def __init__(self, params, filepath=None, interval=None, saveLastStep=False):
+        self.params = dict(params);
+        self.filepath = filepath;
+        self.interval = params.get("checkpointInterval") if interval is None else interval;
+        self.maxTime = params["maxTime"];
+        self.saveLastStep = saveLastStep;
+        self.warmStartFilepath = params.get("warmStartCheckpoint");
+        self.runKey = None;
+
+    #Returns the key identifying this run.
+    def get_run_key(self):
+        from utilities import result_cache; #imported here as result_cache imports the model, which uses this module
+        if self.runKey is None:
+            self.runKey = result_cache.get_cache_key(self.params);
+        return self.runKey;
+
+    #Returns this run's checkpoint, or None if it doesn't have one (or the
+    # checkpoint belongs to a run with different parameters).
+    def load(self):
+        if self.filepath is None:
+            return None;
+        checkpoint = load_checkpoint(self.filepath);
+        if checkpoint is None or checkpoint["runKey"] != self.get_run_key():
+            return None;
+        return checkpoint;
+
+    #Returns the agents to start from if the run has a warm start, otherwise None.
+    def load_warm_start_agents(self):
+        if self.warmStartFilepath is None:
+            return None;
+        checkpoint = load_checkpoint(self.warmStartFilepath);
+        if checkpoint is None:
+            raise FileNotFoundError("Warm start checkpoint not found: "+str(self.warmStartFilepath));
+        return checkpoint["agents"];
+
+    #Returns the state to start the simulation from: the agent state (None if
+    # the population should be initialised as normal), the time series so far
+    # and the first time step to simulate. If the run is resumed from a
+    # checkpoint the state of rng (and stopping, if the run had already
+    # stopped) is restored too.
+    def start(self, rng, stopping):
+        return self.restore(self.load(), rng, stopping);
+
+    #As start, but resuming from the given checkpoint (or None to start afresh).
+    def restore(self, checkpoint, rng, stopping):
+        if checkpoint is None:
+            return self.load_warm_start_agents(), ([], [], []), 0;
+        rng.bit_generator.state = checkpoint["rngState"];
+        if checkpoint["stopReason"] is not None:
+            stopping.stop(checkpoint["stopReason"], checkpoint["stopStep"]);
+            return checkpoint["agents"], checkpoint["timeSeries"], self.maxTime;
+        return checkpoint["agents"], checkpoint["timeSeries"], checkpoint["step"]+1;
+
+    #Returns True if a checkpoint should be saved after time step t.
+    def is_due(self, t):
+        if self.filepath is None or self.interval is None:
+            return False;
+        if t+1 == self.maxTime:
+            return self.saveLastStep;
+        return (t+1) % self.interval == 0;
+
+    #Saves a checkpoint after time step t.
+    #agents: the agent state, timeSeries: the time series so far.
+    def save(self, t, agents, timeSeries, rng, stopping):
+        save_checkpoint(self.filepath, {"step": t, "agents": agents, "timeSeries": timeSeries, "rngState": rng.bit_generator.state,
+                                        "runKey": self.get_run_key(), "stopReason": stopping.reason, "stopStep": stopping.step});
+
+    #Removes the run's checkpoint (once its output has been written).
+    def remove(self):
+        if self.filepath is not None and path.exists(self.filepath):
+            remove(self.filepath);
+
+
+#Removes the checkpoint of a run whose output has been written separately (see
+# run_tools.OutputWriterThread), if it has one.
+def remove_checkpoint(params):
+    checkpointFilepath = get_checkpoint_filepath(params);
+    if path.exists(checkpointFilepath):
+        remove(checkpointFilepath);
+
+
+#Equivalent of Checkpointer.start for a batch of replicates (see
+# batch_engine.py), which are simulated in lock step so can only be resumed if
+# every replicate has a checkpoint saved after the same time step.
+#Returns a list of agent states (or None if the population should be
+# initialised as normal), the time series of each replicate and the first time
+# step to simulate.
+def start_batch(checkpointers, rngs, stoppings):
+    checkpoints = [checkpointer.load() for checkpointer in checkpointers];
+    if any(checkpoint is None for checkpoint in checkpoints) or len(set(checkpoint["step"] for checkpoint in checkpoints)) != 1:
+        checkpoints = [None]*len(checkpointers);
+    starts = [checkpointer.restore(checkpoint, rng, stopping) for checkpointer, checkpoint, rng, stopping in zip(checkpointers, checkpoints, rngs, stoppings)];
+    agentStates = [start[0] for start in starts];
+    if any(agentState is None for agentState in agentStates):
+        agentStates = None;
+    startStep = min(checkpoint["step"] for checkpoint in checkpoints)+1 if checkpoints[0] is not None else 0;
+    return agentStates, [start[1] for start in starts], startStep;
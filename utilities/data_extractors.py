@@ -10,19 +10,74 @@ Created on Wed Jun 29 07:46:57 2022
 #Prevents code duplication, improves readability and meanst here's a single
 # point to update these in the code.
 
-from os import path;
-import pandas as pd;
 import numpy as np;
-import json;
+
+from utilities import output_formats;
+
+
+#Output is read with output_formats, which detects how it was stored (csv, npz
+# or a sweep dataset), so these functions work with any outputFormat.
+#Every function takes a run's directory, which may also be a RunRecord (see
+# below) when several functions are applied to the same run.
+
+
+#A run's directory, which also keeps the run's output in memory once it has
+# been read. This is a str (the directory path) so it can be passed to any
+# function expecting a directory, but functions which read output using
+# load_time_series / get_params_file below only read each file once however
+# many of them are applied to the same RunRecord.
+#See analysis_tools.extract_many_from_sweep.
+class RunRecord(str):
+    def __new__(cls, directory):
+        record = super().__new__(cls, directory);
+        record.timeSeries = None;
+        record.params = None;
+        return record;
+
+
+#Returns a RunRecord for a run_results.RunResult, which uses the result's time
+# series and parameters if it has them (e.g. a run which wasn't written to
+# disk), so extractors can be applied to results in memory.
+def get_run_record(result):
+    record = RunRecord(result.outputDirectory);
+    if result.timeSeries is not None:
+        record.timeSeries = result.timeSeries;
+        record.params = result.params;
+    return record;
+
+
+#Returns the time series output by a run as a dictionary of {name: array}.
+#columns: names of the time series to read (default: all of them).
+def load_time_series(directory, columns=None):
+    if isinstance(directory, RunRecord):
+        if directory.timeSeries is None:
+            directory.timeSeries = output_formats.load_time_series(directory);
+        return {name: directory.timeSeries[name] for name in (columns if columns is not None else directory.timeSeries)};
+    return output_formats.load_time_series(directory, columns);
+
+
+#Returns the metadata stored with a run's output (see output_formats.get_stored_metadata),
+# e.g. "stopReason" and "stopStep" (see simple_model.StoppingCriteria).
+def get_run_metadata(directory):
+    return output_formats.load_metadata(directory);
+
+
+#Returns why a run stopped, e.g. "maxTime", "extinct" or "maxPopulationSize"
+# (see simple_model.StoppingCriteria). Runs written before this was recorded
+# return None.
+def get_stop_reason(directory):
+    return get_run_metadata(directory).get("stopReason");
 
 
 #Returns an array containing the time series of population size
 def get_pop_size_time_series(directory):
-    return pd.read_table(path.join(directory, "time_series_outputs.csv"), sep=",", usecols=["popSize"])["popSize"].to_numpy();
+    return load_time_series(directory, columns=["popSize"])["popSize"];
 
 
 #Returns the average growth rate of the populatuon (from initial population to last time step).
 #Time in 'time steps'
+#Runs stopped early (see get_stop_reason) have shorter time series, so the rate
+# is the average over the time steps actually simulated.
 def get_population_growth_rate(directory):
     popSizeTS = get_pop_size_time_series(directory);
     return np.log(popSizeTS[-1]/popSizeTS[0])/(len(popSizeTS));
@@ -30,16 +85,18 @@ def get_population_growth_rate(directory):
 
 #Returns an array containing the time series of the birth:death ratio
 def get_birth_death_ratio_time_series(directory):
-    tsData = pd.read_table(path.join(directory, "time_series_outputs.csv"), sep=",")
-    birthDeathRatio = tsData["births"].to_numpy() / tsData["deaths"].to_numpy();
+    tsData = load_time_series(directory, columns=["births", "deaths"]);
+    birthDeathRatio = tsData["births"] / tsData["deaths"];
     return birthDeathRatio;
 
 
 #Returns the parameters used in a simulation in dictionary format.
 def get_params_file(directory):
-    with open(path.join(directory, "params_used.json"), "r") as f:
-        config = json.load(f);
-        return config;
+    if isinstance(directory, RunRecord):
+        if directory.params is None:
+            directory.params = output_formats.load_params(directory);
+        return directory.params;
+    return output_formats.load_params(directory);
 
 
 
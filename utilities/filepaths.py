@@ -16,3 +16,7 @@ projectRoot = path.abspath(path.join(path.dirname(__file__), ".."));
 inputDataDir = path.join(projectRoot, "input_data");
 modelOutputRoot = path.join(projectRoot, "model_output");
 figuresOutputRoot  = path.join(projectRoot, "figures");
+extractionCacheDir = path.join(modelOutputRoot, "extraction_cache"); #see analysis_tools.extract_from_run_directories
+resultCacheDir = path.join(modelOutputRoot, "result_cache"); #see result_cache.py
+benchmarkDir = path.join(modelOutputRoot, "benchmarks"); #see benchmarks.py
+rateScheduleCacheDir = path.join(modelOutputRoot, "rate_schedule_cache"); #see rate_schedules.py
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#This file defines how simulation output is stored on disk, and how it is read
+# back in. Keeping both sides in one place means the model (which writes output)
+# and data_extractors / analysis_tools (which read it) can't disagree on file
+# names or formats.
+#The format is chosen with the 'outputFormat' parameter:
+#   "csv": each run's directory contains params_used.json,
+#          time_series_outputs.csv (the original, human readable format) and
+#          run_metadata.json (e.g. why and when the run stopped).
+#   "npz": as "csv" but the time series are stored in a binary columnar
+#          time_series_outputs.npz file, which is much faster to read.
+#   "sweep": no per-run files. Every run of a sweep (or set of repeats) is
+#          stored in a single columnar dataset, sweep_dataset.npz, in the
+#          sweep's root directory (params["datasetDirectory"], set by run_tools).
+#          Each row is keyed by the run's path relative to the root (e.g.
+#          "fertilityRate=0.1/rep=3"), its repeat number, its parameters and
+#          its metadata.
+#          Runs write to a small part file as they finish, and run_tools
+#          consolidates the parts into the dataset when the sweep is complete.
+#Readers detect the format automatically, so a run's output directory is all
+# they need regardless of how it was written. For the "sweep" format the run
+# directory is 'virtual': it doesn't exist on disk, but the dataset is found by
+# searching its parent directories.
+
+from os import path, makedirs, listdir, replace, remove, getpid, walk;
+import re;
+import json;
+import hashlib;
+import numpy as np;
+import pandas as pd;
+
+
+paramsFilename = "params_used.json";
+metadataFilename = "run_metadata.json";
+csvFilename = "time_series_outputs.csv";
+npzFilename = "time_series_outputs.npz";
+datasetFilename = "sweep_dataset.npz";
+datasetPartsDirname = "sweep_dataset_parts";
+
+#Names of the time series output by the model, in the order they are stored.
+timeSeriesNames = ["popSize", "deaths", "births"];
+
+#Entries of a RunResult's metadata which describe where and how the result was
+# obtained, rather than the run itself, so aren't stored with its output.
+unstoredMetadataNames = ("outputFilepath", "cacheHit", "profile");
+
+
+#Output files are written under a temporary name then renamed, so a file
+# either doesn't exist or is complete: readers never see a partially written
+# file, and a run which is killed or crashes part way through writing its
+# output is not mistaken for a finished run.
+
+#Returns the temporary path to write filepath to before renaming it.
+def get_temp_filepath(filepath):
+    return filepath+".tmp"+str(getpid());
+
+
+#Converts numpy values (e.g. an array passed as a parameter) to the equivalent
+# Python values, so they can be stored as JSON. Arrays with more than
+# maxStoredArraySize elements are stored as their description instead (see
+# describe_array).
+def to_json_value(value):
+    if isinstance(value, np.ndarray) and value.size > maxStoredArraySize:
+        return describe_array(value);
+    if hasattr(value, "tolist"):
+        return value.tolist();
+    raise TypeError("Value can't be stored as JSON: "+repr(value));
+
+
+#Large arrays passed as parameters (e.g. a rate table, see rate_schedules.py)
+# aren't stored value by value in params files, sweep datasets or result cache
+# keys, as this would write (and hash) the whole array as text for every run.
+# They're stored as a description instead: {"array": SHA-256 hash of the
+# contents, "shape": shape, "dtype": dtype}, which identifies the array but
+# can't be turned back into it.
+maxStoredArraySize = 1000;
+
+#Descriptions of read-only memory mapped arrays (e.g. those broadcast to
+# workers, see shared_inputs.py), so each is only hashed once:
+# {id(array): (array, description)}. Other arrays are hashed every time, as
+# they may have been changed.
+_arrayDescriptions = {};
+maxArrayDescriptions = 16;
+
+
+#Returns the description of an array stored in place of its values.
+def describe_array(array):
+    if id(array) in _arrayDescriptions:
+        return _arrayDescriptions[id(array)][1];
+    contents = np.ascontiguousarray(array);
+    description = {"array": hashlib.sha256(contents.data).hexdigest(), "shape": list(array.shape), "dtype": str(array.dtype)};
+    if isinstance(array, np.memmap) and array.flags.writeable == False:
+        if len(_arrayDescriptions) >= maxArrayDescriptions:
+            _arrayDescriptions.clear();
+        _arrayDescriptions[id(array)] = (array, description);
+    return description;
+
+
+#Returns True if value is the description of an array (see describe_array),
+# e.g. a parameter read back from a params file.
+def is_array_description(value):
+    return isinstance(value, dict) and set(value) == {"array", "shape", "dtype"};
+
+
+#Writes params to a JSON file.
+def write_params_file(params, filepath):
+    tempFilepath = get_temp_filepath(filepath);
+    with open(tempFilepath, "w") as file:
+        json.dump(params, file, indent=4, default=to_json_value);
+    replace(tempFilepath, filepath);
+
+
+#Writes a set of arrays to an .npz file.
+def write_npz_atomic(filepath, arrays):
+    tempFilepath = get_temp_filepath(filepath);
+    with open(tempFilepath, "wb") as file:
+        np.savez(file, **arrays);
+    replace(tempFilepath, filepath);
+
+
+#Returns the SHA-1 hash of a file's contents.
+def hash_file(filepath):
+    fileHash = hashlib.sha1();
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            fileHash.update(block);
+    return fileHash.hexdigest();
+
+
+
+#Each output format is a writer object with the same three methods:
+#prepare(params): called before the simulation starts.
+#write(params, timeSeries, verbose, metadata): writes the output of a finished
+#   run, where timeSeries is a dictionary of {timeSeriesName: values} and
+#   metadata is an optional dictionary of information about the run (see
+#   get_stored_metadata). Returns the path of the time series file written.
+#exists(params): returns True if output for this run has already been written.
+
+#Original format: one directory per run with a csv file for the time series.
+#A run's directory is created (containing params_used.json) before it starts,
+# but the run is only complete once its time series file exists.
+class CsvWriter:
+    outputFilename = csvFilename;
+
+    def prepare(self, params):
+        if path.exists(params["outputDirectory"]) == False:
+            makedirs(params["outputDirectory"]);
+        write_params_file(params, path.join(params["outputDirectory"], paramsFilename));
+
+    def write(self, params, timeSeries, verbose=False, metadata=None):
+        if metadata is not None:
+            write_params_file(get_stored_metadata(metadata), path.join(params["outputDirectory"], metadataFilename));
+        output = pd.DataFrame();
+        for name in timeSeriesNames:
+            output[name] = timeSeries[name];
+        outputFile = path.join(params["outputDirectory"], csvFilename);
+        tempFilepath = get_temp_filepath(outputFile);
+        output.to_csv(tempFilepath, sep=",");
+        replace(tempFilepath, outputFile);
+        if verbose:
+            print("Output written to", outputFile);
+        return outputFile;
+
+    def exists(self, params):
+        return path.exists(path.join(params["outputDirectory"], self.outputFilename));
+
+
+#One directory per run, time series stored in a binary .npz file.
+class NpzWriter(CsvWriter):
+    outputFilename = npzFilename;
+
+    def write(self, params, timeSeries, verbose=False, metadata=None):
+        if metadata is not None:
+            write_params_file(get_stored_metadata(metadata), path.join(params["outputDirectory"], metadataFilename));
+        outputFile = path.join(params["outputDirectory"], npzFilename);
+        write_npz_atomic(outputFile, {name: np.asarray(timeSeries[name], dtype=np.int64) for name in timeSeriesNames});
+        if verbose:
+            print("Output written to", outputFile);
+        return outputFile;
+
+
+#All runs stored in a single dataset in params["datasetDirectory"].
+class SweepDatasetWriter:
+    def prepare(self, params):
+        makedirs(path.join(params["datasetDirectory"], datasetPartsDirname), exist_ok=True);
+
+    def write(self, params, timeSeries, verbose=False, metadata=None):
+        runPath = get_run_path(params);
+        outputFile = get_part_filepath(params["datasetDirectory"], runPath);
+        write_npz_atomic(outputFile, make_dataset_arrays([runPath], [params], [timeSeries], [get_stored_metadata(metadata)]));
+        if verbose:
+            print("Output written to", outputFile);
+        return outputFile;
+
+    #Only checks the run's own part file and the run paths of the consolidated
+    # dataset, as this is called before every run of a sweep: loading the whole
+    # dataset (which merges every part file) would make a sweep quadratic.
+    def exists(self, params):
+        runPath = get_run_path(params);
+        if path.exists(get_part_filepath(params["datasetDirectory"], runPath)):
+            return True;
+        return runPath in get_consolidated_run_paths(params["datasetDirectory"]);
+
+
+#Writes the output of a finished run in the format given by params["outputFormat"].
+#Returns the path of the file written.
+def write_run(params, timeSeries, verbose=False, metadata=None):
+    writer = get_writer(params);
+    writer.prepare(params);
+    return writer.write(params, timeSeries, verbose, metadata);
+
+
+#Returns the part of a run's metadata which is stored with its output.
+def get_stored_metadata(metadata):
+    return {name: value for name, value in (metadata or {}).items() if name not in unstoredMetadataNames};
+
+
+writers = {"csv": CsvWriter(),
+           "npz": NpzWriter(),
+           "sweep": SweepDatasetWriter(),
+           };
+
+
+#Returns the writer for the format named by params["outputFormat"].
+def get_writer(params):
+    outputFormat = params.get("outputFormat", "csv");
+    if outputFormat not in writers:
+        raise ValueError("Unrecognised outputFormat: "+str(outputFormat));
+    return writers[outputFormat];
+
+
+
+###Sweep datasets
+#Returns the path of a run relative to its dataset's root directory, using "/"
+# as the separator on every platform.
+def get_run_path(params):
+    runPath = path.relpath(params["outputDirectory"], params["datasetDirectory"]);
+    return "/".join(runPath.split(path.sep));
+
+
+#Returns the path of the part file used to store a single run before consolidation.
+def get_part_filepath(datasetDirectory, runPath):
+    return path.join(datasetDirectory, datasetPartsDirname, hashlib.sha1(runPath.encode()).hexdigest()+".npz");
+
+
+#Returns the path of an extra file kept with a run's output (e.g. its checkpoint
+# or profile): filename in the run's output directory, or for runs stored in a
+# sweep dataset (which have no directory of their own) next to the run's part
+# file, with extension in place of ".npz" so it isn't mistaken for a part file.
+def get_run_extra_filepath(params, filename, extension):
+    if params.get("outputFormat", "csv") == "sweep":
+        partFilepath = get_part_filepath(params["datasetDirectory"], get_run_path(params));
+        return path.splitext(partFilepath)[0]+extension;
+    return path.join(params["outputDirectory"], filename);
+
+
+#Returns the repeat number of a run from its path, or -1 if it isn't a repeat.
+def get_rep_number(runPath):
+    match = re.search(r"(^|/)rep=(\d+)$", runPath);
+    return int(match.group(2)) if match is not None else -1;
+
+
+#Packs a set of runs into the columnar arrays stored in a dataset file. The
+# time series of every run are concatenated, with run i stored at
+# [offsets[i], offsets[i+1]).
+#metadataList: the metadata of each run (None if there is none).
+def make_dataset_arrays(runPaths, paramsList, timeSeriesList, metadataList=None):
+    if metadataList is None:
+        metadataList = [{}]*len(runPaths);
+    lengths = [len(timeSeries[timeSeriesNames[0]]) for timeSeries in timeSeriesList];
+    arrays = {"runPath": np.array(runPaths, dtype=str),
+              "rep": np.array([get_rep_number(runPath) for runPath in runPaths], dtype=np.int64),
+              "params": np.array([json.dumps(params, default=to_json_value) for params in paramsList], dtype=str),
+              "metadata": np.array([json.dumps(metadata) for metadata in metadataList], dtype=str),
+              "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+              };
+    for name in timeSeriesNames:
+        arrays[name] = np.concatenate([np.asarray(timeSeries[name], dtype=np.int64) for timeSeries in timeSeriesList]+[np.zeros((0,), dtype=np.int64)]);
+    return arrays;
+
+
+#Reads an (unconsolidated or consolidated) dataset file into a dictionary of arrays.
+def read_dataset_file(filepath):
+    with np.load(filepath) as file:
+        return {key: file[key] for key in file.files};
+
+
+#Merges dataset arrays. Where the same run appears more than once the last one is kept.
+#Datasets written before metadata was stored have no "metadata" array.
+def merge_dataset_arrays(datasetArraysList):
+    rowsByRun = {};
+    for arrays in datasetArraysList:
+        for i, runPath in enumerate(arrays["runPath"]):
+            timeSeries = {name: arrays[name][arrays["offsets"][i]:arrays["offsets"][i+1]] for name in timeSeriesNames};
+            metadata = json.loads(str(arrays["metadata"][i])) if "metadata" in arrays else {};
+            rowsByRun[str(runPath)] = (json.loads(str(arrays["params"][i])), timeSeries, metadata);
+    runPaths = sorted(rowsByRun.keys());
+    return make_dataset_arrays(runPaths, *[[rowsByRun[runPath][column] for runPath in runPaths] for column in range(3)]);
+
+
+#Combines all part files into the dataset file for a sweep, then removes them.
+def consolidate_dataset(datasetDirectory):
+    partsDirectory = path.join(datasetDirectory, datasetPartsDirname);
+    datasetFilepath = path.join(datasetDirectory, datasetFilename);
+    partFilepaths = [path.join(partsDirectory, f) for f in listdir(partsDirectory) if f.endswith(".npz")] if path.exists(partsDirectory) else [];
+    if len(partFilepaths) == 0:
+        return;
+
+    datasetArraysList = [read_dataset_file(datasetFilepath)] if path.exists(datasetFilepath) else [];
+    datasetArraysList += [read_dataset_file(f) for f in sorted(partFilepaths, key=path.getmtime)];
+    write_npz_atomic(datasetFilepath, merge_dataset_arrays(datasetArraysList));
+    for partFilepath in partFilepaths:
+        remove(partFilepath);
+
+
+#Loaded datasets, so a whole sweep is only read from disk once:
+# {datasetDirectory: (modification key, dataset)}
+_datasetCache = {};
+
+
+#Run paths in consolidated dataset files: {datasetDirectory: (modification time, set of run paths)}
+_runPathsCache = {};
+
+
+#Returns the set of run paths stored in the consolidated dataset file in
+# datasetDirectory (not including any parts), reading only the runPath column.
+def get_consolidated_run_paths(datasetDirectory):
+    datasetFilepath = path.join(datasetDirectory, datasetFilename);
+    if path.exists(datasetFilepath) == False:
+        return set();
+    modifiedTime = path.getmtime(datasetFilepath);
+    if datasetDirectory not in _runPathsCache or _runPathsCache[datasetDirectory][0] != modifiedTime:
+        with np.load(datasetFilepath) as file:
+            _runPathsCache[datasetDirectory] = (modifiedTime, set(str(runPath) for runPath in file["runPath"]));
+    return _runPathsCache[datasetDirectory][1];
+
+
+#Returns the dataset stored in datasetDirectory (including any parts which
+# haven't been consolidated yet), or None if there isn't one. The returned
+# dictionary contains the dataset arrays plus "rowOfRun" mapping each run path
+# to its row, and "children" mapping each virtual directory to the names of the
+# directories it contains.
+def load_dataset(datasetDirectory):
+    datasetFilepath = path.join(datasetDirectory, datasetFilename);
+    partsDirectory = path.join(datasetDirectory, datasetPartsDirname);
+    modificationKey = tuple(path.getmtime(f) if path.exists(f) else None for f in (datasetFilepath, partsDirectory));
+    if modificationKey == (None, None):
+        return None;
+    if datasetDirectory in _datasetCache and _datasetCache[datasetDirectory][0] == modificationKey:
+        return _datasetCache[datasetDirectory][1];
+
+    datasetArraysList = [read_dataset_file(datasetFilepath)] if path.exists(datasetFilepath) else [];
+    if path.exists(partsDirectory):
+        partFilepaths = [path.join(partsDirectory, f) for f in listdir(partsDirectory) if f.endswith(".npz")];
+        datasetArraysList += [read_dataset_file(f) for f in sorted(partFilepaths, key=path.getmtime)];
+    dataset = merge_dataset_arrays(datasetArraysList) if len(datasetArraysList) != 1 else datasetArraysList[0];
+    dataset["rowOfRun"] = {str(runPath): i for i, runPath in enumerate(dataset["runPath"])};
+    dataset["children"] = {};
+    for runPath in dataset["rowOfRun"]:
+        parts = runPath.split("/");
+        for depth in range(len(parts)):
+            parent = "/".join(parts[0:depth]) if depth > 0 else ".";
+            dataset["children"].setdefault(parent, set()).add(parts[depth]);
+    _datasetCache[datasetDirectory] = (modificationKey, dataset);
+    return dataset;
+
+
+#Searches directory and its parents for a sweep dataset. Returns the dataset
+# and the path of directory relative to the dataset root, or (None, None).
+def find_dataset(directory):
+    directory = path.abspath(directory);
+    searchDirectory = directory;
+    while True:
+        if path.exists(path.join(searchDirectory, datasetFilename)) or path.exists(path.join(searchDirectory, datasetPartsDirname)):
+            dataset = load_dataset(searchDirectory);
+            if dataset is not None:
+                return dataset, "/".join(path.relpath(directory, searchDirectory).split(path.sep));
+        parentDirectory = path.dirname(searchDirectory);
+        if parentDirectory == searchDirectory:
+            return None, None;
+        searchDirectory = parentDirectory;
+
+
+#Loads a sweep dataset as a pandas DataFrame with one row per run: the run
+# path, repeat number and one column per parameter. Useful for selecting runs
+# by parameter value.
+def load_dataset_index(datasetDirectory):
+    dataset = load_dataset(datasetDirectory);
+    index = pd.DataFrame([json.loads(str(params)) for params in dataset["params"]]);
+    index.insert(0, "rep", dataset["rep"]);
+    index.insert(0, "runPath", dataset["runPath"]);
+    return index;
+
+
+
+###Readers
+#Returns the time series output by a run as a dictionary of {name: array}.
+#columns: names of the time series to read (default: all of them).
+def load_time_series(directory, columns=None):
+    if columns is None:
+        columns = timeSeriesNames;
+    if path.exists(path.join(directory, npzFilename)):
+        with np.load(path.join(directory, npzFilename)) as file:
+            return {name: file[name] for name in columns};
+    if path.exists(path.join(directory, csvFilename)):
+        tsData = pd.read_table(path.join(directory, csvFilename), sep=",", usecols=columns);
+        return {name: tsData[name].to_numpy() for name in columns};
+
+    dataset, runPath = find_dataset(directory);
+    if dataset is None or runPath not in dataset["rowOfRun"]:
+        raise FileNotFoundError("No simulation output found for "+str(directory));
+    row = dataset["rowOfRun"][runPath];
+    start, end = dataset["offsets"][row], dataset["offsets"][row+1];
+    return {name: dataset[name][start:end] for name in columns};
+
+
+#Returns the path of the file containing a run's time series: its own npz or
+# csv file, or the (part or consolidated) sweep dataset file containing it.
+def get_output_filepath(directory):
+    for filename in (npzFilename, csvFilename):
+        if path.exists(path.join(directory, filename)):
+            return path.join(directory, filename);
+    dataset, runPath = find_dataset(directory);
+    if dataset is None or runPath not in dataset["rowOfRun"]:
+        raise FileNotFoundError("No simulation output found for "+str(directory));
+    datasetDirectory = path.abspath(directory);
+    for i in range(len(runPath.split("/")) if runPath != "." else 0):
+        datasetDirectory = path.dirname(datasetDirectory);
+    partFilepath = get_part_filepath(datasetDirectory, runPath);
+    return partFilepath if path.exists(partFilepath) else path.join(datasetDirectory, datasetFilename);
+
+
+#Returns the parameters used by a run in dictionary format.
+def load_params(directory):
+    if path.exists(path.join(directory, paramsFilename)):
+        with open(path.join(directory, paramsFilename), "r") as file:
+            return json.load(file);
+
+    dataset, runPath = find_dataset(directory);
+    if dataset is None or runPath not in dataset["rowOfRun"]:
+        raise FileNotFoundError("No parameter file found for "+str(directory));
+    return json.loads(str(dataset["params"][dataset["rowOfRun"][runPath]]));
+
+
+#Returns the metadata stored with a run's output (see get_stored_metadata), or
+# an empty dictionary if there is none (e.g. output written by older versions).
+def load_metadata(directory):
+    if path.exists(path.join(directory, metadataFilename)):
+        with open(path.join(directory, metadataFilename), "r") as file:
+            return json.load(file);
+    if path.exists(path.join(directory, paramsFilename)):
+        return {};
+    
+    dataset, runPath = find_dataset(directory);
+    if dataset is None or runPath not in dataset["rowOfRun"]:
+        raise FileNotFoundError("No simulation output found for "+str(directory));
+    return json.loads(str(dataset["metadata"][dataset["rowOfRun"][runPath]])) if "metadata" in dataset else {};
+
+
+#Returns True if directory exists, either on disk or as a (virtual) directory
+# in a sweep dataset (i.e. a run, or a directory containing runs).
+def output_exists(directory):
+    if path.exists(directory):
+        return True;
+    dataset, runPath = find_dataset(directory);
+    if dataset is None:
+        return False;
+    return runPath in dataset["rowOfRun"] or runPath in dataset["children"];
+
+
+#Returns the full paths of the subdirectories of directory, including virtual
+# ones from a sweep dataset.
+def list_subdirectories(directory):
+    subdirectories = set();
+    if path.exists(directory):
+        subdirectories.update(name for name in listdir(directory) if path.isdir(path.join(directory, name)) and name != datasetPartsDirname);
+    dataset, runPath = find_dataset(directory);
+    if dataset is not None:
+        subdirectories.update(dataset["children"].get(runPath, set()));
+    return [path.join(directory, name) for name in sorted(subdirectories)];
+
+
+#Returns the most recent modification time of any simulation output (in any
+# format) in directory or its subdirectories, or 0 if there is none. Used to
+# check whether results derived from the output are out of date.
+def get_latest_output_time(directory):
+    outputFilenames = (paramsFilename, metadataFilename, csvFilename, npzFilename, datasetFilename);
+    latest = 0;
+    for dirpath, dirnames, filenames in walk(directory):
+        for filename in filenames:
+            if filename in outputFilenames or path.basename(dirpath) == datasetPartsDirname:
+                latest = max(latest, path.getmtime(path.join(dirpath, filename)));
+    return latest;
@@ -19,6 +19,21 @@ def get_default_params():
               "maxTime": 200, #years
               "mortalityRate": 0.015, #per year
               "fertilityRate": 0.075, #per year
+              "fertilitySchedule": None, #csv file in the input data directory of fertility rates by age of the mother, used instead of fertilityRate (None: use fertilityRate), see rate_schedules.py
+              "mortalitySchedule": None, #csv file in the input data directory of mortality rates by age and sex (e.g. a life table), used instead of mortalityRate (None: use mortalityRate)
+              "engine": "array", #agent representation used by the model, "array", "dataframe" (reference implementation) or "cohort" (counts of agents, for very large populations)
+              "incrementalPairing": False, #array engine only: keep pools of unpartnered adults up to date instead of finding them every step (faster for large populations, same distribution of output but different output for the same seed), see agent_store.SinglePools
+              "outputFormat": "csv", #how output is stored: "csv", "npz" (binary, faster to read) or "sweep" (one dataset per sweep), see output_formats.py
+              #Optional criteria for stopping a run before maxTime (None disables each), see simple_model.StoppingCriteria:
+              "maxPopulationSize": None, #agents, stop once the population is larger than this
+              "growthRateWindow": None, #time steps, stop once the growth rate over the last window differs from the window before by less than growthRateTolerance
+              "growthRateTolerance": 0.001, #per time step
+              "maxRunTime": None, #seconds (wall clock time)
+              "maxMemoryMB": None, #megabytes used by the process running the simulation
+              #Checkpoints, see checkpoints.py:
+              "checkpointInterval": None, #time steps between saving the state of a run, so it can be resumed if interrupted (None: never saved)
+              "warmStartCheckpoint": None, #path of a checkpoint saved by simple_model.run_burn_in to start from instead of a new population of initialPopulationSize agents
+              "profile": None, #None, "time" (time spent in each phase of the model) or "memory" (also memory allocated, much slower), see profiling.py
               "outputDirectory": path.join(filepaths.modelOutputRoot, "default_output_directory"),
               };
     return params;
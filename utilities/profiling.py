@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Optional profiling of where a run spends its time and memory, switched on with
+# the 'profile' parameter:
+#   None: no profiling (the default). Engines call the methods of a profiler
+#         which does nothing, so the cost is a few empty method calls per step.
+#   "time": the wall clock time of each phase of every time step (see
+#         stepPhaseNames), the population size and the memory used by the
+#         process (see simple_model.get_memory_usage_mb) after each step, and
+#         the time taken to initialise the population and write the output.
+#   "memory": as "time", plus the memory allocated in each phase (using
+#         tracemalloc, which slows the run down considerably): the net change
+#         in traced bytes, the peak traced bytes above the start of the phase
+#         and the net change in the number of allocated Python memory blocks.
+#A run's profile is stored as run_profile.npz, next to its time series file (or
+# next to its part file for the "sweep" output format, see
+# output_formats.get_run_extra_filepath). It contains the arrays:
+#   stepPhaseNames, stepSeconds[step, phase], popSize[step], memoryMB[step],
+#   runPhaseNames, runPhaseSeconds[phase], batchSize
+#   and for "memory" profiles stepNetBytes, stepPeakBytes and stepNetBlocks,
+#   each [step, phase].
+#A batch of repeats (see simple_model.run_model_batch) is profiled as a whole,
+# and its profile is stored with its first repeat's output.
+#run_tools summarises the profiles of every run in a set of repeats or a sweep
+# in sweep_profile.json in its root directory (see write_sweep_profile).
+
+from os import path, walk;
+import sys;
+import json;
+import time;
+import tracemalloc;
+import numpy as np;
+
+from utilities import output_formats;
+
+
+profileFilename = "run_profile.npz";
+profileExtension = ".profile";
+sweepProfileFilename = "sweep_profile.json";
+
+#Phases of each time step, in the order the engines run them. "bookkeeping"
+# covers everything else done in a step: storing output, consistency and
+# stopping checks, and saving checkpoints.
+stepPhaseNames = ("pairing", "reproduction", "mortality", "ageing", "bookkeeping");
+
+profileLevels = (None, "time", "memory");
+
+
+#Profiler which records nothing, used when profiling is switched off.
+class NullProfiler:
+    enabled = False;
+
+    def tick(self, phaseName):
+        pass;
+
+    def end_step(self, popSize):
+        pass;
+
+
+nullProfiler = NullProfiler();
+
+
+#Records the time (and optionally memory) used by each phase of a run. The
+# engines call tick(phaseName) at the end of each phase, and end_step after
+# each time step. A phase's time is the time since the previous tick.
+#Phases not in stepPhaseNames (e.g. "initialise", "output") are totalled for
+# the whole run rather than by step.
+class Profiler:
+    enabled = True;
+
+    def __init__(self, traceMemory=False, batchSize=1):
+        from model import simple_model; #imported here as the model uses this module
+        self.get_memory_usage_mb = simple_model.get_memory_usage_mb;
+        self.traceMemory = traceMemory;
+        self.batchSize = batchSize;
+        self.columnOf = {name: column for column, name in enumerate(stepPhaseNames)};
+        self.stepRows = [];
+        self.popSizes = [];
+        self.memoryMB = [];
+        self.runPhaseSeconds = {};
+        self.row = [0.0]*len(stepPhaseNames);
+        self.startedTracing = False;
+        if traceMemory:
+            if tracemalloc.is_tracing() == False:
+                tracemalloc.start();
+                self.startedTracing = True;
+            self.memoryRows = {name: [] for name in ("stepNetBytes", "stepPeakBytes", "stepNetBlocks")};
+            self.memoryRow = {name: [0]*len(stepPhaseNames) for name in self.memoryRows};
+            self.lastTraced = tracemalloc.get_traced_memory()[0];
+            self.lastBlocks = sys.getallocatedblocks();
+        self.last = time.perf_counter();
+
+    #Records the time (and memory) used since the last tick against phaseName.
+    def tick(self, phaseName):
+        now = time.perf_counter();
+        column = self.columnOf.get(phaseName);
+        if column is None:
+            self.runPhaseSeconds[phaseName] = self.runPhaseSeconds.get(phaseName, 0.0) + now-self.last;
+        else:
+            self.row[column] += now-self.last;
+            if self.traceMemory:
+                current, peak = tracemalloc.get_traced_memory();
+                blocks = sys.getallocatedblocks();
+                self.memoryRow["stepNetBytes"][column] += current-self.lastTraced;
+                self.memoryRow["stepPeakBytes"][column] = max(self.memoryRow["stepPeakBytes"][column], peak-self.lastTraced);
+                self.memoryRow["stepNetBlocks"][column] += blocks-self.lastBlocks;
+                if hasattr(tracemalloc, "reset_peak"): #Python 3.9+
+                    tracemalloc.reset_peak();
+                self.lastTraced, self.lastBlocks = current, blocks;
+        self.last = time.perf_counter(); #excludes the time spent profiling
+
+    #Records the end of a time step, after which the population has popSize agents.
+    def end_step(self, popSize):
+        self.stepRows.append(self.row);
+        self.row = [0.0]*len(stepPhaseNames);
+        self.popSizes.append(popSize);
+        self.memoryMB.append(self.get_memory_usage_mb());
+        if self.traceMemory:
+            for name, rows in self.memoryRows.items():
+                rows.append(self.memoryRow[name]);
+                self.memoryRow[name] = [0]*len(stepPhaseNames);
+        self.last = time.perf_counter();
+
+    #Stops tracing memory (if this profiler started it) and returns the profile
+    # as a dictionary of arrays (see the top of this file).
+    def get_profile(self):
+        if self.startedTracing:
+            tracemalloc.stop();
+            self.startedTracing = False;
+        numPhases = len(stepPhaseNames);
+        profile = {"stepPhaseNames": np.array(stepPhaseNames, dtype=str),
+                   "stepSeconds": np.array(self.stepRows, dtype=float).reshape(-1, numPhases),
+                   "popSize": np.array(self.popSizes, dtype=np.int64),
+                   "memoryMB": np.array(self.memoryMB, dtype=float),
+                   "runPhaseNames": np.array(list(self.runPhaseSeconds.keys()), dtype=str),
+                   "runPhaseSeconds": np.array(list(self.runPhaseSeconds.values()), dtype=float),
+                   "batchSize": np.array(self.batchSize)};
+        if self.traceMemory:
+            for name, rows in self.memoryRows.items():
+                profile[name] = np.array(rows, dtype=np.int64).reshape(-1, numPhases);
+        return profile;
+
+
+#Returns the profiler for a run (or batch of batchSize runs) with params.
+def get_profiler(params, batchSize=1):
+    level = params.get("profile");
+    if level not in profileLevels:
+        raise ValueError("Unrecognised profile level: "+str(level));
+    if level is None:
+        return nullProfiler;
+    return Profiler(traceMemory=level == "memory", batchSize=batchSize);
+
+
+#Returns the path of a run's profile file.
+def get_profile_filepath(params):
+    return output_formats.get_run_extra_filepath(params, profileFilename, profileExtension);
+
+
+#Writes the profile of the run with params.
+def write_profile(params, profile):
+    output_formats.write_npz_atomic(get_profile_filepath(params), profile);
+
+
+#Reads a profile file into a dictionary of arrays.
+def load_profile(filepath):
+    with np.load(filepath) as file:
+        return {key: file[key] for key in file.files};
+
+
+#Returns the paths of every profile file of the runs under rootDirectory.
+def find_profile_filepaths(rootDirectory):
+    filepaths = [];
+    for dirpath, dirnames, filenames in walk(rootDirectory):
+        for filename in filenames:
+            if filename == profileFilename or (filename.endswith(profileExtension) and path.basename(dirpath) == output_formats.datasetPartsDirname):
+                filepaths.append(path.join(dirpath, filename));
+    return sorted(filepaths);
+
+
+#Summarises a set of profiles: the total, mean (per run) and maximum time of
+# each phase and the fraction of the total time it accounts for, the number of
+# runs and time steps, and the largest population and memory use. "memory"
+# profiles also give the total net and largest peak traced bytes, and total net
+# allocated blocks, of each step phase.
+def summarise_profiles(profiles):
+    seconds = {};
+    memory = {};
+    numRuns = 0;
+    for profile in profiles:
+        numRuns += int(profile["batchSize"]);
+        phaseSeconds = dict(zip([str(name) for name in profile["stepPhaseNames"]], np.sum(profile["stepSeconds"], axis=0)));
+        phaseSeconds.update(zip([str(name) for name in profile["runPhaseNames"]], profile["runPhaseSeconds"]));
+        for name, value in phaseSeconds.items():
+            seconds.setdefault(name, []).append(float(value));
+        if "stepNetBytes" in profile:
+            for column, name in enumerate(str(name) for name in profile["stepPhaseNames"]):
+                phaseMemory = memory.setdefault(name, {"netBytes": 0, "peakBytes": 0, "netBlocks": 0});
+                phaseMemory["netBytes"] += int(np.sum(profile["stepNetBytes"][:, column]));
+                phaseMemory["peakBytes"] = max(phaseMemory["peakBytes"], int(np.max(profile["stepPeakBytes"][:, column], initial=0)));
+                phaseMemory["netBlocks"] += int(np.sum(profile["stepNetBlocks"][:, column]));
+
+    totalSeconds = sum(sum(values) for values in seconds.values());
+    summary = {"numRuns": numRuns,
+               "numProfiles": len(profiles),
+               "numSteps": int(sum(len(profile["popSize"]) for profile in profiles)),
+               "maxPopSize": int(max([np.max(profile["popSize"], initial=0) for profile in profiles], default=0)),
+               "maxMemoryMB": float(max([np.max(profile["memoryMB"], initial=0) for profile in profiles], default=0)),
+               "totalSeconds": totalSeconds,
+               "phases": {name: {"totalSeconds": sum(values), "meanSeconds": sum(values)/len(values), "maxSeconds": max(values),
+                                 "fraction": sum(values)/totalSeconds if totalSeconds > 0 else 0.0} for name, values in seconds.items()}};
+    if len(memory) > 0:
+        summary["memory"] = memory;
+    return summary;
+
+
+#Summarises the profiles of every run under rootDirectory (see
+# summarise_profiles) and writes the summary to sweep_profile.json in
+# rootDirectory. Returns the summary, or None if there are no profiles.
+def write_sweep_profile(rootDirectory):
+    profileFilepaths = find_profile_filepaths(rootDirectory);
+    if len(profileFilepaths) == 0:
+        return None;
+    summary = summarise_profiles([load_profile(filepath) for filepath in profileFilepaths]);
+    output_formats.write_params_file(summary, path.join(rootDirectory, sweepProfileFilename));
+    return summary;
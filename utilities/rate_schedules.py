@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Age and sex specific rate schedules (e.g. a life table), used in place of the
+# single mortalityRate and fertilityRate when the 'mortalitySchedule' and
+# 'fertilitySchedule' parameters are set (see simple_model.get_rates).
+#A schedule is a csv file, found in filepaths.inputDataDir unless its path is
+# absolute, with an "age" column and either a "rate" column (the same for both
+# sexes) or "male" and "female" columns. Rates are probabilities per time step.
+# Each row gives the rate from its age up to the next row's age, and the last
+# row gives the rate for every older age. E.g. a schedule in 5 year age bands:
+#   age,male,female
+#   0,0.005,0.004
+#   5,0.0005,0.0004
+#   ...
+#   85,0.15,0.12
+#Fertility schedules are indexed by the mother's age, so only the female rates
+# are used.
+#A table of rates (with a row for each age and a column for each sex) can also
+# be given as the value of the parameter directly instead of a file.
+#Schedules are compiled into a dense table of rates indexed by [age, sex]
+# (sex 1 is female), with one row for every age up to the last row of the
+# schedule. Looking up the rate of every agent is then a single fancy index
+# (see simple_model.get_agent_rates), with older agents using the last row.
+#Compiled tables are stored in filepaths.rateScheduleCacheDir under the hash of
+# the schedule file, and loaded as read-only memory maps, so they're only
+# compiled once for every run using the schedule, and worker processes share
+# the same memory rather than each holding its own copy. Each process also keeps
+# the tables of its last maxLoadedTables schedules, for as long as their files
+# are unchanged.
+
+from os import path, makedirs, replace, getpid, stat;
+import numpy as np;
+import pandas as pd;
+
+from utilities import filepaths, output_formats;
+
+
+#Tables loaded by this process, oldest first:
+# {schedule path: ((modification time, size), table)}.
+loadedTables = {};
+maxLoadedTables = 16;
+
+
+#Returns the path of a schedule file given the value of a schedule parameter.
+def get_schedule_filepath(schedule):
+    return path.join(filepaths.inputDataDir, schedule);
+
+
+#Reads a schedule file and compiles it into a dense table of rates by
+# [age, sex]. Raises a ValueError if the schedule isn't valid.
+def compile_schedule(filepath):
+    schedule = pd.read_csv(filepath);
+    if "age" not in schedule.columns:
+        raise ValueError("Rate schedule has no age column: "+filepath);
+    if "rate" in schedule.columns:
+        rates = np.stack([schedule["rate"].to_numpy(dtype=float)]*2, axis=1);
+    elif "male" in schedule.columns and "female" in schedule.columns:
+        rates = np.stack([schedule["male"].to_numpy(dtype=float), schedule["female"].to_numpy(dtype=float)], axis=1);
+    else:
+        raise ValueError("Rate schedule needs a rate column, or male and female columns: "+filepath);
+    ages = schedule["age"].to_numpy();
+    if len(ages) == 0 or np.any(ages != np.round(ages)) or ages[0] != 0 or np.any(np.diff(ages) <= 0):
+        raise ValueError("Rate schedule ages must be whole numbers increasing from 0: "+filepath);
+    if np.any(np.isnan(rates)) or np.any(rates < 0) or np.any(rates > 1):
+        raise ValueError("Rate schedule rates must be probabilities between 0 and 1: "+filepath);
+    rows = np.searchsorted(ages, np.arange(0, int(ages[-1])+1), side="right")-1;
+    return np.ascontiguousarray(rates[rows]);
+
+
+#Returns a table of rates given directly as a parameter value (e.g. an array,
+# or a list read back from a params_used.json file) as an array. Raises a
+# ValueError if it isn't a valid table. Large tables are stored in params files
+# as a description of the array rather than its values (see
+# output_formats.describe_array), so can't be read back.
+def as_table(table):
+    if output_formats.is_array_description(table):
+        raise ValueError("Rate table was stored as a description of the array (its hash and shape), so the array itself must be passed instead");
+    table = np.asarray(table, dtype=float);
+    if table.ndim != 2 or table.shape[0] == 0 or table.shape[1] != 2:
+        raise ValueError("Rate tables must have a row for each age and a column for each sex, not shape "+str(table.shape));
+    if np.any(np.isnan(table)) or np.any(table < 0) or np.any(table > 1):
+        raise ValueError("Rate table rates must be probabilities between 0 and 1");
+    return table;
+
+
+#Returns the compiled table of a schedule (see compile_schedule) as a read-only
+# memory map, compiling it and storing it in the cache if it isn't already.
+def load_table(schedule):
+    filepath = get_schedule_filepath(schedule);
+    fileStat = stat(filepath);
+    loadedKey = path.abspath(filepath);
+    fileVersion = (fileStat.st_mtime_ns, fileStat.st_size);
+    if loadedKey not in loadedTables or loadedTables[loadedKey][0] != fileVersion:
+        tableFilepath = path.join(filepaths.rateScheduleCacheDir, output_formats.hash_file(filepath)+".npy");
+        if path.exists(tableFilepath) == False:
+            makedirs(filepaths.rateScheduleCacheDir, exist_ok=True);
+            tempFilepath = tableFilepath+".tmp"+str(getpid())+".npy";
+            np.save(tempFilepath, compile_schedule(filepath));
+            replace(tempFilepath, tableFilepath);
+        loadedTables.pop(loadedKey, None); #the schedule has changed
+        if len(loadedTables) >= maxLoadedTables:
+            del loadedTables[next(iter(loadedTables))];
+        loadedTables[loadedKey] = (fileVersion, np.load(tableFilepath, mmap_mode="r"));
+    return loadedTables[loadedKey][1];
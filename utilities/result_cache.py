@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#A content addressed cache of simulation results, shared by every script which
+# runs the model. A run's output depends only on its parameters (including the
+# seed and seedSpawnKey) and the version of the model, so results are stored
+# under a hash of these rather than the run's outputDirectory. The same run
+# repeated under a different outputDirectory (e.g. by a different script) is
+# then copied from the cache instead of being simulated again.
+#Each entry is a directory in filepaths.resultCacheDir named by the run's key,
+# containing its time series file, its metadata (see
+# output_formats.get_stored_metadata) and the parameters it was created with.
+#Cached files are hard linked to the run's output directory where possible, so
+# a cache hit costs no extra disk space. Output files are only ever replaced
+# (see output_formats), never modified in place, so this can't corrupt the cache.
+#The cache's total size is limited to maxCacheBytes, by removing the least
+# recently used entries (see evict).
+
+from os import path, makedirs, listdir, scandir, link, replace, rename, utime;
+import shutil;
+import json;
+import hashlib;
+import numpy as np;
+
+from model import simple_model;
+from utilities import filepaths, output_formats, status_codes, rate_schedules;
+from utilities.run_results import RunResult;
+
+
+#Maximum total size of the cache in bytes.
+maxCacheBytes = 2*1024**3;
+
+#Parameters which only say where output is stored, so don't affect the result.
+locationParamNames = ("outputDirectory", "datasetDirectory", "outputFormat");
+#Parameters which only change how a run is carried out, not its result.
+executionParamNames = ("checkpointInterval", "profile");
+
+
+#Returns the cache key of a run: a hash of its parameters (apart from those
+# in locationParamNames and executionParamNames) and the model version.
+#A run which is warm started depends on the contents of its warm start
+# checkpoint rather than its path, so the checkpoint's hash is used instead. The
+# same goes for rate schedules (see rate_schedules.py).
+def get_cache_key(params):
+    keyParams = {name: value for name, value in params.items() if name not in locationParamNames+executionParamNames};
+    if keyParams.get("warmStartCheckpoint") is not None:
+        keyParams["warmStartCheckpoint"] = output_formats.hash_file(keyParams["warmStartCheckpoint"]);
+    for scheduleName in ("fertilitySchedule", "mortalitySchedule"):
+        if isinstance(keyParams.get(scheduleName), str):
+            keyParams[scheduleName] = output_formats.hash_file(rate_schedules.get_schedule_filepath(keyParams[scheduleName]));
+    canonical = json.dumps({"params": keyParams, "modelVersion": simple_model.modelVersion}, sort_keys=True, separators=(",", ":"), default=to_json_value);
+    return hashlib.sha256(canonical.encode()).hexdigest();
+
+
+#Converts numpy values (e.g. from a sweep's parameter value arrays) to the
+# equivalent Python values, so they give the same key. Large arrays are
+# replaced by their description (see output_formats.describe_array).
+def to_json_value(value):
+    if isinstance(value, np.ndarray) and value.size > output_formats.maxStoredArraySize:
+        return output_formats.describe_array(value);
+    if hasattr(value, "tolist"):
+        return value.tolist();
+    raise TypeError("Parameter value can't be used in a cache key: "+repr(value));
+
+
+#Returns the directory of the cache entry with the given key.
+def get_entry_directory(key):
+    return path.join(filepaths.resultCacheDir, key);
+
+
+#Returns the directory of the cache entry for a run, or None if the run isn't
+# in the cache. The entry is marked as recently used.
+def lookup(params):
+    entryDirectory = get_entry_directory(get_cache_key(params));
+    if path.isdir(entryDirectory) == False:
+        return None;
+    utime(entryDirectory);
+    return entryDirectory;
+
+
+#Returns True if a run's result can be stored in the cache: it was successful,
+# and wasn't cut short by a time or memory budget (which depends on the machine
+# rather than the parameters, see simple_model.StoppingCriteria).
+def is_cacheable(result):
+    return result.status == status_codes.SUCCESSFUL and result.metadata.get("stopReason") not in simple_model.StoppingCriteria.budgetStopReasons;
+
+
+#Adds a successful run to the cache (if it isn't there already). Its output
+# file is hard linked into the cache if it has its own csv or npz file,
+# otherwise its time series are written to a new npz file.
+def store(result):
+    entryDirectory = get_entry_directory(get_cache_key(result.params));
+    if path.isdir(entryDirectory):
+        return;
+    #Build the entry under a temporary name, so it's only visible once complete
+    tempDirectory = output_formats.get_temp_filepath(entryDirectory);
+    makedirs(tempDirectory, exist_ok=True);
+    outputFilepath = result.metadata.get("outputFilepath");
+    if outputFilepath is not None and path.basename(outputFilepath) in (output_formats.csvFilename, output_formats.npzFilename):
+        link_file(outputFilepath, path.join(tempDirectory, path.basename(outputFilepath)));
+        output_formats.write_params_file(output_formats.get_stored_metadata(result.metadata), path.join(tempDirectory, output_formats.metadataFilename));
+    else:
+        output_formats.NpzWriter().write({"outputDirectory": tempDirectory}, result.timeSeries, metadata=result.metadata);
+    output_formats.write_params_file(result.params, path.join(tempDirectory, output_formats.paramsFilename));
+    try:
+        rename(tempDirectory, entryDirectory);
+    except OSError: #another process stored the same run first
+        shutil.rmtree(tempDirectory, ignore_errors=True);
+
+
+#Returns the RunResult of a cached run, with the given params.
+#writeOutput: if True the cached output is copied to params["outputDirectory"]
+#   (using the params' output format).
+#loadTimeSeries: if False the time series are only read if they're needed to
+#   write the output.
+def load_result(entryDirectory, params, writeOutput=True, loadTimeSeries=True, verbose=False):
+    metadata = output_formats.load_metadata(entryDirectory);
+    metadata["cacheHit"] = True;
+    timeSeries = None;
+    if writeOutput:
+        writer = output_formats.get_writer(params);
+        writer.prepare(params);
+        outputFilename = getattr(writer, "outputFilename", None);
+        if outputFilename in listdir(entryDirectory):
+            if path.exists(path.join(entryDirectory, output_formats.metadataFilename)):
+                link_file(path.join(entryDirectory, output_formats.metadataFilename), path.join(params["outputDirectory"], output_formats.metadataFilename));
+            metadata["outputFilepath"] = path.join(params["outputDirectory"], outputFilename);
+            link_file(path.join(entryDirectory, outputFilename), metadata["outputFilepath"]);
+        else: #stored in a different format
+            timeSeries = output_formats.load_time_series(entryDirectory);
+            metadata["outputFilepath"] = writer.write(params, timeSeries, verbose, metadata);
+    if timeSeries is None and loadTimeSeries:
+        timeSeries = output_formats.load_time_series(entryDirectory);
+    return RunResult(status_codes.SUCCESSFUL, params, timeSeries, metadata);
+
+
+#Hard links sourceFilepath to filepath (replacing it if it exists), or copies
+# it if a link isn't possible (e.g. they're on different file systems).
+def link_file(sourceFilepath, filepath):
+    tempFilepath = output_formats.get_temp_filepath(filepath);
+    try:
+        link(sourceFilepath, tempFilepath);
+    except OSError:
+        shutil.copyfile(sourceFilepath, tempFilepath);
+    replace(tempFilepath, filepath);
+
+
+#Removes the least recently used entries until the cache is no bigger than maxBytes.
+def evict(maxBytes=None):
+    if maxBytes is None:
+        maxBytes = maxCacheBytes;
+    if path.isdir(filepaths.resultCacheDir) == False:
+        return;
+    entries = [];
+    for entry in scandir(filepaths.resultCacheDir):
+        if entry.is_dir() and len(entry.name) == 64: #ignore partly stored entries
+            entries.append((entry.stat().st_mtime, sum(file.stat().st_size for file in scandir(entry.path)), entry.path));
+    totalBytes = sum(size for lastUsed, size, entryDirectory in entries);
+    for lastUsed, size, entryDirectory in sorted(entries):
+        if totalBytes <= maxBytes:
+            break;
+        shutil.rmtree(entryDirectory, ignore_errors=True);
+        totalBytes -= size;
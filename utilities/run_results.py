@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Defines the object used to return the results of a simulation run in memory
+# (see returnResult / returnResults in run_tools), so output can be used
+# directly without writing it to disk and reading it back in.
+
+
+#The result of a single simulation run.
+#status: the status code of the run (see status_codes.py).
+#params: the parameters used, including the seed.
+#timeSeries: dictionary of {timeSeriesName: array} (see
+#   output_formats.timeSeriesNames), or None if the run was skipped.
+#metadata: dictionary of additional information about the run, e.g. "runTime"
+#   (wall clock time of the simulation in seconds).
+class RunResult:
+    def __init__(self, status, params, timeSeries=None, metadata=None):
+        self.status = status;
+        self.params = params;
+        self.timeSeries = timeSeries;
+        self.metadata = metadata if metadata is not None else {};
+    
+    @property
+    def outputDirectory(self):
+        return self.params["outputDirectory"];
+    
+    def __repr__(self):
+        return "RunResult(status="+str(self.status)+", outputDirectory="+repr(self.params.get("outputDirectory"))+")";
@@ -13,35 +13,113 @@ Created on Tue Jun  7 10:15:40 2022
 #These functions start with a simple single model run, and build up to more complex way of running models (e.g. sets of repeat rungs and parameter sweeps).
 #There can additionally be support for running on multiple cores, etc.
 
-from os import path, urandom, makedirs;
-import sys;
-from concurrent.futures import ProcessPoolExecutor, wait;
+from os import path, makedirs;
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait;
+from concurrent.futures.process import BrokenProcessPool;
+import multiprocessing;
+import atexit;
 import numpy as np;
 import json;
 
 from model import simple_model;
-from utilities import status_codes;
+from utilities import status_codes, output_formats, sweep_manifest, result_cache, checkpoints, profiling, work_queue, sweep_designs, data_extractors, analysis_tools, shared_inputs;
+from utilities.run_results import RunResult;
 
 
 
+#Seeding: each run's random number generator is a node in a numpy SeedSequence
+# tree (see simple_model.make_rng). The root of the tree is identified by
+# params["seed"], a 128 bit random integer shared by every run in a set of
+# repeats or a sweep. params["seedSpawnKey"] identifies the run within the tree,
+# i.e. [repeat number] for run_reps and [parameter set index, repeat number]
+# for run_param_sets / run_sweep. Passing the same 'seed' to these functions
+# reproduces every run exactly.
+
+
+#Returns a new random root seed (128 bits of OS entropy).
+def generate_seed():
+    return np.random.SeedSequence().entropy;
+
+
+#Returns the root seed for a set of runs whose parameters share baseParams.
+# If seed is None the seed recorded in their sweep manifest is used, so a
+# resumed sweep uses the same seed as the runs already done, or a new random
+# seed if there isn't one. The seed is recorded in the manifest (if output is
+# written, see get_sweep_manifest).
+def get_root_seed(baseParams, seed, writeOutput):
+    manifestFilepath = get_sweep_manifest(baseParams, writeOutput);
+    if seed is None and manifestFilepath is not None:
+        seed = sweep_manifest.get_root_seed(manifestFilepath);
+    if seed is None:
+        seed = generate_seed();
+    if manifestFilepath is not None:
+        sweep_manifest.set_root_seed(manifestFilepath, seed);
+    return seed;
+
+
+#Sets the seed of a run to a node in the SeedSequence tree with the given root seed.
+def set_seed(params, seed, seedSpawnKey):
+    params["seed"] = seed;
+    params["seedSpawnKey"] = list(seedSpawnKey);
+
+
+#When the "sweep" output format is used, every run is stored in one dataset in
+# params["datasetDirectory"] (see output_formats). If it isn't already set, the
+# outermost function called (run_single, run_reps or run_param_sets) uses its
+# own outputDirectory, and consolidates the dataset once all its runs are done.
+#Returns True if the caller should consolidate the dataset when it finishes.
+def claim_dataset_directory(params):
+    if params.get("outputFormat", "csv") == "sweep" and "datasetDirectory" not in params:
+        params["datasetDirectory"] = params["outputDirectory"];
+        return True;
+    return False;
+
+
 #Runs a single simulation
 #params: Dictionary containing the parameter set
 #skipIfExists: Should the parameter overwrite existing data? Default behaviour is not to do this and instead print a message to the console.
-def run_single(params, skipIfExists=True, overwriteSeed=None, verbose=False):
-    if path.exists(params["outputDirectory"]) and skipIfExists == True:
+#overwriteSeed: root seed to use. If None a new random seed is used. Any
+#   'seedSpawnKey' already in params is kept, so a run can be reproduced using the
+#   'seed' from its params_used.json file.
+#writeOutput: True: output is written to disk (see output_formats).
+#             False: nothing is written to disk (and skipIfExists is ignored).
+#                    Useful with returnResult when output is used directly.
+#             "async": used by run_reps / run_param_sets. Output isn't written
+#                    by this function, but by the caller in a background thread.
+#returnResult: If True a RunResult (see run_results.py) containing the status,
+#   parameters, time series and metadata of the run is returned instead of
+#   just the status code.
+#manifestFilepath: sweep manifest to record the run's progress in (see
+#   sweep_manifest.py). Set by run_reps / run_param_sets.
+#useResultCache: if True the run is copied from the result cache (see
+#   result_cache.py) if the same parameters and seed have been run before, and
+#   added to the cache otherwise.
+#evictResultCache: if True the cache is trimmed to its maximum size after the
+#   run. run_tasks sets this to False and trims the cache once at the end.
+def run_single(params, skipIfExists=True, overwriteSeed=None, verbose=False, writeOutput=True, returnResult=False, manifestFilepath=None, useResultCache=False, evictResultCache=True):
+    ownsDataset = writeOutput == True and claim_dataset_directory(params);
+    if writeOutput != False and skipIfExists == True and output_formats.get_writer(params).exists(params):
         print("Skipping simulation with outputDirectory", params["outputDirectory"], "because it already exists...");
-        return status_codes.SKIPPED;
+        if manifestFilepath is not None:
+            sweep_manifest.set_done(manifestFilepath, params["outputDirectory"], output_formats.get_output_filepath(params["outputDirectory"]));
+        return RunResult(status_codes.SKIPPED, params) if returnResult else status_codes.SKIPPED;
     
     if overwriteSeed is None:
         #Set the seed to a value we know
-        params["seed"] = int.from_bytes(urandom(4), sys.byteorder);
+        params["seed"] = generate_seed();
     else:
         params["seed"] = overwriteSeed;
+    params.setdefault("seedSpawnKey", []);
     
     #run the model
     #This could involve calling a Python function or running something from the commandline.
     #In this case, the model is implemented with Python so we can just run it directly.
-    status = simple_model.run_model(params, verbose);
+    result = run_with_manifest(manifestFilepath, [params], writeOutput, lambda: run_with_result_cache([params], writeOutput, returnResult, useResultCache,
+                                                                                                 lambda paramsList: [simple_model.run_model(params, verbose, writeOutput=writeOutput == True, returnResult=True, checkpoint=writeOutput != False)]))[0];
+    if useResultCache and evictResultCache:
+        result_cache.evict();
+    if ownsDataset:
+        output_formats.consolidate_dataset(params["datasetDirectory"]);
     
     ####Additional steps can be added here, e.g. if you have a set of statistics or plots you always want to produce for every simulation:
     #if calcBasicStats:
@@ -49,7 +127,402 @@ def run_single(params, skipIfExists=True, overwriteSeed=None, verbose=False):
     #if makeBasicPlots:
     #    plot_tools.make_diagnostic_individual_run_plots(params["outputDirectory"]), saveDirectory=path.join(params["outputDirectory"], "plots"), closeFigs=True);
     
-    return status;
+    return result if returnResult else result.status;
+
+
+
+#Runs a set of repeat simulations together in the current process using the
+# batch engine. Each parameter set in paramsList must be identical apart from
+# its outputDirectory, seed and seedSpawnKey (which must already be set). Output
+# is the same as calling run_single for each parameter set, but much cheaper
+# for small populations.
+#writeOutput, returnResults, manifestFilepath, useResultCache, evictResultCache: as for run_single.
+#Returns a list of statuses (or RunResults), one per parameter set.
+def run_batch(paramsList, skipIfExists=True, verbose=False, writeOutput=True, returnResults=False, manifestFilepath=None, useResultCache=False, evictResultCache=True):
+    results = [RunResult(status_codes.SKIPPED, params) for params in paramsList];
+    toRun = [];
+    for i, params in enumerate(paramsList):
+        if writeOutput != False and skipIfExists == True and output_formats.get_writer(params).exists(params):
+            print("Skipping simulation with outputDirectory", params["outputDirectory"], "because it already exists...");
+            if manifestFilepath is not None:
+                sweep_manifest.set_done(manifestFilepath, params["outputDirectory"], output_formats.get_output_filepath(params["outputDirectory"]));
+        else:
+            toRun.append(i);
+    
+    if len(toRun) > 0:
+        toRunParamsList = [paramsList[i] for i in toRun];
+        runResults = run_with_manifest(manifestFilepath, toRunParamsList, writeOutput, lambda: run_with_result_cache(toRunParamsList, writeOutput, returnResults, useResultCache,
+                                                                                                                 lambda uncachedParamsList: simple_model.run_model_batch(uncachedParamsList, verbose, writeOutput=writeOutput == True, returnResults=True, checkpoint=writeOutput != False)));
+        for i, result in zip(toRun, runResults):
+            results[i] = result;
+        if useResultCache and evictResultCache:
+            result_cache.evict();
+    return results if returnResults else [result.status for result in results];
+
+
+#Calls runFunction, which runs the simulations in paramsList and returns their
+# RunResults, recording their progress in the sweep manifest (if
+# manifestFilepath isn't None): running, then done once their output has been
+# written (unless writeOutput is "async", in which case OutputWriterThread
+# records them as done), or error if an exception is raised.
+def run_with_manifest(manifestFilepath, paramsList, writeOutput, runFunction):
+    if manifestFilepath is None:
+        return runFunction();
+    outputDirectories = [params["outputDirectory"] for params in paramsList];
+    sweep_manifest.set_states(manifestFilepath, outputDirectories, sweep_manifest.RUNNING);
+    try:
+        results = runFunction();
+    except BaseException:
+        sweep_manifest.set_states(manifestFilepath, outputDirectories, sweep_manifest.ERROR);
+        raise;
+    if writeOutput == True:
+        for result in results:
+            sweep_manifest.set_done(manifestFilepath, result.outputDirectory, result.metadata["outputFilepath"]);
+    return results;
+
+
+#Runs the simulations in paramsList using runFunction(paramsList), which returns
+# their RunResults, except for any found in the result cache (if useResultCache
+# is True), which are copied from it instead. Successful runs are added to the
+# cache, unless they were stopped by a time or memory budget.
+#returnResults: if False, the time series of cached runs are only read if needed.
+def run_with_result_cache(paramsList, writeOutput, returnResults, useResultCache, runFunction):
+    if useResultCache == False:
+        return runFunction(paramsList);
+    results = [None]*len(paramsList);
+    toRun = [];
+    for i, params in enumerate(paramsList):
+        entryDirectory = result_cache.lookup(params);
+        if entryDirectory is None:
+            toRun.append(i);
+        else:
+            results[i] = result_cache.load_result(entryDirectory, params, writeOutput=writeOutput == True, loadTimeSeries=returnResults or writeOutput != True);
+    if len(toRun) > 0:
+        for i, result in zip(toRun, runFunction([paramsList[i] for i in toRun])):
+            results[i] = result;
+            if result_cache.is_cacheable(result):
+                result_cache.store(result);
+    return results;
+
+
+
+#Runs a list of tasks, each a tuple of (name, function, args, kwargs) where the
+# function is run_single or run_batch. Returns the list of results in the same
+# order as the tasks (batches' lists of results are flattened into it).
+#numCores: If None tasks are run one at a time in the current process,
+#   otherwise the number of processes to use. Tasks are then scheduled with
+#   schedule_tasks: the most expensive are started first, and cheap tasks are
+#   grouped into chunks to reduce the overhead of sending them to workers.
+#runner: the Runner (pool of worker processes) to use. If None and numCores is
+#   set, the shared Runner with numCores workers is used (see get_runner).
+#verbose: print the name of each task as it is queued and completed.
+#writeOutput, returnResults: as for run_reps. When writeOutput is "async"
+#   finished runs are sent back to this process and written to disk in a
+#   background thread (see OutputWriterThread), while the workers carry on.
+#manifestFilepath: if not None, the sweep manifest (see sweep_manifest.py) is
+#   used to skip runs which have already been done and to record the progress
+#   of the rest (see apply_manifest).
+#useResultCache: see run_single. The cache is trimmed once all tasks are done.
+#workQueue: if not None, the path of a work queue (see work_queue.py). Tasks
+#   are added to the queue, and run by worker processes started separately
+#   (possibly on other machines) instead of numCores / runner. Output must be
+#   written (writeOutput=True), and any results returned are read back from it.
+def run_tasks(tasks, numCores=None, verbose=False, writeOutput=True, returnResults=False, runner=None, manifestFilepath=None, useResultCache=False, workQueue=None):
+    if workQueue is not None and writeOutput != True:
+        raise ValueError("Runs in a work queue must write their output (writeOutput=True)");
+    if writeOutput == False:
+        manifestFilepath = None;
+    writerThread = OutputWriterThread(manifestFilepath) if writeOutput == "async" else None;
+    wantResults = returnResults or writerThread is not None;
+    for name, function, args, kwargs in tasks:
+        kwargs["writeOutput"] = writeOutput;
+        kwargs["returnResult" if function is run_single else "returnResults"] = wantResults and workQueue is None;
+        kwargs["useResultCache"] = useResultCache;
+        kwargs["evictResultCache"] = False;
+    runMasks = apply_manifest(tasks, manifestFilepath, verbose) if manifestFilepath is not None else [None]*len(tasks);
+    pendingTasks = [i for i, runMask in enumerate(runMasks) if runMask is None or any(runMask)];
+    
+    def handle_results(taskResults):
+        if writerThread is not None:
+            for result in taskResults:
+                for runResult in (result if isinstance(result, list) else [result]):
+                    writerThread.write(runResult);
+    
+    results = [None]*len(tasks);
+    if workQueue is not None:
+        taskIds = work_queue.submit_tasks(workQueue, [tasks[i] for i in pendingTasks]);
+        if verbose:
+            print(len(taskIds), "tasks added to the work queue", workQueue);
+        for i, result in zip(pendingTasks, work_queue.wait_for_tasks(workQueue, taskIds, verbose=verbose)):
+            results[i] = result if returnResults == False else load_results(tasks[i], result);
+    elif numCores is None and runner is None:
+        for i in pendingTasks:
+            name, function, args, kwargs = tasks[i];
+            if verbose:
+                print("running", name);
+            results[i] = function(*args, **kwargs);
+            handle_results([results[i]]);
+    elif len(pendingTasks) > 0:
+        if runner is None:
+            runner = get_runner(numCores);
+        chunks = [[pendingTasks[j] for j in chunk] for chunk in schedule_tasks([tasks[i] for i in pendingTasks], runner.numCores)];
+        executor = runner.get_executor();
+        #Large arrays in the tasks' parameters are sent to the workers once,
+        # rather than with every task (see shared_inputs.py)
+        broadcast = shared_inputs.Broadcast();
+        try:
+            sharedTasks = broadcast.share_tasks(tasks);
+            processHandles = [];
+            for chunk in chunks:
+                handle = executor.submit(run_task_chunk, [sharedTasks[i][1:] for i in chunk]);
+                if verbose:
+                    name = tasks[chunk[0]][0] if len(chunk) == 1 else str(tasks[chunk[0]][0])+" and "+str(len(chunk)-1)+" more";
+                    print("queuing", name);
+                    handle.add_done_callback(lambda future,name=name : print("Completed running: "+str(name))); #Note: using an additional argument and providing a default value allows the lambda to capture by value instead of reference.
+                if writerThread is not None:
+                    handle.add_done_callback(lambda future : handle_results(broadcast.restore_results(future.result())));
+                processHandles.append(handle);
+            wait(processHandles);
+            
+            #Put results back into the original task order
+            for chunk, processHandle in zip(chunks, processHandles):
+                for i, result in zip(chunk, broadcast.restore_results(processHandle.result())):
+                    results[i] = result;
+        except BrokenProcessPool:
+            runner.shutdown(); #A worker died, so the pool can't be reused
+            raise;
+        finally:
+            broadcast.close();
+        if verbose:
+            print(runner.numWorkersStarted, "worker processes started by this runner so far");
+    
+    if writerThread is not None:
+        writerThread.close();
+    if useResultCache:
+        result_cache.evict();
+    
+    #Get simulation results (batches return a list of results). Runs skipped
+    # because the manifest records them as done are given the SKIPPED status.
+    outputResults = [];
+    for (name, function, args, kwargs), result, runMask in zip(tasks, results, runMasks):
+        if runMask is None:
+            outputResults += result if isinstance(result, list) else [result];
+            continue;
+        ranResults = iter(result if isinstance(result, list) else [result]);
+        for params, ran in zip(runMask.paramsList, runMask):
+            if ran:
+                outputResults.append(next(ranResults));
+            else:
+                outputResults.append(RunResult(status_codes.SKIPPED, params) if wantResults else status_codes.SKIPPED);
+    if writerThread is not None and returnResults == False:
+        outputResults = [result.status for result in outputResults];
+    return outputResults;
+
+
+#Returns the RunResults of a task run elsewhere (e.g. by a work queue worker),
+# given the statuses it returned, by reading its runs' output from disk.
+def load_results(task, statuses):
+    name, function, args, kwargs = task;
+    paramsList = args[0] if function is run_batch else [args[0]];
+    results = [];
+    for params, status in zip(paramsList, statuses if function is run_batch else [statuses]):
+        if status == status_codes.SUCCESSFUL:
+            results.append(RunResult(status, params, output_formats.load_time_series(params["outputDirectory"]), output_formats.load_metadata(params["outputDirectory"])));
+        else:
+            results.append(RunResult(status, params));
+    return results if function is run_batch else results[0];
+
+
+#Uses the sweep manifest to decide which runs in each task need to be run.
+#Runs recorded as done are removed from their task (without checking for their
+# output on disk). Runs recorded in any other state were interrupted or failed,
+# so are re-run even if a partial output directory exists. Runs which aren't
+# in the manifest yet are checked for existing output as usual. The runs left
+# to do are recorded as queued.
+#Returns a RunMask (a list of booleans, True for each run to do) for each task.
+def apply_manifest(tasks, manifestFilepath, verbose=False):
+    paramsLists = [args[0] if function is run_batch else [args[0]] for name, function, args, kwargs in tasks];
+    states = sweep_manifest.get_states(manifestFilepath, [params["outputDirectory"] for paramsList in paramsLists for params in paramsList]);
+    runMasks = [];
+    toQueue = [];
+    for (name, function, args, kwargs), paramsList in zip(tasks, paramsLists):
+        runMask = RunMask([states.get(params["outputDirectory"]) != sweep_manifest.DONE for params in paramsList]);
+        runMask.paramsList = paramsList;
+        runMasks.append(runMask);
+        toRun = [params for params, ran in zip(paramsList, runMask) if ran];
+        if function is run_batch and len(toRun) > 0:
+            args = (toRun,)+tuple(args[1:]);
+        if len(toRun) > 0 and all(params["outputDirectory"] in states for params in toRun):
+            kwargs["skipIfExists"] = False;
+        kwargs["manifestFilepath"] = manifestFilepath;
+        tasks[len(runMasks)-1] = (name, function, args, kwargs);
+        toQueue += [params["outputDirectory"] for params in toRun];
+    
+    numDone = sum(len(runMask)-sum(runMask) for runMask in runMasks);
+    if verbose and numDone > 0:
+        print("Skipping", numDone, "runs which the sweep manifest records as done");
+    if len(toQueue) > 0:
+        sweep_manifest.set_states(manifestFilepath, toQueue, sweep_manifest.QUEUED);
+    return runMasks;
+
+
+#List of booleans (one per run in a task) with the task's parameter sets attached.
+class RunMask(list):
+    pass;
+
+
+#A pool of worker processes which is started when first needed and kept
+# running between calls, so consecutive calls to run_reps / run_param_sets /
+# run_sweep don't each pay the cost of starting processes and importing modules.
+#Can be used as a context manager, which shuts the workers down on exit:
+# with run_tools.Runner(4, startMethod="forkserver") as runner:
+#     run_tools.run_reps(params, 16, runner=runner);
+#     run_tools.run_sweep(sweepParams, ["fertilityRate"], rates, runner=runner);
+#numCores: number of worker processes.
+#startMethod: multiprocessing start method, or None for the platform default.
+#   "forkserver" starts workers from a server process which has already
+#   imported preloadModules, so each new worker starts quickly without
+#   inheriting the state of the main process. Note: scripts using "forkserver"
+#   (or "spawn") must guard their top level code with if __name__ == "__main__".
+#preloadModules: modules imported by the fork server (only used with "forkserver").
+class Runner:
+    def __init__(self, numCores, startMethod=None, preloadModules=("numpy", "pandas", "model.simple_model", "utilities.run_tools")):
+        self.numCores = numCores;
+        self.context = multiprocessing.get_context(startMethod);
+        if startMethod == "forkserver":
+            self.context.set_forkserver_preload(list(preloadModules));
+        self.workerStarts = self.context.Value("i", 0);
+        self.executor = None;
+    
+    #Returns the pool of workers, starting it if it isn't already running.
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.numCores, mp_context=self.context, initializer=count_worker_start, initargs=(self.workerStarts,));
+        return self.executor;
+    
+    #Number of worker processes started since the Runner was created.
+    @property
+    def numWorkersStarted(self):
+        return self.workerStarts.value;
+    
+    #Stops the worker processes. They will be started again if the Runner is reused.
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True);
+            self.executor = None;
+    
+    def __enter__(self):
+        return self;
+    
+    def __exit__(self, excType, excValue, traceback):
+        self.shutdown();
+
+
+#Called in each worker process as it starts.
+def count_worker_start(workerStarts):
+    with workerStarts.get_lock():
+        workerStarts.value += 1;
+
+
+#The shared Runner used when only numCores is given (see get_runner).
+_sharedRunner = None;
+
+
+#Returns the shared Runner with numCores workers, which is reused by every call
+# to the run_tools functions with the same numCores. If numCores has changed
+# the previous shared Runner is shut down and a new one created.
+def get_runner(numCores):
+    global _sharedRunner;
+    if _sharedRunner is None or _sharedRunner.numCores != numCores:
+        if _sharedRunner is None:
+            atexit.register(shutdown_shared_runner);
+        shutdown_shared_runner();
+        _sharedRunner = Runner(numCores);
+    return _sharedRunner;
+
+
+#Shuts down the shared Runner's worker processes.
+def shutdown_shared_runner():
+    if _sharedRunner is not None:
+        _sharedRunner.shutdown();
+
+
+#Runs a chunk of tasks, each a tuple of (function, args, kwargs), in the
+# current process and returns their results. Broadcast arrays in the tasks'
+# arguments are attached (see shared_inputs.py) for the duration of the chunk.
+def run_task_chunk(chunk):
+    attached = {};
+    results = [];
+    for function, args, kwargs in chunk:
+        args, detach_results = shared_inputs.attach_task_args(args, attached);
+        results.append(detach_results(function(*args, **kwargs)));
+    return results;
+
+
+#Returns the estimated relative cost of a task (see simple_model.estimate_run_cost).
+def estimate_task_cost(task):
+    name, function, args, kwargs = task;
+    paramsList = args[0] if function is run_batch else [args[0]];
+    return sum(simple_model.estimate_run_cost(params) for params in paramsList);
+
+
+#Splits tasks into chunks to submit to numCores workers. Returns a list of
+# chunks (lists of task indices) in the order they should be submitted.
+#Tasks are sorted by estimated cost, most expensive first, so long runs don't
+# end up at the end of the sweep holding everything up while other cores sit idle.
+#Tasks costing more than targetCost (the total cost divided into chunksPerCore
+# chunks per core) get a chunk of their own, while cheaper tasks are grouped
+# into chunks costing up to targetCost.
+def schedule_tasks(tasks, numCores, chunksPerCore=4):
+    costs = np.array([estimate_task_cost(task) for task in tasks]);
+    targetCost = np.sum(costs)/(numCores*chunksPerCore);
+    chunks = [];
+    chunk = [];
+    chunkCost = 0;
+    for i in np.argsort(-costs, kind="stable"):
+        if costs[i] >= targetCost:
+            chunks.append([int(i)]);
+            continue;
+        chunk.append(int(i));
+        chunkCost += costs[i];
+        if chunkCost >= targetCost:
+            chunks.append(chunk);
+            chunk = [];
+            chunkCost = 0;
+    if len(chunk) > 0:
+        chunks.append(chunk);
+    return chunks;
+
+
+#Writes RunResults to disk in a background thread, in the order they are given.
+#Used for writeOutput="async", so writing output doesn't hold up the workers.
+#manifestFilepath: if not None, each run is recorded as done in the sweep
+#   manifest once its output has been written.
+class OutputWriterThread:
+    def __init__(self, manifestFilepath=None):
+        self.executor = ThreadPoolExecutor(max_workers=1);
+        self.futures = [];
+        self.manifestFilepath = manifestFilepath;
+    
+    #Queues a result to be written (skipped runs have nothing to write).
+    def write(self, result):
+        if result.status == status_codes.SUCCESSFUL:
+            self.futures.append(self.executor.submit(self.write_now, result));
+    
+    #Writes a result in the background thread.
+    def write_now(self, result):
+        outputFilepath = output_formats.write_run(result.params, result.timeSeries, metadata=result.metadata);
+        checkpoints.remove_checkpoint(result.params);
+        if "profile" in result.metadata:
+            profiling.write_profile(result.params, result.metadata["profile"]);
+        if self.manifestFilepath is not None:
+            sweep_manifest.set_done(self.manifestFilepath, result.outputDirectory, outputFilepath);
+    
+    #Waits for all queued results to be written. Raises any error encountered while writing.
+    def close(self):
+        self.executor.shutdown(wait=True);
+        for future in self.futures:
+            future.result();
 
 
 
@@ -63,26 +536,78 @@ def run_single(params, skipIfExists=True, overwriteSeed=None, verbose=False):
 #innerVerbose: should each individual simulation be verbose? This only works for single core.
 #numCores: If None only a single process is used, otherwise the number of cores specified
 #           will be used and separate processes created for each repeat simulation.
-def run_reps(baseParams, numReps, verbose=True, innerVerbose=False, numCores=None):
-    with ProcessPoolExecutor(max_workers=numCores) as executor:
-        processHandles = [];
-        for rep in range(0, numReps):
-            params = baseParams.copy();
-            params["outputDirectory"] = path.join(baseParams["outputDirectory"], "rep="+str(rep));
-            if numCores is None:
-                print("running", params["outputDirectory"]);
-                run_single(params, verbose=innerVerbose);
-            else:
-                print("queuing", params["outputDirectory"]);
-                handle = executor.submit(run_single, params, verbose=False);
-                handle.add_done_callback(lambda future,name=params["outputDirectory"] : print("Completed running: "+str(name))); #Note: using an additional argument and providing a default value allows the lambda to capture by value instead of reference.
-                processHandles.append(handle);
-        wait(processHandles);
-        
-        #Return an array of model return statuses.
-        statusList = np.array([processHandle.result() for processHandle in processHandles]);
-        return statusList;
-        
+#batched: If True repeats are run together using the batch engine (see run_batch),
+#         as a single batch, or split into one batch per core.
+#seed: root seed shared by the repeats. If None the seed recorded in the sweep
+#         manifest is used when resuming, otherwise a new random seed (see get_root_seed).
+#seedSpawnKey: position of this set of repeats in a larger seed tree (used by
+#         run_param_sets). Each repeat appends its repeat number to this.
+#writeOutput: True (write output as each run finishes), False (don't write
+#         anything to disk) or "async" (write output in a background thread of
+#         this process, see run_tasks).
+#returnResults: If True a list of RunResults (see run_results.py) is returned,
+#         containing each run's time series, instead of an array of statuses.
+#runner: Runner (pool of worker processes) to use instead of numCores. By
+#         default the shared Runner for numCores is used, so worker processes
+#         are reused by consecutive calls (see Runner and get_runner).
+#useResultCache: If True runs which have been run before (with the same
+#         parameters and seed, under any outputDirectory) are copied from the
+#         result cache instead of being simulated again (see result_cache.py).
+#workQueue: path of a work queue (see work_queue.py). If not None the runs are
+#         added to the queue and run by separately started worker processes,
+#         which may be on other machines, instead of numCores / runner.
+#Progress is recorded in a sweep manifest in baseParams["outputDirectory"] (see
+# sweep_manifest.py), so an interrupted call can be resumed by repeating it:
+# finished runs are skipped and partially written runs are re-run.
+def run_reps(baseParams, numReps, verbose=True, innerVerbose=False, numCores=None, batched=False, seed=None, seedSpawnKey=(), writeOutput=True, returnResults=False, runner=None, useResultCache=False, workQueue=None):
+    seed = get_root_seed(baseParams, seed, writeOutput);
+    if runner is not None:
+        numCores = runner.numCores;
+    baseParams = baseParams.copy();
+    ownsDataset = writeOutput != False and claim_dataset_directory(baseParams);
+    
+    repParamsList = [];
+    for rep in range(0, numReps):
+        params = baseParams.copy();
+        params["outputDirectory"] = path.join(baseParams["outputDirectory"], "rep="+str(rep));
+        set_seed(params, seed, list(seedSpawnKey)+[rep]);
+        repParamsList.append(params);
+    
+    tasks = [];
+    if batched:
+        for repIndices in np.array_split(np.arange(0, numReps), 1 if numCores is None else min(numCores, numReps)):
+            batchName = baseParams["outputDirectory"]+" rep="+str(repIndices[0])+"-"+str(repIndices[-1]);
+            tasks.append((batchName, run_batch, ([repParamsList[rep] for rep in repIndices],), {"verbose": innerVerbose if numCores is None else False}));
+    else:
+        for params in repParamsList:
+            tasks.append((params["outputDirectory"], run_single, (params,), {"overwriteSeed": seed, "verbose": innerVerbose if numCores is None else False}));
+    results = run_tasks(tasks, numCores=numCores, verbose=verbose, writeOutput=writeOutput, returnResults=returnResults, runner=runner, manifestFilepath=get_sweep_manifest(baseParams, writeOutput), useResultCache=useResultCache, workQueue=workQueue);
+    
+    if ownsDataset:
+        output_formats.consolidate_dataset(baseParams["datasetDirectory"]);
+    write_sweep_profile(baseParams, writeOutput);
+    #Return an array of model return statuses (or the list of results).
+    return results if returnResults else np.array(results);
+
+
+
+#Summarises the profiles of a set of runs whose parameters share baseParams in
+# sweep_profile.json in baseParams' output directory, if they're profiled (see
+# profiling.py) and their output was written.
+def write_sweep_profile(baseParams, writeOutput):
+    if baseParams.get("profile") is not None and writeOutput != False:
+        profiling.write_sweep_profile(baseParams["outputDirectory"]);
+
+
+#Returns the path of the sweep manifest for a set of runs whose parameters
+# share baseParams (None if no output is written). The manifest is kept in
+# baseParams' output directory, which is created if necessary.
+def get_sweep_manifest(baseParams, writeOutput):
+    if writeOutput == False:
+        return None;
+    makedirs(baseParams["outputDirectory"], exist_ok=True);
+    return sweep_manifest.get_manifest_filepath(baseParams["outputDirectory"]);
+
 
 
 #Run simulations for a parameter sweep over N dimensions.
@@ -93,7 +618,11 @@ def run_reps(baseParams, numReps, verbose=True, innerVerbose=False, numCores=Non
 #numReps: number of repeat simulations to run for each unique combination of parameter values
 #numCores: number of CPU cores to use. Default is None meaning no new processes are created.
 #verbose: prints feedback on queued and completed simulation runs.
-def run_sweep(baseParams, paramNames, paramValueLists, numReps=1, numCores=None, verbose=True):
+#batched: run the repeats of each parameter set together using the batch engine.
+#seed: root seed shared by every run in the sweep. If None the seed of the runs
+#         already done is used when resuming, otherwise a new random seed.
+#writeOutput, returnResults, runner, useResultCache, workQueue: see run_reps.
+def run_sweep(baseParams, paramNames, paramValueLists, numReps=1, numCores=None, verbose=True, batched=False, seed=None, writeOutput=True, returnResults=False, runner=None, useResultCache=False, workQueue=None):
     if not (isinstance(paramNames, list) or isinstance(paramNames, np.ndarray)):
         paramNames = [paramNames];
     if not (isinstance(paramValueLists[0], list) or isinstance(paramValueLists[0], np.ndarray)):
@@ -127,7 +656,88 @@ def run_sweep(baseParams, paramNames, paramValueLists, numReps=1, numCores=None,
         json.dump(sweepInfo, file, indent=2);
     
     #Pass these parameter sets onto the run_param_sets function actually run them
-    return run_param_sets(baseParams, paramSetNames, paramSetOverrides, numCores=numCores, numReps=numReps, verbose=verbose);
+    return run_param_sets(baseParams, paramSetNames, paramSetOverrides, numCores=numCores, numReps=numReps, verbose=verbose, batched=batched, seed=seed, writeOutput=writeOutput, returnResults=returnResults, runner=runner, useResultCache=useResultCache, workQueue=workQueue);
+
+
+
+#Run simulations for a sampled parameter sweep: a fixed number of points spread
+# through a range of values for each parameter, instead of every combination of
+# a list of values (see sweep_designs.py). Each point is stored in a directory
+# named "point=<index>" and the design in sweep_design.json (use
+# analysis_tools.extract_from_design to read the output).
+#paramRanges: dictionary of {paramName: (low, high)}. If both low and high are
+#   integers the parameter only takes integer values.
+#numPoints: number of points (parameter sets) to run.
+#method: "sobol" (a Sobol sequence, most even when numPoints is a power of 2)
+#   or "lhs" (a random Latin hypercube sample, using the seed).
+#Other arguments are as for run_sweep.
+def run_sampled_sweep(baseParams, paramRanges, numPoints, method="sobol", numReps=1, numCores=None, verbose=True, batched=False, seed=None, writeOutput=True, returnResults=False, runner=None, useResultCache=False, workQueue=None):
+    if seed is None: #resuming uses the existing design's seed, see run_design
+        existingDesign = sweep_designs.load_design(baseParams["outputDirectory"]);
+        seed = existingDesign["seed"] if existingDesign is not None else generate_seed();
+    paramNames = list(paramRanges.keys());
+    if method == "sobol":
+        unitPoints = sweep_designs.sobol_sequence(numPoints, len(paramNames));
+    elif method == "lhs":
+        unitPoints = sweep_designs.latin_hypercube(numPoints, len(paramNames), np.random.default_rng(seed));
+    else:
+        raise ValueError("Unrecognised sampling method: "+str(method));
+    points = sweep_designs.scale_points(unitPoints, list(paramRanges.values()));
+    return run_design(baseParams, paramNames, points, numReps=numReps, numCores=numCores, verbose=verbose, batched=batched, seed=seed, writeOutput=writeOutput, returnResults=returnResults, runner=runner, useResultCache=useResultCache, workQueue=workQueue,
+                      unitPoints=unitPoints, paramRanges=list(paramRanges.values()));
+
+
+#Run simulations for each point in a design (see sweep_designs.py).
+#paramNames: the parameters varied.
+#points: list of the parameter values (in paramNames order) of each point.
+#unitPoints, paramRanges: the points' positions in the unit cube and the range
+#   of each parameter they were scaled to, if known (used by refine_sweep).
+#If a design is already stored in the output directory, points must start with
+# the points already in it, and its seed is used (if seed is None), so the
+# existing points are skipped and only new points are run.
+#Other arguments are as for run_sweep.
+def run_design(baseParams, paramNames, points, numReps=1, numCores=None, verbose=True, batched=False, seed=None, writeOutput=True, returnResults=False, runner=None, useResultCache=False, workQueue=None, unitPoints=None, paramRanges=None):
+    makedirs(baseParams["outputDirectory"], exist_ok=True);
+    points = [list(point) for point in points];
+    existingDesign = sweep_designs.load_design(baseParams["outputDirectory"]);
+    if existingDesign is not None:
+        if existingDesign["paramNames"] != list(paramNames) or existingDesign["points"] != points[0:len(existingDesign["points"])]:
+            raise ValueError("The design in "+baseParams["outputDirectory"]+" can only be extended with new points");
+        if seed is not None and seed != existingDesign["seed"]:
+            raise ValueError("The design in "+baseParams["outputDirectory"]+" was run with a different seed");
+        seed = existingDesign["seed"];
+    if seed is None:
+        seed = generate_seed();
+    sweep_designs.write_design(baseParams["outputDirectory"], {"paramNames": list(paramNames), "points": points, "unitPoints": unitPoints, "paramRanges": paramRanges, "seed": seed,
+                                                               "numReps": numReps.maxReps if isinstance(numReps, AdaptiveReps) else numReps});
+    
+    paramSetNames = [sweep_designs.get_point_name(i) for i in range(len(points))];
+    paramSetOverrides = [dict(zip(paramNames, point)) for point in points];
+    return run_param_sets(baseParams, paramSetNames, paramSetOverrides, numCores=numCores, numReps=numReps, verbose=verbose, batched=batched, seed=seed, writeOutput=writeOutput, returnResults=returnResults, runner=runner, useResultCache=useResultCache, workQueue=workQueue);
+
+
+#Adds numNewPoints points to the design in baseParams["outputDirectory"] (see
+# run_design) and runs them. The points are placed where the output extracted
+# by extractorFunc (which must return a number) changes fastest between
+# neighbouring points, and/or varies most between repeats (see
+# sweep_designs.choose_refinement_points).
+#criterion: "gradient", "variance" or "both".
+#Other arguments are as for run_sweep. The number of repeats and seed are those
+# of the existing design.
+def refine_sweep(baseParams, numNewPoints, extractorFunc=data_extractors.get_population_growth_rate, criterion="both", numCores=None, verbose=True, batched=False, writeOutput=True, returnResults=False, runner=None, useResultCache=False, workQueue=None, numWorkers=None):
+    design = sweep_designs.load_design(baseParams["outputDirectory"]);
+    if design is None:
+        raise FileNotFoundError("No design found in "+baseParams["outputDirectory"]);
+    paramNames, points, values = analysis_tools.extract_from_design(baseParams["outputDirectory"], extractorFunc, numWorkers=numWorkers);
+    paramRanges = design["paramRanges"];
+    if paramRanges is None: #use the range of the existing points
+        paramRanges = [(np.min(points[:, dim]), np.max(points[:, dim])) for dim in range(len(paramNames))];
+    unitPoints = np.array(design["unitPoints"]) if design["unitPoints"] is not None else sweep_designs.unscale_points(design["points"], paramRanges);
+    
+    rng = np.random.default_rng([design["seed"], len(design["points"])]);
+    newUnitPoints = sweep_designs.choose_refinement_points(unitPoints, [values[i] for i in range(len(design["points"]))], numNewPoints, rng, criterion=criterion);
+    return run_design(baseParams, paramNames, design["points"]+sweep_designs.scale_points(newUnitPoints, paramRanges), numReps=design["numReps"], numCores=numCores, verbose=verbose, batched=batched, writeOutput=writeOutput, returnResults=returnResults, runner=runner, useResultCache=useResultCache, workQueue=workQueue,
+                      unitPoints=np.concatenate([unitPoints, newUnitPoints]) if design["paramRanges"] is not None else None, paramRanges=design["paramRanges"]);
 
 
 
@@ -138,50 +748,141 @@ def run_sweep(baseParams, paramNames, paramValueLists, numReps=1, numCores=None,
 #paramSetOverrides: Dictionaries defining the particular values which should be
 #   overwritten in the baseParams for each unique parameter set.
 #numReps: how many repeats to run for each unique parameter set. When set
-#   to None no 'rep=#' subdirectory is created.
+#   to None no 'rep=#' subdirectory is created. If an AdaptiveReps object, the
+#   repeats of each parameter set are run in waves until its estimate of the
+#   mean has converged (see AdaptiveReps).
 #numCores: How many CPU cores to use. When set to None no new processes are created
 #   and all work is done using the existing process.
 #verbose: prints feedback on queued and completed simulation runs.
-def run_param_sets(baseParams, paramSetNames, paramSetOverrides, numReps=1, numCores=None, verbose=True):
-    if numCores is None: #Single CPU core, no new processes created
-        outputStatuses = [];
-        for i in range(len(paramSetNames)):
-            #Create the full parameter set for the current set of overrides
-            params = baseParams.copy();
-            params.update(paramSetOverrides[i]);
-            params["outputDirectory"] = path.join(params["outputDirectory"], paramSetNames[i]);
-            if numReps is None: #Special case for when numReps is None (don't create an extra subdirectory)
-                outputStatuses.append(run_single(params));
-            else:
-                outputStatuses += run_reps(params, numReps, verbose=False);
-        return outputStatuses;
+#batched: If True the repeats of each parameter set are run together as one
+#   task (or one task per wave) using the batch engine (see run_batch). Has no
+#   effect if numReps is None.
+#seed: root seed shared by every run. If None the seed recorded in the sweep
+#   manifest is used when resuming, otherwise a new random seed. Each
+#   run's seedSpawnKey is [parameter set index, repeat number].
+#writeOutput, returnResults, runner, useResultCache, workQueue: see run_reps.
+def run_param_sets(baseParams, paramSetNames, paramSetOverrides, numReps=1, numCores=None, verbose=True, batched=False, seed=None, writeOutput=True, returnResults=False, runner=None, useResultCache=False, workQueue=None):
+    seed = get_root_seed(baseParams, seed, writeOutput);
+    baseParams = baseParams.copy();
+    ownsDataset = writeOutput != False and claim_dataset_directory(baseParams);
     
-    else: #Run on multiple CPUs
-        with ProcessPoolExecutor(max_workers=numCores) as executor:
-            processHandles = [];
-            for i in range(len(paramSetNames)):
-                #Create the full parameter set for the current set of overrides
-                params = baseParams.copy();
-                params.update(paramSetOverrides[i]);
-                params["outputDirectory"] = path.join(params["outputDirectory"], paramSetNames[i]);
-                
-                #Queue the simulations
-                if numReps is None: #Special case for when numReps is None (don't create an extra subdirectory)
-                    handle = executor.submit(run_single, params, verbose=False);
-                    if verbose:
-                        print("Queued parameter set:", paramSetNames[i]);
-                        handle.add_done_callback(lambda future,name=paramSetNames[i]:print("Completed running: "+str(name))); #Note: using an additional argument and providing a default value allows the lambda to capture by value instead of reference.
-                    processHandles.append(handle);
-                else: #more than one repeat: note we don't rely on run_reps here because we want all the processes to be in the same ProcessPoolExecutor to avoid excess wait times
-                    for r in range(numReps):
-                        repParams = params.copy();
-                        repParams["outputDirectory"] = path.join(params["outputDirectory"], "rep="+str(r));
-                        handle = executor.submit(run_single, repParams, verbose=False);
-                        if verbose:
-                            print("Queued parameter set:", path.join(paramSetNames[i], "rep="+str(r)));
-                            handle.add_done_callback(lambda future,name=paramSetNames[i]+" rep="+str(r) : print("Completed running: "+str(name))); #Note using an additional argument and providing a default value allows the lambda to capture by value instead of reference.
-                        processHandles.append(handle);
-            wait(processHandles);
-            #Get simulation return codes
-            outputStatuses = [ph.result() for ph in processHandles];
-            return outputStatuses;
+    #Create the full parameter set for each set of overrides
+    paramSetParamsList = [];
+    for i in range(len(paramSetNames)):
+        params = baseParams.copy();
+        params.update(paramSetOverrides[i]);
+        params["outputDirectory"] = path.join(params["outputDirectory"], paramSetNames[i]);
+        paramSetParamsList.append(params);
+    
+    runTasksOptions = {"numCores": numCores, "verbose": verbose and (numCores is not None or runner is not None or workQueue is not None), "writeOutput": writeOutput, "runner": runner,
+                       "manifestFilepath": get_sweep_manifest(baseParams, writeOutput), "useResultCache": useResultCache, "workQueue": workQueue};
+    if isinstance(numReps, AdaptiveReps):
+        outputResults = run_adaptive_reps(numReps, paramSetParamsList, paramSetNames, seed, batched, returnResults, runTasksOptions);
+    else:
+        #All the simulations are queued together (rather than using run_reps for
+        # each parameter set) to avoid excess wait times between parameter sets.
+        tasks = [];
+        for i, params in enumerate(paramSetParamsList):
+            tasks += make_rep_tasks(params, paramSetNames[i], i, None if numReps is None else range(numReps), seed, batched);
+        outputResults = run_tasks(tasks, returnResults=returnResults, **runTasksOptions);
+    if ownsDataset:
+        output_formats.consolidate_dataset(baseParams["datasetDirectory"]);
+    write_sweep_profile(baseParams, writeOutput);
+    return outputResults;
+
+
+
+#Returns the tasks (see run_tasks) to run repeats of a parameter set.
+#params: the parameter set, with its outputDirectory.
+#paramSetIndex: the parameter set's position in the sweep (see run_param_sets).
+#reps: the repeat numbers to run, or None for a single run in the parameter
+#   set's own directory (no 'rep=#' subdirectory).
+def make_rep_tasks(params, paramSetName, paramSetIndex, reps, seed, batched):
+    if reps is None:
+        params = params.copy();
+        set_seed(params, seed, [paramSetIndex]);
+        return [(paramSetName, run_single, (params,), {"overwriteSeed": seed, "verbose": False})];
+    
+    repParamsList = [];
+    for r in reps:
+        repParams = params.copy();
+        repParams["outputDirectory"] = path.join(params["outputDirectory"], "rep="+str(r));
+        set_seed(repParams, seed, [paramSetIndex, r]);
+        repParamsList.append(repParams);
+    if batched: #all the repeats are run as a single batch
+        return [(paramSetName+" (repeats "+str(reps[0])+"-"+str(reps[-1])+", batched)", run_batch, (repParamsList,), {"verbose": False})];
+    return [(path.join(paramSetName, "rep="+str(r)), run_single, (repParams,), {"overwriteSeed": seed, "verbose": False}) for r, repParams in zip(reps, repParamsList)];
+
+
+
+#Number of repeats to run for each parameter set in run_param_sets (or
+# run_sweep / run_design), decided as the repeats are run. Repeats are run in
+# waves (the same wave of every parameter set at once), and after each wave
+# extractorFunc (e.g. data_extractors.get_population_growth_rate, which must
+# return a number) is applied to every repeat of each parameter set. A
+# parameter set stops once the confidence interval of the mean of these values
+# is narrower than tolerance, or maxReps repeats have been run.
+#Repeats are numbered and seeded exactly as with a fixed number of repeats, so
+# the first N repeats are the same as those of a sweep with numReps=N.
+#tolerance: the largest acceptable width of the confidence interval.
+#relativeTolerance: if True tolerance is relative to the magnitude of the mean.
+#confidence: confidence level of the interval (see analysis_tools.get_confidence_interval).
+#minReps: number of repeats in the first wave (at least 2).
+#waveSize: number of repeats in each later wave.
+#maxReps: the largest number of repeats run for any parameter set.
+#Values which aren't finite (e.g. the growth rate of an extinct population)
+# are ignored, so parameter sets with fewer than 2 finite values never converge.
+class AdaptiveReps:
+    def __init__(self, extractorFunc=data_extractors.get_population_growth_rate, tolerance=0.001, relativeTolerance=False, confidence=0.95, minReps=3, waveSize=5, maxReps=50):
+        self.extractorFunc = extractorFunc;
+        self.tolerance = tolerance;
+        self.relativeTolerance = relativeTolerance;
+        self.confidence = confidence;
+        self.minReps = max(2, minReps);
+        self.waveSize = waveSize;
+        self.maxReps = maxReps;
+    
+    #Returns True if the confidence interval of the mean of values is narrow enough.
+    def has_converged(self, values):
+        low, high = analysis_tools.get_confidence_interval(values, self.confidence);
+        if np.isnan(low):
+            return False;
+        tolerance = self.tolerance*abs((low+high)/2) if self.relativeTolerance else self.tolerance;
+        return high-low < tolerance;
+    
+    #Returns the repeat numbers of the next wave, given the number run so far.
+    def get_next_wave(self, numRepsRun):
+        return range(numRepsRun, min(numRepsRun+(self.minReps if numRepsRun == 0 else self.waveSize), self.maxReps));
+
+
+#Runs the repeats of each parameter set in waves until they converge (see
+# AdaptiveReps). Called by run_param_sets, with the options for run_tasks.
+#Returns the results of every repeat, ordered by parameter set then repeat.
+def run_adaptive_reps(adaptiveReps, paramSetParamsList, paramSetNames, seed, batched, returnResults, runTasksOptions):
+    repResults = [[] for params in paramSetParamsList];
+    repValues = [[] for params in paramSetParamsList];
+    converged = [False]*len(paramSetParamsList);
+    while True:
+        tasks = [];
+        waveSizes = [];
+        for i, params in enumerate(paramSetParamsList):
+            wave = adaptiveReps.get_next_wave(len(repResults[i])) if converged[i] == False else range(0);
+            if len(wave) > 0:
+                tasks += make_rep_tasks(params, paramSetNames[i], i, wave, seed, batched);
+            waveSizes.append(len(wave));
+        if len(tasks) == 0:
+            break;
+        
+        #Results are kept (in memory) to apply the extractor to. Runs which
+        # were skipped (e.g. because they were already run) are read from disk.
+        results = iter(run_tasks(tasks, returnResults=True, **runTasksOptions));
+        for i, waveSize in enumerate(waveSizes):
+            for j in range(waveSize):
+                result = next(results);
+                repValues[i].append(adaptiveReps.extractorFunc(data_extractors.get_run_record(result)) if result.status in (status_codes.SUCCESSFUL, status_codes.SKIPPED) else np.nan);
+                repResults[i].append(result if returnResults else result.status);
+            if waveSize > 0:
+                converged[i] = adaptiveReps.has_converged(repValues[i]);
+        if runTasksOptions["verbose"]:
+            print(sum(converged), "of", len(converged), "parameter sets converged after", sum(len(results) for results in repResults), "runs");
+    return [result for results in repResults for result in results];
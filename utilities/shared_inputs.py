@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Broadcasts large arrays in the parameters of tasks run by worker processes
+# (see run_tools.run_tasks), e.g. a rate table passed as the value of the
+# mortalitySchedule parameter. Without this every task submitted to the pool
+# pickles its own copy of every array in its parameters, so a sweep of
+# thousands of runs sharing one large array copies it thousands of times.
+#Instead each array of at least minBroadcastBytes is written once to a file in
+# a broadcast directory (in /dev/shm where available, so it's held in shared
+# memory rather than written to disk), and replaced in the tasks by an
+# ArrayHandle naming the file. Workers load the file as a read-only memory map,
+# so every worker shares the same memory without copying the array. Results
+# returned by the workers have the handles in their params replaced by the
+# original arrays again.
+#The broadcast directory is removed when the tasks finish, or fail. If the
+# process running the tasks is killed before it can remove it, the directory is
+# removed by the next broadcast (see remove_stale_broadcasts).
+
+from os import path, makedirs, listdir, getpid, kill, access, W_OK;
+import atexit;
+import shutil;
+import tempfile;
+import itertools;
+import numpy as np;
+
+from utilities.run_results import RunResult;
+
+
+#Arrays smaller than this (in bytes) are pickled with their tasks as normal.
+minBroadcastBytes = 1 << 20;
+
+#Directory that broadcast directories are created in.
+broadcastRoot = "/dev/shm" if path.isdir("/dev/shm") and access("/dev/shm", W_OK) else tempfile.gettempdir();
+broadcastPrefix = "abm_broadcast_";
+
+#Number of broadcasts started by this process, used to name their directories.
+broadcastCounter = itertools.count();
+
+
+#Stands in for a broadcast array in the parameters of a task.
+class ArrayHandle:
+    def __init__(self, filepath, shape, dtype):
+        self.filepath = filepath;
+        self.shape = shape;
+        self.dtype = dtype;
+
+    #Returns the array as a read-only memory map.
+    def attach(self):
+        return np.load(self.filepath, mmap_mode="r");
+
+    def __repr__(self):
+        return "ArrayHandle("+repr(self.filepath)+", shape="+str(self.shape)+", dtype="+str(self.dtype)+")";
+
+
+#Returns value with every dictionary, list and tuple in it rebuilt by applying
+# replaceFunc to each item which isn't one of these containers.
+def replace_values(value, replaceFunc):
+    if isinstance(value, dict):
+        return {key: replace_values(item, replaceFunc) for key, item in value.items()};
+    if isinstance(value, (list, tuple)):
+        return type(value)(replace_values(item, replaceFunc) for item in value);
+    return replaceFunc(value);
+
+
+#Returns True if the process with the given ID is running.
+def is_process_running(pid):
+    try:
+        kill(pid, 0);
+    except ProcessLookupError:
+        return False;
+    except PermissionError: #running, but owned by another user
+        return True;
+    return True;
+
+
+#Removes broadcast directories left behind by processes which were killed
+# before they could remove them.
+def remove_stale_broadcasts():
+    for dirname in listdir(broadcastRoot):
+        if dirname.startswith(broadcastPrefix):
+            pid = dirname[len(broadcastPrefix):].split("_")[0];
+            if pid.isdigit() and is_process_running(int(pid)) == False:
+                shutil.rmtree(path.join(broadcastRoot, dirname), ignore_errors=True);
+
+
+#The arrays broadcast for one set of tasks. Can be used as a context manager,
+# which removes the broadcast directory on exit:
+# with shared_inputs.Broadcast() as broadcast:
+#     tasks = broadcast.share_tasks(tasks);
+#     ...submit tasks to workers, which call attach_task_args...
+#     results = broadcast.restore_results(results);
+class Broadcast:
+    def __init__(self):
+        self.directory = None;
+        self.handles = {}; #id(array) -> (array, ArrayHandle)
+        self.arrays = {}; #handle filepath -> array
+
+    #Returns the handle of a large array (writing it to the broadcast directory
+    # the first time it's seen), or value itself if it isn't a large array.
+    def share_value(self, value):
+        if isinstance(value, np.ndarray) == False or value.nbytes < minBroadcastBytes:
+            return value;
+        if id(value) not in self.handles:
+            if self.directory is None:
+                remove_stale_broadcasts();
+                self.directory = path.join(broadcastRoot, broadcastPrefix+str(getpid())+"_"+str(next(broadcastCounter)));
+                makedirs(self.directory);
+                atexit.register(self.close);
+            handle = ArrayHandle(path.join(self.directory, str(len(self.handles))+".npy"), value.shape, str(value.dtype));
+            np.save(handle.filepath, value);
+            self.handles[id(value)] = (value, handle);
+            self.arrays[handle.filepath] = value;
+        return self.handles[id(value)][1];
+
+    #Returns a copy of tasks (see run_tools.run_tasks) with every large array
+    # in their arguments replaced by a handle. Arrays which are the same object
+    # in several tasks are only broadcast once.
+    def share_tasks(self, tasks):
+        return [(name, function, replace_values(args, self.share_value), kwargs) for name, function, args, kwargs in tasks];
+
+    #Replaces the handles in the params of RunResults returned by the workers
+    # with the original arrays (in place). Returns results.
+    def restore_results(self, results):
+        restore = lambda value: self.arrays[value.filepath] if isinstance(value, ArrayHandle) else value;
+        for result in results:
+            for runResult in (result if isinstance(result, list) else [result]):
+                if isinstance(runResult, RunResult):
+                    runResult.params = replace_values(runResult.params, restore);
+        return results;
+
+    #Removes the broadcast directory. Workers must have finished with the arrays.
+    def close(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True);
+            atexit.unregister(self.close);
+            self.directory = None;
+
+    def __enter__(self):
+        return self;
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close();
+
+
+#Called by workers: returns the arguments of a task with each handle replaced by
+# its array (attached as a read-only memory map), and a function which replaces
+# these arrays in a RunResult's params with their handles again, so they aren't
+# copied back to the main process. attached is a dictionary of {filepath: array}
+# shared by the tasks in a chunk, so each array is only attached once.
+def attach_task_args(args, attached):
+    attachedHandles = {};
+    def attach(value):
+        if isinstance(value, ArrayHandle) == False:
+            return value;
+        if value.filepath not in attached:
+            attached[value.filepath] = value.attach();
+        attachedHandles[id(attached[value.filepath])] = value;
+        return attached[value.filepath];
+    def detach(value):
+        if isinstance(value, np.ndarray) and id(value) in attachedHandles:
+            return attachedHandles[id(value)];
+        return value;
+    def detach_results(results):
+        for runResult in (results if isinstance(results, list) else [results]):
+            if isinstance(runResult, RunResult):
+                runResult.params = replace_values(runResult.params, detach);
+        return results;
+    return replace_values(args, attach), detach_results;
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#Sampling designs for parameter sweeps. Instead of every combination of a list
+# of values for each parameter (run_tools.run_sweep), a design is a fixed number
+# of points scattered through a range for each parameter, so the number of runs
+# doesn't grow exponentially with the number of parameters swept.
+#Points are generated in the unit cube [0, 1)^d (one dimension per parameter)
+# then scaled to each parameter's range (see scale_points).
+#A design is run by run_tools.run_design / run_sampled_sweep: each point is a
+# parameter set named "point=<index>" in the sweep's root directory, and the
+# design itself is stored in sweep_design.json (see write_design). Points can be
+# added to a design later, e.g. by run_tools.refine_sweep, which places them
+# where the output changes fastest (see choose_refinement_points).
+#analysis_tools.extract_from_design reads the output of a design.
+
+from os import path;
+import json;
+import numpy as np;
+
+from utilities import output_formats;
+
+
+designFilename = "sweep_design.json";
+
+#Sobol direction numbers from Joe and Kuo (2008), "Constructing Sobol sequences
+# with better two-dimensional projections" (file new-joe-kuo-6.21201), for
+# dimensions 2 to 21. Each row is (s, a, m_1 ... m_s): the degree and
+# coefficients of the primitive polynomial, and the initial direction numbers.
+#The first dimension uses m_i = 1 for all i.
+joeKuoDirectionNumbers = [(1, 0, [1]),
+                          (2, 1, [1, 3]),
+                          (3, 1, [1, 3, 1]),
+                          (3, 2, [1, 1, 1]),
+                          (4, 1, [1, 1, 3, 3]),
+                          (4, 4, [1, 3, 5, 13]),
+                          (5, 2, [1, 1, 5, 5, 17]),
+                          (5, 4, [1, 1, 5, 5, 5]),
+                          (5, 7, [1, 1, 7, 11, 19]),
+                          (5, 11, [1, 1, 5, 1, 1]),
+                          (5, 13, [1, 1, 1, 3, 11]),
+                          (5, 14, [1, 3, 5, 5, 31]),
+                          (6, 1, [1, 3, 3, 9, 7, 49]),
+                          (6, 13, [1, 1, 1, 15, 21, 21]),
+                          (6, 16, [1, 3, 1, 13, 27, 49]),
+                          (6, 19, [1, 1, 1, 15, 7, 5]),
+                          (6, 22, [1, 3, 1, 15, 13, 25]),
+                          (6, 25, [1, 1, 5, 5, 19, 61]),
+                          (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+                          (7, 4, [1, 3, 7, 13, 13, 15, 69])];
+sobolBits = 32; #precision of the points (up to 2^32 points can be generated)
+
+
+#Returns the first numPoints points of the (unscrambled) Sobol sequence in
+# numDims dimensions, as a (numPoints, numDims) array in [0, 1).
+#skip: number of points to skip from the start of the sequence, so a design can
+#   be extended with the points that follow it.
+#Sobol points are most evenly spread when numPoints (and skip) are powers of 2.
+def sobol_sequence(numPoints, numDims, skip=0):
+    if numDims > len(joeKuoDirectionNumbers)+1:
+        raise ValueError("Sobol sequences are only available for up to "+str(len(joeKuoDirectionNumbers)+1)+" dimensions");
+    #Direction numbers, scaled to integers with sobolBits bits
+    directions = np.zeros((numDims, sobolBits), dtype=np.uint64);
+    directions[0] = [1 << (sobolBits-1-i) for i in range(sobolBits)];
+    for dim in range(1, numDims):
+        s, a, m = joeKuoDirectionNumbers[dim-1];
+        v = [m[i] << (sobolBits-1-i) for i in range(s)];
+        for i in range(s, sobolBits):
+            value = v[i-s] ^ (v[i-s] >> s);
+            for k in range(1, s):
+                if (a >> (s-1-k)) & 1:
+                    value ^= v[i-k];
+            v.append(value);
+        directions[dim] = v;
+
+    #Gray code construction: each point differs from the last by one direction number
+    points = np.zeros((numPoints, numDims), dtype=np.uint64);
+    x = np.zeros(numDims, dtype=np.uint64);
+    for n in range(skip+numPoints):
+        if n >= skip:
+            points[n-skip] = x;
+        lowestZeroBit = (~n & (n+1)).bit_length()-1;
+        x ^= directions[:, lowestZeroBit];
+    return points/float(1 << sobolBits);
+
+
+#Returns a Latin hypercube sample of numPoints points in numDims dimensions: each
+# dimension is split into numPoints equal intervals, and each interval contains
+# exactly one point.
+#rng: numpy random Generator.
+def latin_hypercube(numPoints, numDims, rng):
+    points = np.empty((numPoints, numDims));
+    for dim in range(numDims):
+        points[:, dim] = (rng.permutation(numPoints)+rng.random(numPoints))/numPoints;
+    return points;
+
+
+#Scales points in the unit cube to parameter values.
+#paramRanges: list of (low, high) for each dimension. If both are integers the
+#   parameter is treated as an integer (e.g. initialPopulationSize) and values
+#   are rounded.
+#Returns a list of lists of parameter values, one per point.
+def scale_points(unitPoints, paramRanges):
+    values = [];
+    for dim, (low, high) in enumerate(paramRanges):
+        if isinstance(low, (int, np.integer)) and isinstance(high, (int, np.integer)):
+            values.append([int(value) for value in np.floor(low+unitPoints[:, dim]*(high-low+1)).clip(low, high)]);
+        else:
+            values.append([float(value) for value in low+unitPoints[:, dim]*(high-low)]);
+    return [list(point) for point in zip(*values)];
+
+
+#Inverse of scale_points: returns the position of each point in the unit cube.
+def unscale_points(points, paramRanges):
+    points = np.asarray(points, dtype=float);
+    unitPoints = np.empty(points.shape);
+    for dim, (low, high) in enumerate(paramRanges):
+        isInteger = isinstance(low, (int, np.integer)) and isinstance(high, (int, np.integer));
+        unitPoints[:, dim] = (points[:, dim]+0.5-low)/(high-low+1) if isInteger else (points[:, dim]-low)/(high-low);
+    return unitPoints;
+
+
+#Chooses new points to add to a design, where they are most informative.
+#Each existing point is scored by how fast the output changes around it (the
+# largest difference in mean output to one of its nearest neighbours, divided by
+# the distance to it) and/or the standard deviation of the output across its
+# repeats. New points are then chosen greedily from random candidates, favouring
+# those near high scoring points and far from every existing (or already chosen)
+# point, so they fill in the regions where the output is least certain.
+#unitPoints: (numPoints, numDims) array of the existing points in the unit cube.
+#values: list containing a list of the values (one per repeat) at each point.
+#criterion: "gradient", "variance" or "both" (scores are normalised and added).
+#numCandidates: number of random candidates considered for each new point.
+#Returns a (numNewPoints, numDims) array of new points in the unit cube.
+def choose_refinement_points(unitPoints, values, numNewPoints, rng, criterion="both", numNeighbours=None, numCandidates=50):
+    unitPoints = np.asarray(unitPoints, dtype=float);
+    numPoints, numDims = unitPoints.shape;
+    means = np.array([np.nanmean(pointValues) if np.any(np.isfinite(pointValues)) else np.nan for pointValues in values]);
+    sds = np.array([np.nanstd(pointValues, ddof=1) if np.sum(np.isfinite(pointValues)) > 1 else 0.0 for pointValues in values]);
+
+    #Score existing points
+    scores = np.zeros(numPoints);
+    if criterion in ("gradient", "both") and numPoints > 1:
+        if numNeighbours is None:
+            numNeighbours = 2*numDims;
+        distances = np.sqrt(np.sum((unitPoints[:, None, :]-unitPoints[None, :, :])**2, axis=2));
+        np.fill_diagonal(distances, np.inf);
+        neighbours = np.argsort(distances, axis=1)[:, 0:min(numNeighbours, numPoints-1)];
+        rows = np.arange(numPoints)[:, None];
+        gradients = np.abs(means[:, None]-means[neighbours])/np.maximum(distances[rows, neighbours], 1e-12);
+        gradients = np.nan_to_num(np.max(gradients, axis=1), nan=0.0, posinf=0.0);
+        scores += gradients/np.max(gradients) if np.max(gradients) > 0 else 0;
+    if criterion in ("variance", "both"):
+        sds = np.nan_to_num(sds, nan=0.0);
+        scores += sds/np.max(sds) if np.max(sds) > 0 else 0;
+    elif criterion != "gradient":
+        raise ValueError("Unrecognised refinement criterion: "+str(criterion));
+    scores += 0.01; #so low scoring regions are still filled in eventually
+
+    #Greedily choose the best candidate
+    candidates = rng.random((numNewPoints*numCandidates, numDims));
+    candidateDistances = np.sqrt(np.sum((candidates[:, None, :]-unitPoints[None, :, :])**2, axis=2));
+    candidateScores = scores[np.argmin(candidateDistances, axis=1)];
+    nearestDistances = np.min(candidateDistances, axis=1);
+    newPoints = [];
+    for i in range(numNewPoints):
+        best = np.argmax(candidateScores*nearestDistances);
+        newPoints.append(candidates[best]);
+        nearestDistances = np.minimum(nearestDistances, np.sqrt(np.sum((candidates-candidates[best])**2, axis=1)));
+    return np.array(newPoints).reshape(numNewPoints, numDims);
+
+
+
+###Storing designs
+#A design is stored in its root directory as a JSON file containing:
+#paramNames: names of the parameters varied.
+#points: list of parameter values for each point (in paramNames order).
+#unitPoints: position of each point in the unit cube, or None if unknown.
+#paramRanges: (low, high) for each parameter, or None if not sampled from a range.
+#seed: the root seed used by every run in the design (see run_tools).
+#numReps: number of repeats of each point.
+
+#Returns the name of the parameter set (and directory) of a point in a design.
+def get_point_name(pointIndex):
+    return "point="+str(pointIndex);
+
+
+#Returns the design stored in rootDirectory, or None if there isn't one.
+def load_design(rootDirectory):
+    if path.exists(path.join(rootDirectory, designFilename)) == False:
+        return None;
+    with open(path.join(rootDirectory, designFilename), "r") as file:
+        return json.load(file);
+
+
+#Writes a design to rootDirectory. Arrays (e.g. unitPoints) are stored in full,
+# not as descriptions like large array parameters, so the design can be read back.
+def write_design(rootDirectory, design):
+    design = {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in design.items()};
+    output_formats.write_params_file(design, path.join(rootDirectory, designFilename));
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#A sweep manifest records the state of every run in a set of repeats or a
+# sweep, in a SQLite database in the sweep's root directory. It's used by
+# run_tools to resume an interrupted sweep: runs recorded as done are skipped
+# without looking for their output on disk, and runs which were queued or
+# running when the sweep was interrupted (or failed with an error) are re-run.
+#Each run is identified by its outputDirectory, relative to the manifest's
+# directory, and goes through the states:
+#   queued -> running -> done (or error)
+#Done runs also record the SHA-1 hash of their output file, so the output can
+# be checked against the manifest later (see verify_run).
+#The manifest also records the sweep's root seed, so a sweep started without a
+# seed is resumed with the same one (see run_tools.get_root_seed).
+#The database is opened for each update, so it can be shared by any number of
+# worker processes.
+
+from os import path;
+import sqlite3;
+import time;
+
+from utilities import output_formats;
+
+
+manifestFilename = "sweep_manifest.sqlite";
+
+QUEUED = "queued";
+RUNNING = "running";
+DONE = "done";
+ERROR = "error";
+
+
+#Returns the path of the manifest for the sweep with the given root directory.
+def get_manifest_filepath(rootDirectory):
+    return path.join(rootDirectory, manifestFilename);
+
+
+#Opens the manifest database, creating it if it doesn't exist.
+def connect(manifestFilepath):
+    connection = sqlite3.connect(manifestFilepath, timeout=60);
+    connection.execute("PRAGMA journal_mode=WAL");
+    connection.execute("CREATE TABLE IF NOT EXISTS runs (runPath TEXT PRIMARY KEY, state TEXT NOT NULL, contentHash TEXT, updated REAL NOT NULL)");
+    connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)");
+    return connection;
+
+
+#Returns the key used for outputDirectory: its path relative to the manifest,
+# so the sweep directory can be moved.
+def get_run_key(manifestFilepath, outputDirectory):
+    return "/".join(path.relpath(outputDirectory, path.dirname(manifestFilepath)).split(path.sep));
+
+
+#Returns a dictionary of {outputDirectory: state} for the given output
+# directories. Runs missing from the manifest are not included.
+def get_states(manifestFilepath, outputDirectories):
+    if path.exists(manifestFilepath) == False:
+        return {};
+    connection = connect(manifestFilepath);
+    try:
+        states = dict(connection.execute("SELECT runPath, state FROM runs").fetchall());
+    finally:
+        connection.close();
+    runKeys = {outputDirectory: get_run_key(manifestFilepath, outputDirectory) for outputDirectory in outputDirectories};
+    return {outputDirectory: states[runKey] for outputDirectory, runKey in runKeys.items() if runKey in states};
+
+
+#Sets the state of each directory in outputDirectories.
+#contentHash: hash of the run's output (for done runs).
+def set_states(manifestFilepath, outputDirectories, state, contentHash=None):
+    connection = connect(manifestFilepath);
+    try:
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO runs (runPath, state, contentHash, updated) VALUES (?, ?, ?, ?)",
+                                   [(get_run_key(manifestFilepath, outputDirectory), state, contentHash, time.time()) for outputDirectory in outputDirectories]);
+    finally:
+        connection.close();
+
+
+#Returns the root seed recorded in the manifest, or None if there isn't one.
+def get_root_seed(manifestFilepath):
+    if path.exists(manifestFilepath) == False:
+        return None;
+    connection = connect(manifestFilepath);
+    try:
+        row = connection.execute("SELECT value FROM settings WHERE name = 'rootSeed'").fetchone();
+    finally:
+        connection.close();
+    return int(row[0]) if row is not None else None;
+
+
+#Records the root seed of the sweep (seeds are up to 128 bits, so stored as text).
+def set_root_seed(manifestFilepath, seed):
+    connection = connect(manifestFilepath);
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('rootSeed', ?)", (str(int(seed)),));
+    finally:
+        connection.close();
+
+
+#Records that a run has finished and its output was written to outputFilepath.
+def set_done(manifestFilepath, outputDirectory, outputFilepath):
+    set_states(manifestFilepath, [outputDirectory], DONE, output_formats.hash_file(outputFilepath));
+
+
+#Returns True if a run is recorded as done, and its output file (if it has
+# its own, i.e. it hasn't since been consolidated into a sweep dataset) still
+# has the hash recorded in the manifest.
+def verify_run(manifestFilepath, outputDirectory):
+    connection = connect(manifestFilepath);
+    try:
+        row = connection.execute("SELECT state, contentHash FROM runs WHERE runPath = ?", (get_run_key(manifestFilepath, outputDirectory),)).fetchone();
+    finally:
+        connection.close();
+    if row is None or row[0] != DONE:
+        return False;
+    outputFilepath = output_formats.get_output_filepath(outputDirectory);
+    if path.basename(outputFilepath) == output_formats.datasetFilename:
+        return True;
+    return output_formats.hash_file(outputFilepath) == row[1];
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#A work queue for running simulations on several machines at once. The queue
+# is a SQLite database, normally in a directory shared by every machine (e.g. an
+# NFS mount). The coordinator (run_reps / run_sweep / run_param_sets called with
+# workQueue=queueFilepath, see run_tools.run_tasks) adds its tasks to the queue
+# and waits for them to finish. Any number of workers, started on any machine
+# with access to the shared directory, take tasks from the queue and run them:
+#   PYTHONPATH=. python3 -m utilities.work_queue path/to/queue.sqlite
+#Start one worker per core (each worker runs one task at a time). Output
+# directories must be on the shared file system, with the same paths on every
+# machine.
+#A worker claims a task by taking a lease on it, which it renews while the task
+# runs. If a worker dies its lease expires and the task is given to another
+# worker. Output is written atomically (see output_formats), so a task which is
+# run twice is harmless. A task whose lease has expired maxAttempts times (e.g.
+# one which crashes every worker that runs it) is marked as failed instead of
+# being given out again, so the coordinator reports it rather than waiting forever.
+#Tasks are stored as JSON: the name of the run_tools function (run_single or
+# run_batch) with its arguments. Large arrays in the arguments (e.g. a rate
+# table, see rate_schedules.py) are saved once to .npy files next to the queue
+# instead of being copied into every task (see store_array).
+
+from os import path, makedirs, getpid, replace;
+import sqlite3;
+import socket;
+import threading;
+import traceback;
+import argparse;
+import json;
+import time;
+import numpy as np;
+
+from utilities import output_formats;
+
+
+QUEUED = "queued";
+LEASED = "leased";
+DONE = "done";
+ERROR = "error";
+
+#run_tools functions that tasks can run.
+taskFunctionNames = ("run_single", "run_batch");
+
+#How long a worker's claim on a task lasts (in seconds) without being renewed.
+defaultLeaseSeconds = 120;
+#How many times a task can be claimed before it's marked as failed if its lease expires.
+defaultMaxAttempts = 3;
+
+
+#Opens the queue database, creating it if it doesn't exist.
+def connect(queueFilepath):
+    if path.dirname(queueFilepath) != "":
+        makedirs(path.dirname(queueFilepath), exist_ok=True);
+    connection = sqlite3.connect(queueFilepath, timeout=60, isolation_level=None);
+    connection.execute("CREATE TABLE IF NOT EXISTS tasks (taskId INTEGER PRIMARY KEY, name TEXT, spec TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, leaseExpires REAL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT)");
+    return connection;
+
+
+#Returns the directory holding the arrays of a queue's tasks (see store_array).
+def get_arrays_directory(queueFilepath):
+    return path.splitext(path.abspath(queueFilepath))[0]+"_arrays";
+
+
+#Saves an array to a .npy file in arraysDirectory, named by the hash of its
+# contents so each array is only saved once however many tasks use it. Returns
+# {"arrayFile": filepath}, which is stored in the task in place of the array
+# and loaded by workers as a read-only memory mapped array (see from_json_object).
+def store_array(array, arraysDirectory):
+    filepath = path.join(arraysDirectory, output_formats.describe_array(array)["array"]+".npy");
+    if path.exists(filepath) == False:
+        makedirs(arraysDirectory, exist_ok=True);
+        tempFilepath = output_formats.get_temp_filepath(filepath);
+        with open(tempFilepath, "wb") as file:
+            np.save(file, array);
+        replace(tempFilepath, filepath);
+    return {"arrayFile": filepath};
+
+
+#Converts numpy values in task arguments (e.g. from a sweep's parameter value
+# arrays) to the equivalent Python values. If arraysDirectory is given, arrays
+# with more than output_formats.maxStoredArraySize elements are saved there
+# instead (see store_array).
+def to_json_value(value, arraysDirectory=None):
+    if arraysDirectory is not None and isinstance(value, np.ndarray) and value.size > output_formats.maxStoredArraySize:
+        return store_array(value, arraysDirectory);
+    if hasattr(value, "tolist"):
+        return value.tolist();
+    raise TypeError("Task argument can't be stored in the work queue: "+repr(value));
+
+
+#Loads arrays saved by store_array when a task is read from the queue.
+def from_json_object(value):
+    if set(value) == {"arrayFile"}:
+        return np.load(value["arrayFile"], mmap_mode="r");
+    return value;
+
+
+#Adds tasks (tuples of (name, function, args, kwargs) as used by
+# run_tools.run_tasks) to the queue. Returns the ID of each task.
+def submit_tasks(queueFilepath, tasks):
+    connection = connect(queueFilepath);
+    try:
+        taskIds = [];
+        connection.execute("BEGIN IMMEDIATE");
+        for name, function, args, kwargs in tasks:
+            if function.__name__ not in taskFunctionNames:
+                raise ValueError("Only "+" and ".join(taskFunctionNames)+" tasks can be queued, not "+function.__name__);
+            spec = json.dumps({"function": function.__name__, "args": list(args), "kwargs": kwargs}, default=lambda value: to_json_value(value, get_arrays_directory(queueFilepath)));
+            taskIds.append(connection.execute("INSERT INTO tasks (name, spec, state) VALUES (?, ?, ?)", (str(name), spec, QUEUED)).lastrowid);
+        connection.execute("COMMIT");
+    finally:
+        connection.close();
+    return taskIds;
+
+
+#Marks tasks whose lease has expired after maxAttempts claims as failed.
+#connection must be in a transaction.
+def fail_abandoned_tasks(connection, maxAttempts):
+    connection.execute("UPDATE tasks SET state = ?, result = 'Abandoned after ' || attempts || ' attempts: the lease expired every time, so the task may be crashing its workers', leaseExpires = NULL WHERE state = ? AND leaseExpires < ? AND attempts >= ?",
+                       (ERROR, LEASED, time.time(), maxAttempts));
+
+
+#Waits for the tasks with the given IDs to finish and returns their results (the
+# value returned by the task function). Raises a RuntimeError if any task failed,
+# including tasks abandoned after maxAttempts attempts (see claim_task).
+#pollInterval: seconds between checks of the queue.
+#verbose: print the number of finished tasks whenever it changes.
+def wait_for_tasks(queueFilepath, taskIds, pollInterval=1.0, verbose=False, maxAttempts=defaultMaxAttempts):
+    taskIdSet = set(taskIds);
+    results = {};
+    numDoneReported = 0;
+    while len(results) < len(taskIds):
+        connection = connect(queueFilepath);
+        try:
+            connection.execute("BEGIN IMMEDIATE");
+            fail_abandoned_tasks(connection, maxAttempts);
+            connection.execute("COMMIT");
+            rows = connection.execute("SELECT taskId, name, state, result FROM tasks WHERE taskId BETWEEN ? AND ? AND state IN (?, ?)", (min(taskIds), max(taskIds), DONE, ERROR)).fetchall();
+        finally:
+            connection.close();
+        for taskId, name, state, result in rows:
+            if taskId not in taskIdSet:
+                continue;
+            if state == ERROR:
+                raise RuntimeError("Task "+str(name)+" failed in the work queue:\n"+str(result));
+            results[taskId] = json.loads(result);
+        if verbose and len(results) != numDoneReported:
+            numDoneReported = len(results);
+            print(numDoneReported, "of", len(taskIds), "queued tasks completed");
+        if len(results) < len(taskIds):
+            time.sleep(pollInterval);
+    return [results[taskId] for taskId in taskIds];
+
+
+#Claims the next task which is queued, or whose lease has expired. Returns
+# (taskId, name, spec) or None if there is no task to claim.
+#maxAttempts: tasks whose lease has expired after this many claims are marked
+#   as failed instead (see fail_abandoned_tasks).
+def claim_task(queueFilepath, worker, leaseSeconds=defaultLeaseSeconds, maxAttempts=defaultMaxAttempts):
+    connection = connect(queueFilepath);
+    try:
+        connection.execute("BEGIN IMMEDIATE");
+        fail_abandoned_tasks(connection, maxAttempts);
+        row = connection.execute("SELECT taskId, name, spec FROM tasks WHERE state = ? OR (state = ? AND leaseExpires < ?) ORDER BY taskId LIMIT 1", (QUEUED, LEASED, time.time())).fetchone();
+        if row is not None:
+            connection.execute("UPDATE tasks SET state = ?, worker = ?, leaseExpires = ?, attempts = attempts + 1 WHERE taskId = ?", (LEASED, worker, time.time()+leaseSeconds, row[0]));
+        connection.execute("COMMIT");
+    finally:
+        connection.close();
+    return None if row is None else (row[0], row[1], json.loads(row[2], object_hook=from_json_object));
+
+
+#Extends a worker's lease on a task. Returns False if the worker no longer
+# holds the lease (it expired and the task was given to another worker).
+def renew_lease(queueFilepath, taskId, worker, leaseSeconds=defaultLeaseSeconds):
+    connection = connect(queueFilepath);
+    try:
+        with connection:
+            updated = connection.execute("UPDATE tasks SET leaseExpires = ? WHERE taskId = ? AND state = ? AND worker = ?", (time.time()+leaseSeconds, taskId, LEASED, worker)).rowcount;
+    finally:
+        connection.close();
+    return updated == 1;
+
+
+#Records the result of a task (state is DONE or ERROR), if the worker still
+# holds its lease.
+def finish_task(queueFilepath, taskId, worker, state, result):
+    connection = connect(queueFilepath);
+    try:
+        with connection:
+            connection.execute("UPDATE tasks SET state = ?, result = ?, leaseExpires = NULL WHERE taskId = ? AND state = ? AND worker = ?", (state, result, taskId, LEASED, worker));
+    finally:
+        connection.close();
+
+
+#Renews a worker's lease on a task every leaseSeconds/3 seconds until stopped.
+class LeaseKeeper(threading.Thread):
+    def __init__(self, queueFilepath, taskId, worker, leaseSeconds):
+        super().__init__(daemon=True);
+        self.queueFilepath, self.taskId, self.worker, self.leaseSeconds = queueFilepath, taskId, worker, leaseSeconds;
+        self.stopped = threading.Event();
+
+    def run(self):
+        while self.stopped.wait(self.leaseSeconds/3) == False:
+            renew_lease(self.queueFilepath, self.taskId, self.worker, self.leaseSeconds);
+
+    def stop(self):
+        self.stopped.set();
+        self.join();
+
+
+#Runs tasks from the queue until there are none left.
+#worker: name of the worker, recorded against the tasks it claims. By default
+#   the host name and process ID.
+#idleTimeout: how long to wait (in seconds) for new tasks when the queue is
+#   empty before returning. If None the worker waits forever.
+#pollInterval: seconds between checks for new tasks while the queue is empty.
+#maxAttempts: see claim_task.
+#Returns the number of tasks run.
+def run_worker(queueFilepath, worker=None, leaseSeconds=defaultLeaseSeconds, idleTimeout=None, pollInterval=1.0, verbose=False, maxAttempts=defaultMaxAttempts):
+    from utilities import run_tools; #imported here as run_tools also uses this module
+    if worker is None:
+        worker = socket.gethostname()+":"+str(getpid());
+    numTasksRun = 0;
+    idleSince = time.time();
+    while True:
+        task = claim_task(queueFilepath, worker, leaseSeconds, maxAttempts);
+        if task is None:
+            if idleTimeout is not None and time.time()-idleSince >= idleTimeout:
+                return numTasksRun;
+            time.sleep(pollInterval);
+            continue;
+
+        taskId, name, spec = task;
+        if verbose:
+            print(worker, "running", name);
+        leaseKeeper = LeaseKeeper(queueFilepath, taskId, worker, leaseSeconds);
+        leaseKeeper.start();
+        try:
+            result = getattr(run_tools, spec["function"])(*spec["args"], **spec["kwargs"]);
+            state, result = DONE, json.dumps(result, default=to_json_value);
+        except Exception:
+            state, result = ERROR, traceback.format_exc();
+        finally:
+            leaseKeeper.stop();
+        finish_task(queueFilepath, taskId, worker, state, result);
+        numTasksRun += 1;
+        idleSince = time.time();
+
+
+#Command line entry point for starting a worker.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simulation tasks from a work queue (see utilities/work_queue.py).");
+    parser.add_argument("queueFilepath", help="path of the work queue database");
+    parser.add_argument("--worker", default=None, help="name of this worker (default: host name and process ID)");
+    parser.add_argument("--lease", type=float, default=defaultLeaseSeconds, help="lease length in seconds");
+    parser.add_argument("--idle-timeout", type=float, default=None, help="exit after this many seconds without a task (default: never)");
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between checks for new tasks");
+    parser.add_argument("--max-attempts", type=int, default=defaultMaxAttempts, help="fail a task instead of retrying it once its lease has expired this many times");
+    parser.add_argument("--verbose", action="store_true");
+    args = parser.parse_args(argv);
+    numTasksRun = run_worker(args.queueFilepath, worker=args.worker, leaseSeconds=args.lease, idleTimeout=args.idle_timeout, pollInterval=args.poll_interval, verbose=args.verbose, maxAttempts=args.max_attempts);
+    if args.verbose:
+        print(numTasksRun, "tasks run");
+
+
+if __name__ == "__main__":
+    main();